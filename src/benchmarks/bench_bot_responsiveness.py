@@ -0,0 +1,91 @@
+"""
+Load test for bot responsiveness - Замер отзывчивости бота во время формирования отчета
+
+Пока один пользователь формирует долгий отчет по продажам на фейковом API, другие
+диалоги присылают сообщения каждые interval секунд. Замеряется задержка их обработки
+event loop при формировании отчета прямо в обработчике (inline) и в пуле ReportRunner.
+Запуск из каталога src:
+    python -m benchmarks.bench_bot_responsiveness
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+import requests
+
+from benchmarks.fake_api import FakeWBServer, FakeWBState
+
+
+async def other_conversations(users: int, interval: float, stop: asyncio.Event) -> list:
+    """Сообщения других пользователей - задержка между поступлением и обработкой"""
+    delays = []
+
+    async def conversation():
+        while not stop.is_set():
+            sent = time.perf_counter()
+            await asyncio.sleep(interval)
+            # обработчик вызывается, когда event loop освободился
+            delays.append(time.perf_counter() - sent - interval)
+
+    await asyncio.gather(*(conversation() for _ in range(users)))
+    return delays
+
+
+async def run(mode: str, request, users: int, interval: float):
+    from bot.reports import ReportRunner, build_report
+
+    runner = ReportRunner()
+    stop = asyncio.Event()
+    background = asyncio.create_task(other_conversations(users, interval, stop))
+    await asyncio.sleep(interval * 2)
+    start = time.perf_counter()
+    if mode == 'inline':
+        # прежнее поведение - синхронная выгрузка прямо в обработчике
+        build_report(request)
+    else:
+        await runner.run(request.user_id, build_report, request)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    delays = await background
+    runner.shutdown()
+    return elapsed, delays
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='Bot responsiveness load test')
+    args_parser.add_argument('--offices', type=int, default=30)
+    args_parser.add_argument('--latency', type=float, default=0.03, help='Fake API latency per request, seconds')
+    args_parser.add_argument('--users', type=int, default=20, help='Other conversations')
+    args_parser.add_argument('--interval', type=float, default=0.05, help='Message interval, seconds')
+    args_parser.add_argument('--date_from', type=str, default='2023-07-01')
+    args_parser.add_argument('--date_to', type=str, default='2023-09-30')
+    args = args_parser.parse_args()
+    logging.disable(logging.ERROR)
+
+    state = FakeWBState(offices=args.offices, latency=args.latency)
+    with FakeWBServer(state) as server, tempfile.TemporaryDirectory() as workdir:
+        # адреса API задаются через окружение до импорта модулей парсера
+        os.environ['BASE_URL_V1'] = f'{server.url}/api/v1/franchise'
+        os.environ['BASE_URL_V2'] = f'{server.url}/api/v2/franchise'
+        os.environ['OPERATIONS_URL'] = f'{server.url}/api/v1/franchise/payslip'
+        from bot.reports import ReportRequest
+
+        os.chdir(workdir)
+        os.makedirs('sales_data')
+        request = ReportRequest(user_id=1, chat_id=1, phone='79000000000', report_type='sales',
+                                date_from=args.date_from, date_to=args.date_to, session=requests.Session())
+        print(f"{'mode':>8} {'report s':>9} {'messages':>9} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        for mode in ('inline', 'runner'):
+            elapsed, delays = asyncio.run(run(mode, request, args.users, args.interval))
+            delays.sort()
+            p99 = delays[int(len(delays) * 0.99) - 1] if delays else 0
+            print(f'{mode:>8} {elapsed:>9.2f} {len(delays):>9} {statistics.median(delays) * 1000:>8.1f} '
+                  f'{p99 * 1000:>8.1f} {delays[-1] * 1000:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Benchmark for columnar batches - Сравнение строк продаж с пачками по колонкам
+
+Продажи офисов по дням хранятся тремя способами: объекты с __dict__ (прежний SaleData),
+объекты SaleData со __slots__ и пачки SaleBatch по офисам. Для каждого способа
+замеряются память (tracemalloc), время заполнения, записи csv и суммирования выручки
+по офисам. csv из строк и из пачек сравниваются побайтно.
+Запуск из каталога src:
+    python -m benchmarks.bench_columnar_batches
+"""
+import argparse
+import gc
+import io
+import os
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+os.environ.setdefault('ADMINS', '0')
+
+
+class DictSaleData:
+    """Прежний SaleData: атрибуты в __dict__ каждого объекта"""
+    def __init__(self, **fields):
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+def iter_payload(offices: int, days: int):
+    """Значения строк в порядке колонок, как после разбора ответа API"""
+    start = datetime(2023, 1, 1)
+    for office_id in range(offices):
+        name = f'ПВЗ {office_id}, ул. Ленина, д. {office_id % 90 + 1}'
+        for day in range(days):
+            n = office_id * days + day
+            yield (office_id, name, start + timedelta(days=day), n % 50, n % 7, n * 3, n % 700, n * 2, n % 900,
+                   n % 30, 4.5 + n % 5 / 10, 3.5, n % 40, 0)
+
+
+def build(mode: str, offices: int, days: int):
+    from parser.api import SaleBatch, SaleData
+
+    names = list(SaleBatch.FIELDS)
+    if mode == 'dict':
+        return [DictSaleData(**dict(zip(names, values))) for values in iter_payload(offices, days)]
+    if mode == 'slots':
+        return [SaleData(**dict(zip(names, values))) for values in iter_payload(offices, days)]
+    # одна пачка на офис с общим словарем названий, как в ParserWB.iter_sales_batches
+    categories = {}
+    batches = []
+    builder = SaleBatch.builder(categories)
+    for values in iter_payload(offices, days):
+        builder.append(*values)
+        if len(builder) == days:
+            batches.append(builder.build())
+    return batches
+
+
+def write_csv(mode: str, data) -> bytes:
+    from parser.api import ParserWB, SaleBatch
+    from parser.column_names import sale_data_column_names_mapping
+
+    parser = ParserWB.__new__(ParserWB)
+    buffer = io.BytesIO()
+    if mode == 'batches':
+        parser.save_batches_to_csv(data, buffer, column_names_mapings=sale_data_column_names_mapping,
+                                   columns=list(SaleBatch.FIELDS))
+    else:
+        parser.save_to_csv(data, buffer, column_names_mapings=sale_data_column_names_mapping)
+    return buffer.getvalue()
+
+
+def proceeds_by_office(mode: str, data) -> dict:
+    import numpy as np
+
+    if mode != 'batches':
+        totals = {}
+        for sale in data:
+            totals[sale.office_id] = totals.get(sale.office_id, 0) + sale.proceeds
+        return totals
+    office_ids = np.concatenate([batch.column('office_id') for batch in data])
+    proceeds = np.concatenate([batch.column('proceeds') for batch in data])
+    offices, inverse = np.unique(office_ids, return_inverse=True)
+    return dict(zip(offices.tolist(), np.bincount(inverse, weights=proceeds).astype(np.int64).tolist()))
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='Columnar batches benchmark')
+    args_parser.add_argument('--offices', type=int, default=100)
+    args_parser.add_argument('--days', type=int, default=365)
+    args = args_parser.parse_args()
+    import logging
+    logging.disable(logging.INFO)
+
+    print(f'{args.offices} offices x {args.days} days = {args.offices * args.days} rows')
+    print(f"{'mode':>8} {'memory MB':>10} {'build s':>8} {'csv s':>7} {'sum s':>7}")
+    contents = {}
+    totals = {}
+    for mode in ('dict', 'slots', 'batches'):
+        gc.collect()
+        tracemalloc.start()
+        start = time.perf_counter()
+        data = build(mode, args.offices, args.days)
+        build_seconds = time.perf_counter() - start
+        memory_mb = tracemalloc.get_traced_memory()[0] / 2 ** 20
+        tracemalloc.stop()
+        start = time.perf_counter()
+        contents[mode] = write_csv(mode, data)
+        csv_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        totals[mode] = proceeds_by_office(mode, data)
+        sum_seconds = time.perf_counter() - start
+        print(f'{mode:>8} {memory_mb:>10.1f} {build_seconds:>8.2f} {csv_seconds:>7.2f} {sum_seconds:>7.3f}')
+        del data
+    print(f"same csv: {contents['slots'] == contents['batches'] == contents['dict']}, "
+          f"same totals: {totals['slots'] == totals['batches'] == totals['dict']}")
+
+
+if __name__ == '__main__':
+    main()
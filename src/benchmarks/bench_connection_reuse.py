@@ -0,0 +1,56 @@
+"""
+Benchmark for HTTP connection reuse - Замер переиспользования соединений между отчетами
+
+Несколько отчетов подряд загружают продажи по офисам: с новой requests.Session на каждый
+отчет (как при создании сессии на каждую авторизацию) и с сессией аккаунта из
+SessionRegistry. Считаются соединения, принятые фейковым API.
+Запуск из каталога src:
+    python -m benchmarks.bench_connection_reuse
+"""
+import argparse
+import logging
+import time
+
+import requests
+
+from benchmarks.fake_api import FakeWBServer, FakeWBState
+
+
+def run(mode: str, reports: int, offices: int, workers: int, latency: float):
+    from parser.api import ParserWB
+    from parser.sessions import SessionRegistry
+
+    state = FakeWBState(offices=offices, latency=latency)
+    registry = SessionRegistry(pool_size=workers)
+    with FakeWBServer(state) as server:
+        start = time.perf_counter()
+        for _ in range(reports):
+            session = requests.Session() if mode == 'new session' else registry.session('79000000000')
+            parser = ParserWB(session, max_workers=workers)
+            parser.base_url_v1 = f'{server.url}/api/v1/franchise'
+            parser.base_url_v2 = f'{server.url}/api/v2/franchise'
+            parser.fetch_offices()
+            rows = sum(1 for _ in parser.iter_sales(date_from='2023-09-01', date_to='2023-09-30'))
+            assert rows == offices * 30
+        elapsed = time.perf_counter() - start
+    registry.close()
+    return elapsed, sum(state.requests.values()), state.connections
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='HTTP connection reuse benchmark')
+    args_parser.add_argument('--reports', type=int, default=10)
+    args_parser.add_argument('--offices', type=int, default=20)
+    args_parser.add_argument('--workers', type=int, default=8)
+    args_parser.add_argument('--latency', type=float, default=0.01, help='Fake API latency per request, seconds')
+    args = args_parser.parse_args()
+    logging.disable(logging.INFO)
+
+    print(f"{'mode':>12} {'seconds':>10} {'requests':>10} {'connections':>12}")
+    for mode in ('new session', 'registry'):
+        elapsed, requests_count, connections = run(mode, args.reports, args.offices, args.workers, args.latency)
+        print(f'{mode:>12} {elapsed:>10.3f} {requests_count:>10} {connections:>12}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark for streaming csv writer - Сравнение потоковой записи csv с прежней записью через pandas
+
+Каждый замер выполняется в отдельном процессе, чтобы пиковый RSS не смешивался.
+Запуск из каталога src:
+    python -m benchmarks.bench_csv_writer
+"""
+import argparse
+import filecmp
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault('ADMINS', '0')
+
+
+def iter_rows(count: int):
+    from parser.api import SaleData
+
+    start = datetime(2023, 1, 1)
+    for n in range(count):
+        yield SaleData(office_id=n % 100, name=f'Офис {n % 100}', date=start + timedelta(days=n // 100 % 365),
+                       sale_sum=n * 3, sale_count=n % 50, return_sum=n % 700, return_count=n % 7, proceeds=n * 2,
+                       amount=n % 900, bags_sum=n % 30, office_rating=4.5 + n % 5 / 10, percent=3.5,
+                       office_rating_sum=n % 40, supplier_return_sum=0)
+
+
+def pandas_save_to_csv(data, filename, column_names_mapings):
+    """Прежняя реализация ParserWB.save_to_csv для плоских данных"""
+    import pandas as pd
+
+    data_to_save = [item.to_dict() for item in data]
+    df = pd.DataFrame(data_to_save)
+    df.rename(columns=column_names_mapings, inplace=True)
+    df.to_csv(filename, index=False)
+
+
+def run_one(mode: str, rows: int, filename: str):
+    import logging
+    from parser.api import ParserWB
+    from parser.column_names import sale_data_column_names_mapping
+
+    logging.disable(logging.INFO)
+    start = time.perf_counter()
+    if mode == 'pandas':
+        pandas_save_to_csv(iter_rows(rows), filename, sale_data_column_names_mapping)
+    else:
+        ParserWB.__new__(ParserWB).save_to_csv(iter_rows(rows), filename, sale_data_column_names_mapping)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss в Linux указывается в килобайтах
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({'seconds': elapsed, 'peak_mb': peak_mb}))
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='CSV writer benchmark')
+    args_parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    args_parser.add_argument('--run', nargs=3, metavar=('MODE', 'ROWS', 'FILENAME'), help=argparse.SUPPRESS)
+    args = args_parser.parse_args()
+    if args.run:
+        mode, rows, filename = args.run
+        return run_one(mode, int(rows), filename)
+
+    print(f"{'rows':>10} {'mode':>10} {'seconds':>10} {'peak MB':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            files = {}
+            for mode in ('pandas', 'streaming'):
+                files[mode] = os.path.join(tmp, f'{mode}_{rows}.csv')
+                output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_csv_writer', '--run', mode,
+                                         str(rows), files[mode]], capture_output=True, text=True, check=True)
+                result = json.loads(output.stdout.strip().splitlines()[-1])
+                print(f"{rows:>10} {mode:>10} {result['seconds']:>10.2f} {result['peak_mb']:>10.1f}")
+            identical = filecmp.cmp(files['pandas'], files['streaming'], shallow=False)
+            print(f"{rows:>10} {'identical':>10} {str(identical):>10}")
+
+
+if __name__ == '__main__':
+    main()
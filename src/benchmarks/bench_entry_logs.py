@@ -0,0 +1,49 @@
+"""
+Benchmark for entry log fan-out - Замер получения журналов входов сотрудников
+
+Фейковый FastAPI сервис отвечает с задержкой и инвалидирует токен посреди выгрузки.
+Проверяется, что все сотрудники получены, а токен обновлен один раз на каждое истечение.
+Запуск из каталога src:
+    python -m benchmarks.bench_entry_logs
+"""
+import argparse
+import logging
+import time
+
+from benchmarks.fake_api import FakeEntryLogHandler, FakeEntryLogState, FakeWBServer
+
+
+def run(employees: int, workers: int, latency: float, expire_after: int):
+    from parser.auth_api import AuthApi
+
+    state = FakeEntryLogState(latency=latency, expire_after=expire_after)
+    phones = [f'7900{i:07d}' for i in range(employees)]
+    with FakeWBServer(state, handler=FakeEntryLogHandler) as server:
+        api = AuthApi(max_workers=workers)
+        api.token_url = f'{server.url}/api/get_token'
+        api.employee_url = f'{server.url}/api/employee-plugin-data'
+        api.get_token()
+        start = time.perf_counter()
+        result = api.get_employees_data(phones)
+        elapsed = time.perf_counter() - start
+    missing = sum(1 for phone in phones if not result.get(phone))
+    return elapsed, missing, state.token_requests - 1, state.unauthorized
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='Entry log fan-out benchmark')
+    args_parser.add_argument('--employees', type=int, default=300)
+    args_parser.add_argument('--workers', type=int, nargs='+', default=[1, 16, 32])
+    args_parser.add_argument('--latency', type=float, default=0.02)
+    args_parser.add_argument('--expire_after', type=int, default=200, help='Token expires after N data requests')
+    args = args_parser.parse_args()
+    logging.disable(logging.ERROR)
+
+    print(f"{'workers':>8} {'seconds':>8} {'missing':>8} {'refreshes':>10} {'401s':>6}")
+    for workers in args.workers:
+        elapsed, missing, refreshes, unauthorized = run(args.employees, workers, args.latency, args.expire_after)
+        print(f'{workers:>8} {elapsed:>8.2f} {missing:>8} {refreshes:>10} {unauthorized:>6}')
+
+
+if __name__ == '__main__':
+    main()
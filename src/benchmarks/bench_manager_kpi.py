@@ -0,0 +1,179 @@
+"""
+Benchmark for manager KPIs - Замер расчета KPI менеджеров
+
+Показатели сотрудников по дням считаются тремя способами: перебором операций из
+fetch_employee_data (как при ручной обработке), группировкой pandas и матрицей
+сотрудник x день (parser.kpi.EmployeeDayMatrix). Результаты сравниваются между собой.
+Затем отчет KPI строится из API и из хранилища на фейковом API, csv сравниваются побайтно.
+Запуск из каталога src:
+    python -m benchmarks.bench_manager_kpi
+"""
+import argparse
+import io
+import logging
+import os
+import tempfile
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+# utils.env требует список админов при импорте
+os.environ.setdefault('ADMINS', '0')
+
+WINDOW = 7
+
+
+def make_batch(managers: int, date_from: date, days: int, seed: int = 1):
+    """Пачка операций: сотрудник работает примерно 4 дня из 5"""
+    from parser.api import EmployeeOperationsBatch
+
+    random = np.random.default_rng(seed)
+    builder = EmployeeOperationsBatch.builder({})
+    for employee_id in range(1, managers + 1):
+        worked = np.flatnonzero(random.random(days) < 0.8)
+        counts = random.integers(0, 300, size=(len(worked), 5)).tolist()
+        for day, (on_place, returns, return_sum, sales, sale_sum) in zip(worked.tolist(), counts):
+            builder.append(employee_id, (date_from + timedelta(days=day)).isoformat(), on_place, returns % 20,
+                           return_sum * 10, sales, sale_sum * 100, None)
+    return builder.build()
+
+
+def python_kpis(managers_data, date_from: date, days: int):
+    """Перебор операций по сотрудникам и дням"""
+    result = {}
+    for employee in managers_data:
+        daily = [0] * days
+        totals = {'on_place_cnt': 0, 'return_count': 0, 'sale_count': 0, 'sale_sum': 0}
+        shifts = 0
+        for operation in employee['operations']:
+            shifts += 1
+            for name in totals:
+                totals[name] += getattr(operation, name)
+            daily[(date.fromisoformat(operation.date) - date_from).days] = operation.sale_sum
+        best = max(sum(daily[max(0, day - WINDOW + 1):day + 1]) for day in range(days))
+        result[employee['employee_id']] = (shifts, totals['sale_sum'], totals['sale_sum'] / shifts,
+                                           totals['return_count'] / totals['sale_count'] if totals['sale_count']
+                                           else float('nan'), best)
+    return result
+
+
+def pandas_kpis(batch, date_from: date, days: int):
+    """Группировка pandas по сотрудникам и скользящее окно по дням"""
+    import pandas as pd
+
+    frame = pd.DataFrame({'employee_id': batch.column('employee_id'), 'date': batch.column('date'),
+                          'return_count': batch.column('return_count'), 'sale_count': batch.column('sale_count'),
+                          'sale_sum': batch.column('sale_sum')})
+    grouped = frame.groupby('employee_id', sort=False)
+    totals = grouped[['return_count', 'sale_count', 'sale_sum']].sum()
+    shifts = grouped.size()
+    daily = frame.pivot_table(index='employee_id', columns='date', values='sale_sum', aggfunc='sum', fill_value=0)
+    daily = daily.reindex(columns=pd.date_range(date_from, periods=days), fill_value=0)
+    best = daily.T.rolling(WINDOW, min_periods=1).sum().max()
+    return {employee_id: (shifts[employee_id], totals.at[employee_id, 'sale_sum'],
+                          totals.at[employee_id, 'sale_sum'] / shifts[employee_id],
+                          totals.at[employee_id, 'return_count'] / totals.at[employee_id, 'sale_count']
+                          if totals.at[employee_id, 'sale_count'] else float('nan'), best[employee_id])
+            for employee_id in shifts.index}
+
+
+def matrix_kpis(batch, date_from: date, date_to: date):
+    from parser.kpi import EmployeeDayMatrix
+
+    matrix = EmployeeDayMatrix.from_batches([batch], date_from, date_to)
+    kpis = matrix.kpis(WINDOW)
+    return matrix, {employee_id: values for employee_id, values in zip(matrix.employee_ids.tolist(), zip(
+        kpis['shifts'].tolist(), kpis['sale_sum'].tolist(), kpis['sale_sum_per_shift'].tolist(),
+        kpis['return_rate'].tolist(), kpis['best_window_sale_sum'].tolist()))}
+
+
+def same_kpis(first: dict, second: dict) -> bool:
+    return first.keys() == second.keys() and all(
+        np.allclose(np.array(first[key], dtype=float), np.array(second[key], dtype=float), equal_nan=True)
+        for key in first)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def compare_reports(date_from: date, date_to: date):
+    """Отчет KPI из API и из хранилища на фейковом API"""
+    from sqlalchemy import create_engine
+    from benchmarks.fake_api import FakeWBServer, FakeWBState, make_parser
+    from db.reports import WarehouseReports
+    from db.warehouse import Warehouse
+    from parser.employees import EmployeeDirectory
+    from parser.kpi import EmployeeDayMatrix
+
+    state = FakeWBState(offices=5, employees=50, latency=0)
+    with tempfile.TemporaryDirectory() as directory, FakeWBServer(state) as server:
+        contents = []
+        for mode in ('api', 'warehouse'):
+            parser = make_parser(server)
+            parser.fetch_offices()
+            parser.fetch_employees()
+            buffer = io.BytesIO()
+            staff = EmployeeDirectory(parser.employees)
+            if mode == 'api':
+                batches = parser.iter_employee_operation_batches(date_from=date_from, date_to=date_to)
+                EmployeeDayMatrix.from_batches(batches, date_from, date_to, staff.ids()).write_kpi_csv(buffer, staff)
+                # та же матрица из результата fetch_employee_data
+                from_data = EmployeeDayMatrix.from_employee_data(
+                    parser.fetch_employee_data(date_from=date_from, date_to=date_to), date_from, date_to, staff.ids())
+                data_buffer = io.BytesIO()
+                from_data.write_kpi_csv(data_buffer, staff)
+                contents.append(data_buffer.getvalue())
+            else:
+                reports = WarehouseReports(Warehouse(create_engine(
+                    f"sqlite:///{os.path.join(directory, 'warehouse.db')}")))
+                reports.write_manager_kpis(parser, date_from, date_to, buffer)
+            contents.append(buffer.getvalue())
+    return contents[0].count(b'\n') - 1, all(content == contents[0] for content in contents)
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='Manager KPI benchmark')
+    args_parser.add_argument('--managers', type=int, default=1000)
+    args_parser.add_argument('--date_from', type=str, default='2023-01-01')
+    args_parser.add_argument('--date_to', type=str, default='2023-12-31')
+    args = args_parser.parse_args()
+    logging.disable(logging.INFO)
+    from parser.employees import EmployeeDirectory
+
+    date_from, date_to = date.fromisoformat(args.date_from), date.fromisoformat(args.date_to)
+    days = (date_to - date_from).days + 1
+    batch = make_batch(args.managers, date_from, days)
+    managers_data = [{'employee_id': employee_id, 'operations': operations}
+                     for employee_id, operations in _group_rows(batch)]
+    print(f'{args.managers} managers x {days} days, {len(batch)} rows')
+
+    expected, python_seconds = timed(python_kpis, managers_data, date_from, days)
+    by_pandas, pandas_seconds = timed(pandas_kpis, batch, date_from, days)
+    (matrix, by_matrix), matrix_seconds = timed(matrix_kpis, batch, date_from, date_to)
+    print(f"{'mode':>8} {'ms':>9}  same KPIs")
+    print(f"{'python':>8} {python_seconds * 1000:>9.1f}  True")
+    print(f"{'pandas':>8} {pandas_seconds * 1000:>9.1f}  {same_kpis(expected, by_pandas)}")
+    print(f"{'matrix':>8} {matrix_seconds * 1000:>9.1f}  {same_kpis(expected, by_matrix)}")
+    _, kpi_seconds = timed(matrix.kpis, WINDOW)
+    buffer = io.BytesIO()
+    _, csv_seconds = timed(matrix.write_kpi_csv, buffer, EmployeeDirectory(), WINDOW)
+    print(f'matrix {matrix.values.shape}: KPIs only {kpi_seconds * 1000:.1f} ms, csv {csv_seconds * 1000:.1f} ms')
+
+    rows, same = compare_reports(date(2023, 7, 1), date(2023, 9, 30))
+    print(f'KPI report from API, fetch_employee_data and warehouse: {rows} rows, same csv {same}')
+
+
+def _group_rows(batch):
+    """Строки пачки по сотрудникам в виде результата fetch_employee_data"""
+    operations = {}
+    for employee_id, operation in zip(batch.column('employee_id').tolist(), batch.rows()):
+        operations.setdefault(employee_id, []).append(operation)
+    return operations.items()
+
+
+if __name__ == '__main__':
+    main()
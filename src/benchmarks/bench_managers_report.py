@@ -0,0 +1,92 @@
+"""
+Benchmark for managers report enrichment - Замер сборки отчета по менеджерам
+
+Сравнивается прежний поиск сотрудника перебором списка и тройной цикл сопоставления
+журнала входов с операциями против EmployeeDirectory и хеш-соединения по (телефон, дата).
+Запуск из каталога src:
+    python -m benchmarks.bench_managers_report
+"""
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault('ADMINS', '0')
+
+from parser.api import Employee, EmployeeOperations  # noqa: E402
+from parser.employees import EmployeeDirectory, attach_entry_barcodes  # noqa: E402
+
+
+def make_data(staff: int, days: int):
+    start = datetime(2023, 1, 1)
+    dates = [(start + timedelta(days=n)).strftime('%Y-%m-%d') for n in range(days)]
+    employees = [Employee(employee_id=10000 + i, last_name='Фамилия', first_name='Имя', middle_name='Отчество',
+                          phone=f'7900{i:07d}', create_date=start, rating=4.5) for i in range(staff)]
+    response = [{'employee_id': employee.employee_id,
+                 'by_date': [{'date': day, 'on_place_cnt': 1, 'return_count': 0, 'return_sum': 0,
+                              'sale_count': 1, 'sale_sum': 100} for day in dates]} for employee in employees]
+    # вход в кабинет в каждый второй день
+    entries = {employee.phone: [{'date_created': f'{day}T09:00:00', 'barcode': f'SHK{i % 7}'}
+                                for i, day in enumerate(dates) if i % 2 == 0] for employee in employees}
+    return employees, response, entries
+
+
+def build_managers_data(response, find_employee):
+    result = []
+    for employee_data in response:
+        employee_info = find_employee(employee_data['employee_id'])
+        result.append({'employee_id': employee_data['employee_id'], 'phone': employee_info.phone,
+                       'operations': [EmployeeOperations.from_dict(data) for data in employee_data['by_date']]})
+    return result
+
+
+def nested_loop_join(managers_data, entries):
+    """Прежнее сопоставление из send_report"""
+    for employee in managers_data:
+        api_data = entries.get(employee.get('phone'))
+        if api_data:
+            for day in api_data:
+                api_date = day.get('date_created').split('T')[0]
+                api_barcode = day.get('barcode')
+                for operation in employee.get('operations'):
+                    if api_date == operation.date:
+                        operation.barcode = api_barcode
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='Managers report benchmark')
+    args_parser.add_argument('--staff', type=int, default=500)
+    args_parser.add_argument('--days', type=int, default=90)
+    args = args_parser.parse_args()
+    employees, response, entries = make_data(args.staff, args.days)
+
+    ids = [employee_data['employee_id'] for employee_data in response]
+    start = time.perf_counter()
+    for employee_id in ids:
+        next((e for e in employees if e.employee_id == employee_id), None)
+    old_lookup = time.perf_counter() - start
+    start = time.perf_counter()
+    directory = EmployeeDirectory(employees)
+    for employee_id in ids:
+        directory.get(employee_id)
+    new_lookup = time.perf_counter() - start
+
+    old_data = build_managers_data(response, directory.get)
+    new_data = build_managers_data(response, directory.get)
+    start = time.perf_counter()
+    nested_loop_join(old_data, entries)
+    old_join = time.perf_counter() - start
+    start = time.perf_counter()
+    attach_entry_barcodes(new_data, entries)
+    new_join = time.perf_counter() - start
+
+    assert [[op.barcode for op in e['operations']] for e in old_data] == \
+           [[op.barcode for op in e['operations']] for e in new_data]
+    print(f'{args.staff} staff x {args.days} days')
+    print(f"{'step':>20} {'before, ms':>12} {'after, ms':>12}")
+    print(f"{'employee lookup':>20} {old_lookup * 1000:>12.1f} {new_lookup * 1000:>12.1f}")
+    print(f"{'barcode join':>20} {old_join * 1000:>12.1f} {new_join * 1000:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Benchmark for windowed operations fetch - Замер получения операций окнами дат
+
+Фейковый API отдает многолетнюю историю операций. Сравниваются запрос всей истории
+с фильтрацией на клиенте и запрос окнами дат, в том числе когда сервер границы игнорирует,
+с разбором ответа через response.json() и потоковым разбором (пик памяти по tracemalloc).
+Запуск из каталога src:
+    python -m benchmarks.bench_operations_window
+"""
+import argparse
+import logging
+import time
+import tracemalloc
+
+from benchmarks.fake_api import FakeWBServer, FakeWBState, make_parser
+
+
+def run(history_days: int, honor_bounds: bool, windowed: bool, stream: bool, date_from: str, date_to: str):
+    state = FakeWBState(latency=0, history_days=history_days, honor_bounds=honor_bounds)
+    with FakeWBServer(state) as server:
+        parser = make_parser(server)
+        parser.fetch_offices()
+        # прогрев: тела ответов сервера готовятся до начала замера
+        for _ in parser.iter_operations(date_from=date_from, date_to=date_to, windowed=windowed, stream=stream):
+            pass
+        state.bytes_sent = 0
+        days = 0
+        tracemalloc.start()
+        start = time.perf_counter()
+        for item in parser.iter_operations(date_from=date_from, date_to=date_to, windowed=windowed, stream=stream):
+            assert date_from <= item.date.strftime('%Y-%m-%d') <= date_to
+            days += 1
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return elapsed, days, state.bytes_sent, peak
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='Operations windowed fetch benchmark')
+    args_parser.add_argument('--history_days', type=int, default=5 * 365)
+    args_parser.add_argument('--date_from', type=str, default='2023-10-01')
+    args_parser.add_argument('--date_to', type=str, default='2023-11-30')
+    args = args_parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    print(f"{'mode':>28} {'stream':>7} {'seconds':>8} {'days':>6} {'KB sent':>10} {'peak KB':>10}")
+    for name, honor_bounds, windowed in (('all history + client filter', True, False),
+                                         ('windowed', True, True),
+                                         ('windowed, bounds ignored', False, True)):
+        for stream in (False, True):
+            elapsed, days, sent, peak = run(args.history_days, honor_bounds, windowed, stream,
+                                            args.date_from, args.date_to)
+            print(f'{name:>28} {str(stream):>7} {elapsed:>8.3f} {days:>6} {sent / 1024:>10.0f} {peak / 1024:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
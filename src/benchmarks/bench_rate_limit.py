@@ -0,0 +1,85 @@
+"""
+Benchmark for throttled API - Замер загрузки продаж при ограничении запросов на стороне API
+
+Фейковый API отвечает 429 с Retry-After сверх throttle_rps запросов в секунду.
+Сравнивается загрузка без повторов (прежнее поведение: ответ с ошибкой - пропавший
+офис), через RateLimiter без известной частоты API (только адаптивный лимит и повторы)
+и с token bucket, настроенным на частоту API. Затем проверяется, что исключения запроса,
+которые не повторяются, не занимают слоты параллельности навсегда.
+Запуск из каталога src:
+    python -m benchmarks.bench_rate_limit
+"""
+import argparse
+import logging
+import time
+
+import requests
+
+from benchmarks.fake_api import FakeWBServer, FakeWBState, make_parser
+
+
+def run(mode: str, offices: int, workers: int, throttle_rps: float, latency: float):
+    from parser.rate_limit import RateLimiter
+
+    if mode == 'no retries':
+        limiter = RateLimiter(rate=1e6, burst=10 ** 6, concurrency=workers, max_concurrency=workers, attempts=1)
+    elif mode == 'aimd only':
+        # частота API неизвестна: только адаптивный лимит, Retry-After и повторы
+        limiter = RateLimiter(rate=1e6, burst=10 ** 6, concurrency=workers, max_concurrency=workers)
+    else:
+        limiter = RateLimiter(rate=throttle_rps, burst=int(throttle_rps), concurrency=workers,
+                              max_concurrency=workers)
+    state = FakeWBState(offices=offices, latency=latency, throttle_rps=throttle_rps)
+    with FakeWBServer(state) as server:
+        parser = make_parser(server, max_workers=workers, rate_limiter=limiter)
+        parser.fetch_offices()
+        start = time.perf_counter()
+        rows = sum(1 for _ in parser.iter_sales(date_from='2023-09-01', date_to='2023-09-30'))
+        elapsed = time.perf_counter() - start
+    return elapsed, rows, offices * 30, sum(parser.request_errors.values()), state.throttled, limiter.stats['retries']
+
+
+def in_flight_after_errors(workers: int) -> int:
+    """Занятые слоты после исключений запроса, отличных от ошибок соединения и таймаута"""
+    from parser.api import ReportCancelled
+    from parser.rate_limit import RateLimiter
+
+    class FailingSession(requests.Session):
+        def __init__(self, errors):
+            super().__init__()
+            self.errors = iter(errors)
+
+        def request(self, method, url, **kwargs):
+            raise next(self.errors)
+
+    errors = [requests.exceptions.ChunkedEncodingError(), requests.exceptions.ContentDecodingError(),
+              requests.TooManyRedirects(), requests.exceptions.InvalidURL(), ReportCancelled()] * workers
+    limiter = RateLimiter(rate=1e6, burst=10 ** 6, concurrency=workers, max_concurrency=workers)
+    session = FailingSession(errors)
+    for _ in errors:
+        try:
+            limiter.request(session, 'GET', 'http://127.0.0.1/proceeds', 'sales')
+        except (requests.RequestException, ReportCancelled):
+            pass
+    return limiter.limits('127.0.0.1', 'sales')[1].in_flight
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='Rate limiter benchmark')
+    args_parser.add_argument('--offices', type=int, default=60)
+    args_parser.add_argument('--workers', type=int, default=16)
+    args_parser.add_argument('--throttle_rps', type=float, default=40, help='Fake API requests per second limit')
+    args_parser.add_argument('--latency', type=float, default=0.02, help='Fake API latency per request, seconds')
+    args = args_parser.parse_args()
+    logging.disable(logging.ERROR)
+
+    print(f"{'mode':>12} {'seconds':>10} {'rows':>12} {'errors':>8} {'429s':>6} {'retries':>8}")
+    for mode in ('no retries', 'aimd only', 'limiter'):
+        elapsed, rows, expected, errors, throttled, retries = run(mode, args.offices, args.workers,
+                                                                  args.throttle_rps, args.latency)
+        print(f'{mode:>12} {elapsed:>10.3f} {f"{rows}/{expected}":>12} {errors:>8} {throttled:>6} {retries:>8}')
+    print(f'slots in flight after non-retried request errors: {in_flight_after_errors(args.workers)}')
+
+
+if __name__ == '__main__':
+    main()
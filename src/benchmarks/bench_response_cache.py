@@ -0,0 +1,63 @@
+"""
+Benchmark for API response cache - Замер кеша ответов API
+
+Продажи по офисам загружаются несколько раз подряд без локального хранилища продаж:
+без кеша, с кешем за закрытый период (повторные загрузки без запросов) и с кешем за
+открытый период с истекшим сроком (проверка ответов по ETag, сервер отвечает 304 без тела).
+Запуск из каталога src:
+    python -m benchmarks.bench_response_cache
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+from datetime import date, timedelta
+
+from benchmarks.fake_api import FakeWBServer, FakeWBState, make_parser
+
+
+def run(mode: str, runs: int, offices: int, latency: float):
+    from parser.response_cache import ResponseCache
+
+    if mode == 'open period':
+        date_to = date.today()
+    else:
+        date_to = date.today() - timedelta(days=30)
+    date_from = date_to - timedelta(days=29)
+    state = FakeWBState(offices=offices, latency=latency, etags=True)
+    with tempfile.TemporaryDirectory() as directory, FakeWBServer(state) as server:
+        cache = None
+        if mode != 'no cache':
+            # срок ответов за открытый период истекает сразу, каждый запуск проверяет их по ETag
+            cache = ResponseCache(os.path.join(directory, 'responses.db'), ttl=0)
+        start = time.perf_counter()
+        for _ in range(runs):
+            parser = make_parser(server, response_cache=cache)
+            parser.fetch_offices()
+            rows = sum(1 for _ in parser.iter_sales(date_from=date_from, date_to=date_to))
+            assert rows == offices * 30
+        elapsed = time.perf_counter() - start
+        stats = dict(cache.stats) if cache else {}
+        if cache:
+            cache.close()
+    requests_count = sum(count for path, count in state.requests.items() if not path.endswith('/account'))
+    return elapsed, requests_count, state.not_modified, state.bytes_sent, stats
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='Response cache benchmark')
+    args_parser.add_argument('--runs', type=int, default=5)
+    args_parser.add_argument('--offices', type=int, default=40)
+    args_parser.add_argument('--latency', type=float, default=0.05, help='Fake API latency per request, seconds')
+    args = args_parser.parse_args()
+    logging.disable(logging.INFO)
+
+    print(f"{'mode':>14} {'seconds':>8} {'requests':>9} {'304':>5} {'bytes':>9}  cache")
+    for mode in ('no cache', 'closed period', 'open period'):
+        elapsed, requests_count, not_modified, bytes_sent, stats = run(mode, args.runs, args.offices, args.latency)
+        print(f'{mode:>14} {elapsed:>8.3f} {requests_count:>9} {not_modified:>5} {bytes_sent:>9}  {stats}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+Benchmark for concurrent sales fetching - Замер параллельной загрузки продаж
+
+Запуск из каталога src:
+    python -m benchmarks.bench_sales_fetch
+"""
+import argparse
+import logging
+import time
+
+from benchmarks.fake_api import FakeWBServer, FakeWBState, make_parser
+
+
+def run(offices: int, workers: int, latency: float, date_from: str, date_to: str) -> float:
+    state = FakeWBState(offices=offices, latency=latency)
+    with FakeWBServer(state) as server:
+        parser = make_parser(server, max_workers=workers)
+        parser.fetch_offices()
+        start = time.perf_counter()
+        data = parser.fetch_sales_data(date_from=date_from, date_to=date_to)
+        elapsed = time.perf_counter() - start
+    assert [(row.office_id, row.date) for row in data] == sorted((row.office_id, row.date) for row in data)
+    return elapsed
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='Sales fetch benchmark')
+    args_parser.add_argument('--offices', type=int, nargs='+', default=[5, 20, 60])
+    args_parser.add_argument('--workers', type=int, nargs='+', default=[1, 8, 16])
+    args_parser.add_argument('--latency', type=float, default=0.05, help='Fake API latency per request, seconds')
+    args_parser.add_argument('--date_from', type=str, default='2023-09-01')
+    args_parser.add_argument('--date_to', type=str, default='2023-09-30')
+    args = args_parser.parse_args()
+    logging.disable(logging.INFO)
+
+    print(f"{'offices':>8} {'workers':>8} {'seconds':>10}")
+    for offices in args.offices:
+        for workers in args.workers:
+            elapsed = run(offices, workers, args.latency, args.date_from, args.date_to)
+            print(f'{offices:>8} {workers:>8} {elapsed:>10.3f}')
+
+
+if __name__ == '__main__':
+    main()
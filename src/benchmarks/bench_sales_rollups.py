@@ -0,0 +1,187 @@
+"""
+Benchmark for sales rollups - Замер сводки по продажам по неделям, месяцам и за период
+
+Сводка строится из API (группировка пачек продаж) и из хранилища, где полные недели
+и месяцы берутся из материализованных сумм sales_rollups. csv сравниваются побайтно.
+Затем продажи загружаются в хранилище по месяцам, часть дней заменяется измененными
+значениями, и суммы sales_rollups сравниваются с пересчетом по всем дневным строкам,
+в том числе после прерванной ошибкой загрузки.
+Запуск из каталога src:
+    python -m benchmarks.bench_sales_rollups
+"""
+import argparse
+import io
+import logging
+import os
+import tempfile
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+# utils.env требует список админов при импорте
+os.environ.setdefault('ADMINS', '0')
+
+from benchmarks.fake_api import FakeWBServer, FakeWBState, make_parser  # noqa: E402
+
+
+def api_summary(server: FakeWBServer, date_from: date, date_to: date) -> bytes:
+    from parser.api import SaleBatch
+    from parser.rollups import GRAINS, SalesRollup, write_summary_csv
+
+    parser = make_parser(server)
+    parser.fetch_offices()
+    batch = SaleBatch.concat(list(parser.iter_sales_batches(date_from=date_from, date_to=date_to)))
+    buffer = io.BytesIO()
+    write_summary_csv([SalesRollup.from_batches([batch], grain, date_from) for grain in GRAINS], buffer,
+                      parser.offices)
+    return buffer.getvalue()
+
+
+def warehouse_summary(reports, server: FakeWBServer, date_from: date, date_to: date) -> bytes:
+    parser = make_parser(server)
+    parser.fetch_offices()
+    buffer = io.BytesIO()
+    reports.write_sales_summary(parser, date_from, date_to, buffer)
+    return buffer.getvalue()
+
+
+def same_rollups(first, second) -> bool:
+    order_first = np.lexsort((first.period_starts, first.office_ids))
+    order_second = np.lexsort((second.period_starts, second.office_ids))
+    first, second = first.take(order_first), second.take(order_second)
+    return (np.array_equal(first.office_ids, second.office_ids)
+            and np.array_equal(first.period_starts, second.period_starts)
+            and all(np.allclose(first.sums[name], second.sums[name]) for name in first.sums))
+
+
+def missing_accruals(directory: str, date_from: date, date_to: date) -> bool:
+    """
+    Дни без начисления не снижают средний рейтинг: у всех начислений фейкового API рейтинг 4.75,
+    сводки из API и из хранилища и отчеты по продажам совпадают, в отчете такие дни - нули
+    """
+    from sqlalchemy import create_engine
+    from bot.reports import ReportRequest, _write_report
+    from db.reports import WarehouseReports
+    from db.warehouse import Warehouse
+    from parser.api import SaleBatch
+    from parser.rollups import GRAINS, SalesRollup
+
+    state = FakeWBState(offices=10, latency=0, accrual_gap=5)
+    reports = WarehouseReports(Warehouse(create_engine(f"sqlite:///{os.path.join(directory, 'gaps.db')}")))
+    with FakeWBServer(state) as server:
+        parser = make_parser(server)
+        parser.fetch_offices()
+        batch = SaleBatch.concat(list(parser.iter_sales_batches(date_from=date_from, date_to=date_to)))
+        rollups = [SalesRollup.from_batches([batch], grain, date_from) for grain in GRAINS]
+        ratings = np.concatenate([rollup.average_rating() for rollup in rollups]
+                                 + [rollup.weighted_rating() for rollup in rollups])
+        reports_csv = []
+        request = ReportRequest(user_id=0, chat_id=0, phone='', report_type='sales',
+                                date_from=date_from.isoformat(), date_to=date_to.isoformat(), session=None)
+        for mode in ('api', 'warehouse'):
+            parser = make_parser(server)
+            parser.fetch_offices()
+            buffer = io.BytesIO()
+            if mode == 'api':
+                _write_report(parser, request, buffer, lambda: None)
+            else:
+                reports.write_sales(parser, date_from, date_to, buffer)
+            reports_csv.append(buffer.getvalue())
+        same_summary = warehouse_summary(reports, server, date_from, date_to) == api_summary(server, date_from,
+                                                                                             date_to)
+    unrated = int(np.isnan(batch.column('office_rating')).sum())
+    # у периода только из дней без начисления рейтинга нет (NaN)
+    rated = ratings[~np.isnan(ratings)]
+    return (unrated > 0 and len(rated) > 0 and np.allclose(rated, 4.75) and same_summary
+            and reports_csv[0] == reports_csv[1] and b',,' not in reports_csv[0])
+
+
+def rollups_consistent(warehouse, supplier_id: int, date_from: date, date_to: date) -> bool:
+    """Суммы sales_rollups совпадают с пересчетом по дневным строкам"""
+    from db.warehouse import MATERIALIZED_GRAINS
+
+    return all(same_rollups(warehouse.materialized_rollup(supplier_id, grain, date_from - timedelta(days=7), date_to),
+                            warehouse.aggregate_sales(supplier_id, grain)) for grain in MATERIALIZED_GRAINS)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='Sales rollups benchmark')
+    args_parser.add_argument('--offices', type=int, default=120)
+    args_parser.add_argument('--date_from', type=str, default='2023-01-01')
+    args_parser.add_argument('--date_to', type=str, default='2023-12-31')
+    args = args_parser.parse_args()
+    logging.disable(logging.INFO)
+    from sqlalchemy import create_engine
+    from db.reports import WarehouseReports
+    from db.warehouse import Warehouse
+    from parser.api import SaleBatch
+
+    date_from, date_to = date.fromisoformat(args.date_from), date.fromisoformat(args.date_to)
+    state = FakeWBState(offices=args.offices, latency=0)
+    print(f'{args.offices} offices, {args.date_from} - {args.date_to}')
+    with tempfile.TemporaryDirectory() as directory, FakeWBServer(state) as server:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'warehouse.db')}")
+        reports = WarehouseReports(Warehouse(engine))
+        warehouse = reports.warehouse
+        expected, api_seconds = timed(api_summary, server, date_from, date_to)
+        print(f"{'summary':>16} {'seconds':>8}  same csv")
+        print(f"{'api':>16} {api_seconds:>8.3f}  True")
+        for mode in ('warehouse cold', 'warehouse warm'):
+            content, seconds = timed(warehouse_summary, reports, server, date_from, date_to)
+            print(f'{mode:>16} {seconds:>8.3f}  {content == expected}')
+        # неполные недели и месяцы на краях периода
+        edge_from, edge_to = date_from + timedelta(days=45), date_to - timedelta(days=40)
+        same = warehouse_summary(reports, server, edge_from, edge_to) == api_summary(server, edge_from, edge_to)
+        print(f"{'partial edges':>16} {'':>8}  {same}")
+
+        parser = make_parser(server)
+        parser.fetch_offices()
+        supplier_id = parser.supplier_id
+        _, rollup_seconds = timed(warehouse.sales_summary, supplier_id, 'total', date_from, date_to)
+        _, rescan_seconds = timed(warehouse.aggregate_sales, supplier_id, 'total', date_from, date_to)
+        print(f'year total: from sales_rollups {rollup_seconds * 1000:.1f} ms, '
+              f'rescan of daily rows {rescan_seconds * 1000:.1f} ms')
+
+        # загрузка по месяцам и замена части дней измененными значениями
+        incremental = Warehouse(create_engine(f"sqlite:///{os.path.join(directory, 'incremental.db')}"))
+        incremental.create_tables()
+        month = date_from
+        load_seconds = []
+        while month <= date_to:
+            month_end = min((month + timedelta(days=31)).replace(day=1) - timedelta(days=1), date_to)
+            batches = list(parser.iter_sales_batches(date_from=month, date_to=month_end))
+            _, seconds = timed(incremental.replace_sales, supplier_id, month, month_end, batches)
+            load_seconds.append(seconds)
+            month = month_end + timedelta(days=1)
+        changed_from, changed_to = date_from + timedelta(days=20), date_from + timedelta(days=50)
+        batch = SaleBatch.concat(list(parser.iter_sales_batches(date_from=changed_from, date_to=changed_to)))
+        batch.columns['proceeds'] = batch.columns['proceeds'] * 2
+        batch = batch.take(np.arange(len(batch)) % 5 != 0)
+        incremental.replace_sales(supplier_id, changed_from, changed_to, [batch])
+        consistent = rollups_consistent(incremental, supplier_id, date_from, date_to)
+        # ошибка посреди загрузки (None вместо пачки) откатывает удаление дней и обновление сумм
+        rows = len(incremental.aggregate_sales(supplier_id, 'total', date_from, date_to))
+        try:
+            incremental.replace_sales(supplier_id, date_from, date_to, [batch, None])
+        except AttributeError:
+            pass
+        interrupted = (rollups_consistent(incremental, supplier_id, date_from, date_to)
+                       and len(incremental.aggregate_sales(supplier_id, 'total', date_from, date_to)) == rows)
+        _, rebuild_seconds = timed(incremental.rebuild_rollups, supplier_id)
+        print(f'monthly loads with sales_rollups update: {np.mean(load_seconds):.3f} s per month, '
+              f'full rebuild of sales_rollups {rebuild_seconds:.3f} s')
+        print(f'sales_rollups match rebuild after changed days: {consistent}, '
+              f'after interrupted load: {interrupted}')
+        print(f'days without accruals keep the average rating: '
+              f'{missing_accruals(directory, date_from, date_from + timedelta(days=90))}')
+
+
+if __name__ == '__main__':
+    main()
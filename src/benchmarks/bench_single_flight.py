@@ -0,0 +1,59 @@
+"""
+Benchmark for request coalescing - Замер объединения одинаковых одновременных запросов
+
+Несколько администраторов одного аккаунта одновременно запрашивают продажи за один
+период: у каждого свой ParserWB. Сравниваются запросы к фейковому API без объединения
+(свой SingleFlight у каждого парсера) и с общим SingleFlight.
+Запуск из каталога src:
+    python -m benchmarks.bench_single_flight
+"""
+import argparse
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fake_api import FakeWBServer, FakeWBState, make_parser
+
+
+def run(mode: str, users: int, offices: int, latency: float):
+    from parser.single_flight import SingleFlight
+
+    shared = SingleFlight()
+    state = FakeWBState(offices=offices, latency=latency)
+    # все пользователи начинают одновременно, как после одного сообщения в общем чате
+    barrier = threading.Barrier(users)
+
+    def fetch(_):
+        parser = make_parser(server, single_flight=shared if mode == 'coalesced' else SingleFlight())
+        barrier.wait()
+        parser.fetch_offices()
+        return [(row.office_id, str(row.date), row.sale_sum)
+                for row in parser.iter_sales(date_from='2023-09-01', date_to='2023-09-30')]
+
+    with FakeWBServer(state) as server:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=users) as executor:
+            results = list(executor.map(fetch, range(users)))
+        elapsed = time.perf_counter() - start
+    assert all(result == results[0] for result in results) and len(results[0]) == offices * 30
+    return elapsed, sum(state.requests.values()), shared.stats['shared']
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='Request coalescing benchmark')
+    args_parser.add_argument('--users', type=int, nargs='+', default=[1, 4, 8])
+    args_parser.add_argument('--offices', type=int, default=40)
+    args_parser.add_argument('--latency', type=float, default=0.05, help='Fake API latency per request, seconds')
+    args = args_parser.parse_args()
+    logging.disable(logging.INFO)
+
+    print(f"{'users':>6} {'mode':>10} {'seconds':>8} {'requests':>9} {'shared':>7}")
+    for users in args.users:
+        for mode in ('separate', 'coalesced'):
+            elapsed, requests_count, shared = run(mode, users, args.offices, args.latency)
+            print(f'{users:>6} {mode:>10} {elapsed:>8.3f} {requests_count:>9} {shared:>7}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Benchmark for franchise token reuse - Замер запросов токенов при параллельных отчетах
+
+Несколько потоков одновременно получают сессию одного аккаунта, как параллельные
+отчеты. Сравнивается количество запросов к серверу авторизации при первом получении
+сессии (истекший access токен) и повторном (действующий access токен).
+Запуск из каталога src:
+    python -m benchmarks.bench_token_refresh
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fake_api import FakeTokenHandler, FakeTokenState, FakeWBServer
+
+
+def get_sessions(server: FakeWBServer, store, phone: str, concurrency: int) -> float:
+    from parser.auth_fr import Auth
+
+    def get_session(_):
+        auth = Auth(token_store=store)
+        auth.token_url = f'{server.url}/connect/token'
+        return auth.get_saved_session(phone)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        sessions = list(executor.map(get_session, range(concurrency)))
+    assert all(sessions), 'session was not created'
+    return time.perf_counter() - start
+
+
+def run(concurrency: int, latency: float):
+    from parser.token_store import TokenStore
+
+    state = FakeTokenState(latency=latency)
+    with tempfile.TemporaryDirectory() as directory, FakeWBServer(state, handler=FakeTokenHandler) as server:
+        store = TokenStore(os.path.join(directory, 'tokens.db'), legacy_dir=None)
+        phone = '79000000000'
+        # refresh токен без access токена - как после переноса файла прежнего формата
+        state.refresh_tokens.add('refresh-0')
+        store.save(phone, None, 'refresh-0')
+        results = []
+        for name in ('expired access', 'valid access'):
+            before = state.token_requests
+            elapsed = get_sessions(server, store, phone, concurrency)
+            results.append((name, elapsed, state.token_requests - before))
+        store.close()
+    return results
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='Token reuse benchmark')
+    args_parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    args_parser.add_argument('--latency', type=float, default=0.1, help='Fake token server latency, seconds')
+    args = args_parser.parse_args()
+    logging.disable(logging.INFO)
+
+    print(f"{'threads':>8} {'case':>15} {'seconds':>10} {'token requests':>15}")
+    for concurrency in args.concurrency:
+        for name, elapsed, requests_count in run(concurrency, args.latency):
+            print(f'{concurrency:>8} {name:>15} {elapsed:>10.3f} {requests_count:>15}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Benchmark for warehouse loader - Замер загрузки данных в хранилище (строк в секунду)
+
+Продажи офисов за период загружаются построчно (INSERT и коммит на каждую строку)
+и пачками Warehouse.load_sales, затем тот же период загружается повторно (upsert
+существующих строк). По умолчанию используется временная база SQLite, для PostgreSQL
+передается --url.
+Запуск из каталога src:
+    python -m benchmarks.bench_warehouse_loader
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, func, select
+
+# utils.env требует список админов при импорте
+os.environ.setdefault('ADMINS', '0')
+
+
+def make_sales(offices: int, days: int):
+    from parser.api import SaleData
+
+    first_day = datetime(2023, 1, 1)
+    return [SaleData(office_id=office_id, name=f'Офис {office_id}', date=first_day + timedelta(days=n),
+                     sale_sum=1000 * office_id + n, sale_count=office_id + n, return_sum=10 * n,
+                     return_count=n % 3, proceeds=900 * office_id + n, amount=50 * office_id + n, bags_sum=n,
+                     office_rating=4.75, percent=3.5, office_rating_sum=2 * n, supplier_return_sum=0)
+            for office_id in range(1, offices + 1) for n in range(days)]
+
+
+def load_row_by_row(warehouse, supplier_id: int, sales) -> int:
+    from db.warehouse import daily_sales, reward_accruals
+
+    with warehouse.engine.connect() as connection:
+        for sale in sales:
+            key = {'supplier_id': supplier_id, 'office_id': sale.office_id, 'date': sale.date.date()}
+            connection.execute(daily_sales.insert().values(
+                **key, name=sale.name, sale_count=sale.sale_count, return_count=sale.return_count,
+                sale_sum=sale.sale_sum, return_sum=sale.return_sum, proceeds=sale.proceeds))
+            connection.execute(reward_accruals.insert().values(
+                **key, amount=sale.amount, bags_sum=sale.bags_sum, office_rating=sale.office_rating,
+                percent=sale.percent, office_rating_sum=sale.office_rating_sum,
+                supplier_return_sum=sale.supplier_return_sum))
+            connection.commit()
+    return len(sales)
+
+
+def run(url: str, offices: int, days: int, row_limit: int):
+    from db.warehouse import Warehouse, daily_sales, metadata
+
+    sales = make_sales(offices, days)
+    results = []
+    for mode in ('row by row', 'bulk', 'bulk reload'):
+        warehouse = Warehouse(create_engine(url))
+        if mode != 'bulk reload':
+            metadata.drop_all(warehouse.engine)
+            warehouse.create_tables()
+        # построчная загрузка медленная, замеряется на части строк
+        rows = sales[:row_limit] if mode == 'row by row' else sales
+        start = time.perf_counter()
+        if mode == 'row by row':
+            load_row_by_row(warehouse, 1, rows)
+        else:
+            warehouse.load_sales(1, rows)
+        elapsed = time.perf_counter() - start
+        with warehouse.engine.connect() as connection:
+            stored = connection.execute(select(func.count()).select_from(daily_sales)).scalar()
+        assert stored == len(rows)
+        results.append((mode, len(rows), elapsed, len(rows) / elapsed))
+        warehouse.engine.dispose()
+    return results
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='Warehouse loader benchmark')
+    args_parser.add_argument('--url', type=str, help='SQLAlchemy url, temporary SQLite file by default')
+    args_parser.add_argument('--offices', type=int, default=100)
+    args_parser.add_argument('--days', type=int, default=365)
+    args_parser.add_argument('--row_limit', type=int, default=2000, help='Rows for row by row loading')
+    args = args_parser.parse_args()
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as directory:
+        url = args.url or f"sqlite:///{os.path.join(directory, 'warehouse.db')}"
+        print(f"{'mode':>12} {'rows':>8} {'seconds':>8} {'rows/s':>10}")
+        for mode, rows, elapsed, rate in run(url, args.offices, args.days, args.row_limit):
+            print(f'{mode:>12} {rows:>8} {elapsed:>8.2f} {rate:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
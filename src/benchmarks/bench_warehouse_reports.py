@@ -0,0 +1,120 @@
+"""
+Benchmark for reports from warehouse - Замер отчетов из хранилища
+
+Отчеты по продажам, операциям и менеджерам за закрытый период строятся выгрузкой из
+API и запросами к хранилищу SQLite: первый отчет догружает в хранилище весь период,
+повторный (новая сессия, тот же аккаунт) обходится без запросов данных к API
+и к журналам входов сотрудников (в колонке requests учитываются оба вида запросов).
+csv из хранилища сравнивается с csv из API (строки операций - без учета порядка дней).
+Запуск из каталога src:
+    python -m benchmarks.bench_warehouse_reports
+"""
+import argparse
+import io
+import logging
+import os
+import tempfile
+import time
+from datetime import date
+
+from sqlalchemy import create_engine
+
+# utils.env требует список админов при импорте
+os.environ.setdefault('ADMINS', '0')
+
+from benchmarks.fake_api import FakeEntryLogState, FakeWBServer, FakeWBState, make_parser  # noqa: E402
+
+REPORT_TYPES = ('sales', 'operations', 'managers')
+
+
+def api_report(server: FakeWBServer, report_type: str, date_from: date, date_to: date, load_entries) -> bytes:
+    """Прежняя выгрузка отчета из API"""
+    from parser.column_names import sale_data_column_names_mapping
+    from parser.employees import attach_entry_barcodes
+
+    parser = make_parser(server)
+    parser.fetch_offices()
+    parser.fetch_employees()
+    buffer = io.BytesIO()
+    if report_type == 'sales':
+        parser.save_to_csv(data=parser.iter_sales(date_from=date_from, date_to=date_to), filename=buffer,
+                           column_names_mapings=sale_data_column_names_mapping)
+    elif report_type == 'operations':
+        parser.safe_to_csv_operations(data=parser.iter_operations(date_from=date_from, date_to=date_to),
+                                      filename=buffer)
+    else:
+        managers_data = parser.fetch_employee_data(date_from=date_from, date_to=date_to)
+        attach_entry_barcodes(managers_data, load_entries(employee.get('phone') for employee in managers_data))
+        parser.save_to_csv_mananagers_operations(data=managers_data, filename=buffer)
+    return buffer.getvalue()
+
+
+def warehouse_report(reports, server: FakeWBServer, report_type: str, date_from: date, date_to: date,
+                     load_entries) -> bytes:
+    parser = make_parser(server)
+    parser.fetch_offices()
+    parser.fetch_employees()
+    buffer = io.BytesIO()
+    if report_type == 'sales':
+        reports.write_sales(parser, date_from, date_to, buffer)
+    elif report_type == 'operations':
+        reports.write_operations(parser, date_from, date_to, buffer)
+    else:
+        reports.write_managers(parser, date_from, date_to, buffer, load_entries)
+    return buffer.getvalue()
+
+
+def data_requests(state: FakeWBState, entry_requests: list) -> int:
+    """Запросы данных к API и запросы журналов входов"""
+    return sum(count for path, count in state.requests.items() if not path.endswith('/account')) + sum(entry_requests)
+
+
+def same_rows(first: bytes, second: bytes) -> bool:
+    return sorted(first.decode().splitlines()) == sorted(second.decode().splitlines())
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='Warehouse reports benchmark')
+    args_parser.add_argument('--offices', type=int, default=120)
+    args_parser.add_argument('--employees', type=int, default=50)
+    args_parser.add_argument('--date_from', type=str, default='2023-07-01')
+    args_parser.add_argument('--date_to', type=str, default='2023-09-30')
+    args_parser.add_argument('--latency', type=float, default=0.05, help='Fake API latency per request, seconds')
+    args = args_parser.parse_args()
+    logging.disable(logging.INFO)
+    from db.reports import WarehouseReports
+    from db.warehouse import Warehouse
+
+    date_from, date_to = date.fromisoformat(args.date_from), date.fromisoformat(args.date_to)
+    entry_log = FakeEntryLogState()
+
+    entry_requests = []
+
+    def load_entries(phones):
+        entries = {phone: entry_log.entries(phone) for phone in phones if phone}
+        entry_requests.append(len(entries))
+        return entries
+
+    state = FakeWBState(offices=args.offices, employees=args.employees, latency=args.latency)
+    print(f'{args.offices} offices, {args.employees} employees, {args.date_from} - {args.date_to}')
+    print(f"{'report':>11} {'mode':>15} {'seconds':>8} {'requests':>9} {'rows':>7}  same csv")
+    with tempfile.TemporaryDirectory() as directory, FakeWBServer(state) as server:
+        reports = WarehouseReports(Warehouse(create_engine(f"sqlite:///{os.path.join(directory, 'warehouse.db')}")))
+        for report_type in REPORT_TYPES:
+            expected = None
+            for mode in ('api', 'warehouse cold', 'warehouse warm'):
+                requests_before = data_requests(state, entry_requests)
+                start = time.perf_counter()
+                if mode == 'api':
+                    content = expected = api_report(server, report_type, date_from, date_to, load_entries)
+                else:
+                    content = warehouse_report(reports, server, report_type, date_from, date_to, load_entries)
+                elapsed = time.perf_counter() - start
+                rows = content.count(b'\n') - 1
+                same = content == expected if report_type != 'operations' else same_rows(content, expected)
+                requests = data_requests(state, entry_requests) - requests_before
+                print(f'{report_type:>11} {mode:>15} {elapsed:>8.3f} {requests:>9} {rows:>7}  {same}')
+
+
+if __name__ == '__main__':
+    main()
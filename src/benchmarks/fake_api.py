@@ -0,0 +1,327 @@
+"""
+Local fake WB franchise API for benchmarks - Локальная имитация API WB для замеров
+
+Сервер отдает детерминированные данные по офисам, продажам и вознаграждениям
+с искусственной задержкой на каждый запрос.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# utils.env требует список админов при импорте
+os.environ.setdefault('ADMINS', '0')
+
+
+def _date_range(date_from: str, date_to: str):
+    """Дни диапазона вместе с числом, зависящим только от дня"""
+    day = datetime.strptime(date_from, '%Y-%m-%d')
+    end = datetime.strptime(date_to, '%Y-%m-%d')
+    while day <= end:
+        yield day.toordinal() % 97, day.strftime('%Y-%m-%d')
+        day += timedelta(days=1)
+
+
+class FakeWBState:
+    """Данные и счетчики запросов фейкового API"""
+    def __init__(self, offices: int = 10, employees: int = 10, latency: float = 0.05,
+                 history_days: int = 365, honor_bounds: bool = True, throttle_rps: float = None,
+                 etags: bool = False, accrual_gap: int = 0):
+        self.offices = offices
+        self.employees = employees
+        self.latency = latency
+        # история операций: последние history_days дней, новые дни первыми
+        self.history_days = history_days
+        self.honor_bounds = honor_bounds
+        self.bytes_sent = 0
+        # готовые тела ответов /payslip, чтобы сервер не влиял на замеры памяти клиента
+        self.payslip_cache = {}
+        self.requests = {}
+        # принятые сервером TCP соединения
+        self.connections = 0
+        # сверх throttle_rps запросов в секунду сервер отвечает 429 с Retry-After
+        self.throttle_rps = throttle_rps
+        self.throttle_tokens = throttle_rps or 0
+        self.throttle_updated = time.monotonic()
+        self.throttled = 0
+        # ETag в ответах по продажам и ответ 304 на If-None-Match с тем же ETag
+        self.etags = etags
+        self.not_modified = 0
+        # примерно каждый accrual_gap-й день офиса - без начисления в /accruals
+        self.accrual_gap = accrual_gap
+        self.lock = threading.Lock()
+
+    def count(self, path: str):
+        with self.lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def is_throttled(self) -> bool:
+        if not self.throttle_rps:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            self.throttle_tokens = min(self.throttle_rps,
+                                       self.throttle_tokens + (now - self.throttle_updated) * self.throttle_rps)
+            self.throttle_updated = now
+            if self.throttle_tokens < 1:
+                self.throttled += 1
+                return True
+            self.throttle_tokens -= 1
+            return False
+
+    def account(self):
+        return {
+            'supplier_id': 1000,
+            'offices': [{'id': i, 'name': f'Офис {i}', 'office_shk': f'SHK{i}', 'is_site_active': True}
+                        for i in range(1, self.offices + 1)],
+            'employees': [{'employee_id': 10000 + i, 'last_name': f'Фамилия{i}', 'first_name': f'Имя{i}',
+                           'middle_name': f'Отчество{i}', 'phones': [f'7900{i:07d}'],
+                           'create_date': '2023-01-01T00:00:00', 'rating': 4.5, 'is_deleted': False}
+                          for i in range(1, self.employees + 1)],
+        }
+
+    def proceeds(self, office_id: int, date_from: str, date_to: str):
+        return [{
+            'office_name': f'Офис {office_id}',
+            'by_office': [{'date': day, 'sale_count': office_id + n, 'return_count': n % 3,
+                           'sale_sum': 1000 * office_id + n, 'return_sum': 10 * n, 'proceeds': 900 * office_id + n}
+                          for n, day in _date_range(date_from, date_to)],
+        }]
+
+    def accruals(self, office_id: int, date_from: str, date_to: str):
+        return [{'date': day, 'amount': 50 * office_id + n,
+                 'ext_data': {'bags_sum': n, 'office_rating': 4.75, 'percent': [3.5],
+                              'office_rating_sum': 2 * n, 'supplier_return_sum': 0}}
+                for n, day in _date_range(date_from, date_to)
+                if not self.accrual_gap or (n + office_id) % self.accrual_gap]
+
+    def employee_proceeds(self, employee_ids: str, date_from: str, date_to: str):
+        return [{'employee_id': int(employee_id),
+                 'by_date': [{'date': day, 'on_place_cnt': n, 'return_count': n % 2, 'return_sum': 10 * (n % 2),
+                              'sale_count': n % 5, 'sale_sum': 100 * (n % 5)}
+                             for n, day in _date_range(date_from, date_to) if (n + int(employee_id)) % 3]}
+                for employee_id in employee_ids.split(',') if employee_id]
+
+    def payslip(self, date_from: str = None, date_to: str = None):
+        last_day = datetime(2023, 12, 31)
+        first_day = last_day - timedelta(days=self.history_days - 1)
+        if self.honor_bounds and date_from and date_to:
+            first_day = max(first_day, datetime.strptime(date_from, '%Y-%m-%d'))
+            last_day = min(last_day, datetime.strptime(date_to, '%Y-%m-%d'))
+        days = list(_date_range(first_day.strftime('%Y-%m-%d'), last_day.strftime('%Y-%m-%d')))
+        return {'details': [{
+            'date': f'{day}T00:00:00',
+            'operations': [{'oper_type': 1 + (n + k) % 6, 'oper_amount': 100 * k + n,
+                            'comment': f'ШК {n}{k:04d}', 'grouped': [
+                                {'oper_type': 6, 'oper_amount': n, 'comment': None, 'grouped': []}] if k % 3 == 0 else []}
+                           for k in range(10)],
+        } for n, day in reversed(days)]}
+
+
+class FakeWBHandler(BaseHTTPRequestHandler):
+    # keep-alive, чтобы клиент переиспользовал соединения
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    state: FakeWBState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        # обработчик создается на каждое новое соединение
+        if isinstance(self.state, FakeWBState):
+            with self.state.lock:
+                self.state.connections += 1
+
+    def _send_json(self, data, status: int = 200):
+        self._send_body(json.dumps(data).encode(), status)
+
+    def _send_body(self, body: bytes, status: int = 200, headers: dict = None):
+        with self.state.lock:
+            self.state.bytes_sent += len(body)
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_versioned(self, data):
+        """Ответ с ETag, если он включен, и 304 без тела на совпадающий If-None-Match"""
+        body = json.dumps(data).encode()
+        if not self.state.etags:
+            return self._send_body(body)
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        if self.headers.get('If-None-Match') == etag:
+            with self.state.lock:
+                self.state.not_modified += 1
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        return self._send_body(body, headers={'ETag': etag})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: value[0] for key, value in parse_qs(url.query).items()}
+        self.state.count(url.path)
+        time.sleep(self.state.latency)
+        if self.state.is_throttled():
+            return self._send_body(b'{"message": "too many requests"}', status=429, headers={'Retry-After': '1'})
+        if url.path.endswith('/account'):
+            return self._send_json(self.state.account())
+        if url.path.endswith('/employees/proceeds'):
+            return self._send_versioned(
+                self.state.employee_proceeds(params['employee_ids'], params['from'], params['to']))
+        if url.path.endswith('/proceeds') and 'office_ids' in params:
+            return self._send_versioned(self.state.proceeds(int(params['office_ids']), params['from'], params['to']))
+        if url.path.endswith('/accruals'):
+            return self._send_versioned(self.state.accruals(int(params['office_ids']), params['from'], params['to']))
+        if url.path.endswith('/payslip'):
+            key = (params.get('from'), params.get('to'))
+            if key not in self.state.payslip_cache:
+                self.state.payslip_cache[key] = json.dumps(self.state.payslip(*key)).encode()
+            return self._send_body(self.state.payslip_cache[key])
+        return self._send_json({'message': 'not found'}, status=404)
+
+
+class FakeWBServer:
+    """Запуск фейкового API в фоновом потоке"""
+    def __init__(self, state: FakeWBState, handler=FakeWBHandler):
+        self.state = state
+        handler_class = type('BoundHandler', (handler,), {'state': state})
+        # обрывы соединений клиентом при досрочной остановке чтения не логируются
+        server_class = type('Server', (ThreadingHTTPServer,), {
+            'request_queue_size': 128,
+            'handle_error': lambda self, request, client_address: None,
+        })
+        self.server = server_class(('127.0.0.1', 0), handler_class)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeEntryLogState:
+    """Журнал входов сотрудников и выдача токенов фейкового FastAPI сервиса"""
+    def __init__(self, latency: float = 0.02, expire_after: int = None):
+        self.latency = latency
+        # токен перестает действовать после expire_after запросов данных
+        self.expire_after = expire_after
+        self.token_number = 0
+        self.token_requests = 0
+        self.data_requests = 0
+        self.unauthorized = 0
+        self.lock = threading.Lock()
+
+    def issue_token(self) -> str:
+        with self.lock:
+            self.token_requests += 1
+            self.token_number += 1
+            self.data_requests_with_token = 0
+            return f'token-{self.token_number}'
+
+    def check_token(self, token: str) -> bool:
+        with self.lock:
+            self.data_requests += 1
+            if token != f'token-{self.token_number}':
+                self.unauthorized += 1
+                return False
+            self.data_requests_with_token += 1
+            if self.expire_after and self.data_requests_with_token > self.expire_after:
+                # токен истек, новый выдается только по запросу
+                self.token_number += 1
+                self.unauthorized += 1
+                return False
+            return True
+
+    def entries(self, phone: str):
+        number = int(phone[-4:])
+        return [{'date_created': f'2023-09-{day:02d}T09:00:00', 'barcode': f'SHK{(number + day) % 7}'}
+                for day in range(1, 31, 2)]
+
+
+class FakeEntryLogHandler(FakeWBHandler):
+    state: FakeEntryLogState = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        time.sleep(self.state.latency)
+        if url.path.endswith('/get_token'):
+            return self._send_json({'token': self.state.issue_token()})
+        if '/employee-plugin-data/' in url.path:
+            if not self.state.check_token(self.headers.get('employee-api')):
+                return self._send_json({'detail': 'unauthorized'}, status=401)
+            return self._send_json(self.state.entries(url.path.rsplit('/', 1)[-1]))
+        return self._send_json({'detail': 'not found'}, status=404)
+
+    def _send_body(self, body: bytes, status: int = 200):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeTokenState:
+    """Сервер авторизации ЛК Франшизы: выдача токенов по коду и refresh токену"""
+    def __init__(self, latency: float = 0.05, expires_in: int = 3600):
+        self.latency = latency
+        self.expires_in = expires_in
+        self.token_number = 0
+        self.token_requests = 0
+        self.refresh_tokens = set()
+        self.lock = threading.Lock()
+
+    def grant(self, form: dict):
+        with self.lock:
+            self.token_requests += 1
+            if form.get('grant_type') == 'refresh_token' and form.get('refresh_token') not in self.refresh_tokens:
+                return None
+            self.token_number += 1
+            refresh_token = f'refresh-{self.token_number}'
+            self.refresh_tokens.add(refresh_token)
+            return {'access_token': f'access-{self.token_number}', 'refresh_token': refresh_token,
+                    'expires_in': self.expires_in, 'token_type': 'Bearer'}
+
+
+class FakeTokenHandler(FakeEntryLogHandler):
+    state: FakeTokenState = None
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode()
+        time.sleep(self.state.latency)
+        tokens = self.state.grant({key: value[0] for key, value in parse_qs(body).items()})
+        if tokens is None:
+            return self._send_json({'error': 'invalid_grant'}, status=400)
+        return self._send_json(tokens)
+
+
+def make_parser(server: FakeWBServer, **kwargs):
+    """ParserWB, настроенный на фейковый API"""
+    import requests
+    from parser.api import ParserWB
+
+    parser = ParserWB(requests.Session(), **kwargs)
+    parser.base_url_v1 = f'{server.url}/api/v1/franchise'
+    parser.base_url_v2 = f'{server.url}/api/v2/franchise'
+    parser.operations_url = f'{server.url}/api/v1/franchise/payslip'
+    return parser
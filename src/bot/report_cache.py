@@ -0,0 +1,95 @@
+import json
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+from typing import List, Optional
+from utils.env import LOCAL_STORE_PATH, SALES_OPEN_DAYS
+from parser.api import to_date
+from bot.logger import WBLogger
+
+logger = WBLogger(__name__).get_logger()
+
+
+class ReportCache:
+    """
+    Cache of uploaded reports - Кеш отправленных отчетов по Telegram file_id
+
+    Ключ - (аккаунт, тип отчета, date_from, date_to, хеш содержимого). Отчет за закрытый
+    период (все дни старше open_days последних дней) отдается по file_id без выгрузки из API.
+    Отчет за открытый период формируется заново, но повторно загружается в Telegram
+    только если его содержимое изменилось. Для отчета, разделенного на части,
+    хранится список file_id всех частей.
+    """
+    def __init__(self, path: str = LOCAL_STORE_PATH, open_days: int = SALES_OPEN_DAYS):
+        self.path = path
+        self.open_days = open_days
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._create_tables()
+
+    def _create_tables(self):
+        with self._lock, self._conn:
+            # closed - период был закрыт на момент формирования отчета
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS report_files (
+                    account TEXT NOT NULL,
+                    report_type TEXT NOT NULL,
+                    date_from TEXT NOT NULL,
+                    date_to TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    file_ids TEXT NOT NULL,
+                    closed INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (account, report_type, date_from, date_to, content_hash)
+                )""")
+
+    def is_closed(self, date_to: date) -> bool:
+        """Период закрыт, если его последний день старше open_days последних дней"""
+        return to_date(date_to) <= date.today() - timedelta(days=self.open_days)
+
+    def get_closed(self, account: str, report_type: str, date_from: str, date_to: str) -> Optional[List[str]]:
+        """
+        Get file_ids of closed period report - Получение file_id отчета за закрытый период
+
+        :return: file_ids of report parts or None if period is open or report was not uploaded yet
+        """
+        if not self.is_closed(date_to):
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_ids FROM report_files WHERE account = ? AND report_type = ? AND date_from = ? "
+                "AND date_to = ? AND closed = 1 ORDER BY created_at DESC LIMIT 1",
+                (account, report_type, date_from, date_to)).fetchone()
+        logger.info(f'Кеш отчетов {"попадание" if row else "промах"}: {report_type} {date_from} - {date_to} {account}')
+        return json.loads(row[0]) if row else None
+
+    def get(self, account: str, report_type: str, date_from: str, date_to: str,
+            content_hash: str) -> Optional[List[str]]:
+        """Get file_ids of report with the same content - file_id уже загруженного отчета с тем же содержимым"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_ids FROM report_files WHERE account = ? AND report_type = ? AND date_from = ? "
+                "AND date_to = ? AND content_hash = ?",
+                (account, report_type, date_from, date_to, content_hash)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, account: str, report_type: str, date_from: str, date_to: str, content_hash: str,
+            file_ids: List[str]):
+        """
+        Save uploaded report - Сохранение file_id загруженных частей отчета
+
+        Остальные версии отчета с тем же ключом удаляются, хранится только последняя.
+        """
+        key = (account, report_type, date_from, date_to)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM report_files WHERE account = ? AND report_type = ? AND date_from = ? AND date_to = ?", key)
+            self._conn.execute(
+                "INSERT INTO report_files (account, report_type, date_from, date_to, content_hash, file_ids, "
+                "closed, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (*key, content_hash, json.dumps(file_ids), int(self.is_closed(date_to)), time.time()))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
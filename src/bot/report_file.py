@@ -0,0 +1,150 @@
+import hashlib
+import os
+import tempfile
+import zipfile
+from dataclasses import dataclass
+from typing import IO, Iterator, List, Optional
+from utils.env import REPORT_SPOOL_SIZE, REPORT_UPLOAD_LIMIT, REPORT_COMPRESS_MIN_SIZE
+from bot.logger import WBLogger
+
+logger = WBLogger(__name__).get_logger()
+
+# запас на данные, еще не сброшенные компрессором в файл части
+ZIP_FLUSH_MARGIN = 1 << 20
+
+
+@dataclass
+class ReportPart:
+    """Файл для отправки в Telegram"""
+    filename: str
+    file: IO[bytes]
+    size: int
+
+
+class ReportFile:
+    """
+    Report rendered to temporary buffer - Отчет во временном буфере с упаковкой для отправки
+
+    CSV пишется в SpooledTemporaryFile: до spool_size байт в памяти, дальше во временном
+    файле, который удаляется при закрытии. Перед отправкой отчет больше compress_min_size
+    упаковывается в zip, если это уменьшает размер, а если он не помещается в
+    upload_limit, делится по строкам на пронумерованные части с заголовком в каждой.
+
+    Использование:
+        with ReportFile('sales.csv') as report:
+            parser.save_to_csv(data, report.buffer, ...)
+            for part in report.package():
+                ...
+    """
+    def __init__(self, filename: str, spool_size: int = REPORT_SPOOL_SIZE,
+                 upload_limit: int = REPORT_UPLOAD_LIMIT, compress_min_size: int = REPORT_COMPRESS_MIN_SIZE):
+        self.filename = os.path.basename(filename)
+        self.spool_size = spool_size
+        self.upload_limit = upload_limit
+        self.compress_min_size = compress_min_size
+        self.buffer = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        self.parts: List[ReportPart] = []
+        self.content_hash: Optional[str] = None
+
+    def __enter__(self) -> 'ReportFile':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def size(self) -> int:
+        self.buffer.seek(0, os.SEEK_END)
+        return self.buffer.tell()
+
+    def package(self) -> List[ReportPart]:
+        """
+        Prepare parts for upload - Подготовка частей отчета к отправке
+
+        :return: list of ReportPart, files are positioned at start
+        """
+        size = self.size
+        self.content_hash = self._hash()
+        if size < self.compress_min_size and size <= self.upload_limit:
+            self.parts = [ReportPart(self.filename, self.buffer, size)]
+        else:
+            self.parts = self._zip_parts()
+            # zip без выигрыша в размере не нужен, если отчет помещается целиком
+            if len(self.parts) == 1 and self.parts[0].size >= size and size <= self.upload_limit:
+                self.parts[0].file.close()
+                self.parts = [ReportPart(self.filename, self.buffer, size)]
+        for part in self.parts:
+            part.file.seek(0)
+        logger.info(f'Отчет {self.filename}: {size} байт, части: {[(part.filename, part.size) for part in self.parts]}')
+        return self.parts
+
+    def _hash(self) -> str:
+        digest = hashlib.sha256()
+        self.buffer.seek(0)
+        while chunk := self.buffer.read(1 << 20):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def _iter_records(self) -> Iterator[bytes]:
+        """
+        CSV records of buffer - Записи csv из буфера
+
+        Перевод строки внутри значения в кавычках не разделяет записи: запись продолжается,
+        пока количество кавычек в ней нечетное.
+        """
+        self.buffer.seek(0)
+        record = b''
+        for line in self.buffer:
+            record += line
+            if record.count(b'"') % 2 == 0:
+                yield record
+                record = b''
+        if record:
+            yield record
+
+    def _zip_parts(self) -> List[ReportPart]:
+        """Упаковка в zip с делением на части не больше upload_limit"""
+        stem = os.path.splitext(self.filename)[0]
+        records = self._iter_records()
+        header = next(records, b'')
+        parts = []
+        part_limit = max(self.upload_limit - ZIP_FLUSH_MARGIN, self.upload_limit // 2)
+        archive = entry = None
+        for record in records:
+            if archive is None:
+                archive, entry = self._open_part(stem, len(parts) + 1, header)
+            entry.write(record)
+            if archive.fp.tell() >= part_limit:
+                parts.append(self._close_part(stem, len(parts) + 1, archive, entry))
+                archive = entry = None
+        if archive is None and not parts:
+            # отчет без строк - только заголовок
+            archive, entry = self._open_part(stem, 1, header)
+        if archive is not None:
+            parts.append(self._close_part(stem, len(parts) + 1, archive, entry))
+        if len(parts) == 1:
+            parts[0].filename = f'{stem}.zip'
+        return parts
+
+    def _open_part(self, stem: str, number: int, header: bytes):
+        # первая часть называется как исходный файл, остальные нумеруются
+        name = f'{stem}.csv' if number == 1 else f'{stem}.part{number}.csv'
+        archive = zipfile.ZipFile(tempfile.SpooledTemporaryFile(max_size=self.spool_size), 'w',
+                                  compression=zipfile.ZIP_DEFLATED)
+        entry = archive.open(name, 'w', force_zip64=True)
+        entry.write(header)
+        return archive, entry
+
+    def _close_part(self, stem: str, number: int, archive: zipfile.ZipFile, entry) -> ReportPart:
+        entry.close()
+        file = archive.fp
+        # закрытие ZipFile не закрывает переданный ему файловый объект
+        archive.close()
+        file.seek(0, os.SEEK_END)
+        return ReportPart(f'{stem}.part{number}.zip', file, file.tell())
+
+    def close(self):
+        """Закрытие буфера и частей, временные файлы удаляются"""
+        for part in self.parts:
+            part.file.close()
+        self.buffer.close()
@@ -0,0 +1,166 @@
+import asyncio
+import itertools
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+from utils.env import REPORT_PROGRESS_INTERVAL, REPORT_JOBS_HISTORY
+from bot.logger import WBLogger
+
+logger = WBLogger(__name__).get_logger()
+
+REPORT_TITLES = {
+    'sales': 'Отчет по продажам',
+    'sales_summary': 'Сводка по продажам',
+    'operations': 'Отчет по операциям',
+    'managers': 'Отчет по менеджерам',
+    'managers_kpi': 'KPI менеджеров',
+}
+
+
+class ReportJob:
+    """
+    Report job state - Состояние задачи формирования отчета
+
+    Состояние меняется из потока пула отчетов (прогресс) и из обработчиков бота (отмена),
+    слушатели вызываются в потоке, изменившем состояние.
+    """
+    QUEUED = 'queued'
+    FETCHING = 'fetching'
+    WRITING = 'writing'
+    DONE = 'done'
+    CANCELLED = 'cancelled'
+    FAILED = 'failed'
+    FINISHED_STATES = (DONE, CANCELLED, FAILED)
+
+    STATE_TEXTS = {
+        QUEUED: 'в очереди',
+        FETCHING: 'загрузка данных',
+        WRITING: 'запись файла',
+        DONE: 'готов',
+        CANCELLED: 'отменен',
+        FAILED: 'ошибка',
+    }
+
+    def __init__(self, job_id: int, user_id: int, report_type: str, date_from: str, date_to: str):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.report_type = report_type
+        self.date_from = date_from
+        self.date_to = date_to
+        self.state = self.QUEUED
+        self.done = 0
+        self.total = 0
+        self.created_at = time.time()
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.listeners: List[Callable[['ReportJob'], None]] = []
+
+    @property
+    def finished(self) -> bool:
+        return self.state in self.FINISHED_STATES
+
+    def update(self, state: str = None, done: int = None, total: int = None):
+        """Change job state and notify listeners - Изменение состояния задачи"""
+        if self.finished:
+            return
+        if state is not None:
+            self.state = state
+        if done is not None:
+            self.done = done
+        if total is not None:
+            self.total = total
+        if self.finished:
+            self.finished_at = time.time()
+        for listener in self.listeners:
+            try:
+                listener(self)
+            except Exception as e:
+                logger.error(f'Ошибка уведомления о состоянии отчета {self.job_id}: {e}')
+
+    def set_progress(self, done: int, total: int):
+        """Progress callback for ParserWB - Прогресс загрузки по офисам или окнам дат"""
+        self.update(self.FETCHING, done, total)
+
+    def cancel(self):
+        """Request cancellation - Отмена, загрузка прерывается на границе офиса или окна дат"""
+        self.cancel_event.set()
+        self.update()
+
+    def describe(self) -> str:
+        title = REPORT_TITLES.get(self.report_type, self.report_type)
+        text = f'{title} {self.date_from} - {self.date_to}: {self.STATE_TEXTS[self.state]}'
+        if self.state == self.FETCHING and self.total:
+            text += f' {self.done}/{self.total}'
+        if self.cancel_event.is_set() and not self.finished:
+            text += ' (отменяется)'
+        return text
+
+
+class ReportJobs:
+    """Registry of report jobs by user - Реестр задач формирования отчетов по пользователям"""
+    def __init__(self, history: int = REPORT_JOBS_HISTORY):
+        # количество хранимых завершенных задач на пользователя
+        self.history = history
+        self._jobs: Dict[int, List[ReportJob]] = defaultdict(list)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def create(self, user_id: int, report_type: str, date_from: str, date_to: str) -> ReportJob:
+        with self._lock:
+            job = ReportJob(next(self._ids), user_id, report_type, date_from, date_to)
+            jobs = self._jobs[user_id]
+            jobs.append(job)
+            finished = [item for item in jobs if item.finished]
+            for item in finished[:max(len(finished) - self.history, 0)]:
+                jobs.remove(item)
+            return job
+
+    def user_jobs(self, user_id: int) -> List[ReportJob]:
+        with self._lock:
+            return list(self._jobs.get(user_id, []))
+
+    def active(self, user_id: int) -> List[ReportJob]:
+        return [job for job in self.user_jobs(user_id) if not job.finished]
+
+    def cancel(self, user_id: int) -> List[ReportJob]:
+        """Cancel all active user jobs - Отмена всех незавершенных отчетов пользователя"""
+        jobs = self.active(user_id)
+        for job in jobs:
+            job.cancel()
+        return jobs
+
+
+class TelegramProgress:
+    """
+    Job progress in one Telegram message - Прогресс задачи в одном редактируемом сообщении
+
+    Вызывается из потока пула, редактирование сообщения передается в event loop бота.
+    Промежуточные состояния отправляются не чаще interval секунд, итоговое - всегда.
+    """
+    def __init__(self, bot, loop: asyncio.AbstractEventLoop, chat_id: int, message_id: int,
+                 interval: float = REPORT_PROGRESS_INTERVAL):
+        self.bot = bot
+        self.loop = loop
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.interval = interval
+        self._last_text: Optional[str] = None
+        self._last_sent = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, job: ReportJob):
+        text = job.describe()
+        with self._lock:
+            now = time.monotonic()
+            if text == self._last_text or (not job.finished and now - self._last_sent < self.interval):
+                return
+            self._last_text, self._last_sent = text, now
+        future = asyncio.run_coroutine_threadsafe(
+            self.bot.edit_message_text(text=text, chat_id=self.chat_id, message_id=self.message_id), self.loop)
+        future.add_done_callback(self._log_error)
+
+    @staticmethod
+    def _log_error(future):
+        if not future.cancelled() and future.exception():
+            logger.error(f'Не удалось обновить сообщение о прогрессе отчета: {future.exception()}')
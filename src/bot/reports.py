@@ -0,0 +1,297 @@
+import asyncio
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import date, timedelta
+from functools import partial
+from typing import IO, Any, Callable, Dict, Iterable, Iterator, List, Optional
+from requests import Session
+from parser.api import ParserWB, AccountSnapshot, SaleBatch, to_date
+from parser.auth_api import AuthApi
+from parser.store import SalesStore, DayStore
+from parser.sessions import session_registry
+from parser.response_cache import ResponseCache
+from parser.employees import EmployeeDirectory, attach_batch_barcodes, batch_phones
+from parser.kpi import EmployeeDayMatrix
+from parser.rollups import GRAINS, SalesRollup, write_summary_csv
+from parser.column_names import sale_data_column_names_mapping
+from utils.env import REPORT_WORKERS, REPORTS_PER_USER, PREFETCH_DAYS, PREFETCH_WORKERS
+from db.reports import WarehouseReports
+from bot.logger import WBLogger
+from bot.report_jobs import ReportJob
+from bot.report_file import ReportFile, ReportPart
+
+logger = WBLogger(__name__).get_logger()
+
+# префиксы имен файлов отчетов
+REPORT_FILE_PREFIXES = {
+    'sales': 'sales_data',
+    'operations': 'operations_data',
+    'managers': 'manager_operations_data',
+    'managers_kpi': 'manager_kpi_data',
+    'sales_summary': 'sales_summary_data',
+}
+
+
+class ReportLimitError(Exception):
+    """Превышено количество одновременных отчетов пользователя"""
+
+
+@dataclass
+class ReportRequest:
+    """Параметры отчета, зафиксированные в момент запроса"""
+    user_id: int
+    chat_id: int
+    phone: str
+    report_type: str
+    date_from: str
+    date_to: str
+    session: Session
+    account_snapshot: Optional[AccountSnapshot] = None
+    # отчет по подписке не учитывается в лимите отчетов пользователя
+    scheduled: bool = False
+
+
+@dataclass
+class ReportResult:
+    report: ReportFile
+    account_snapshot: Optional[AccountSnapshot] = None
+    # запросы к API, не выполненные после всех повторов: данные отчета неполные
+    request_errors: Optional[Counter] = None
+
+    @property
+    def parts(self) -> List[ReportPart]:
+        return self.report.parts
+
+    @property
+    def content_hash(self) -> Optional[str]:
+        """sha256 содержимого csv для кеша отправленных отчетов"""
+        return self.report.content_hash
+
+    def close(self):
+        self.report.close()
+
+
+def _on_exhausted(rows: Iterable, callback: Callable[[], None]) -> Iterator:
+    """Вызов callback после того, как строки полностью получены"""
+    yield from rows
+    callback()
+
+
+def prefetch_account(session: Session, sales_store: SalesStore = None,
+                     days: int = PREFETCH_DAYS) -> Optional[AccountSnapshot]:
+    """
+    Prefetch account data - Фоновая загрузка данных аккаунта сразу после авторизации
+
+    Пока пользователь выбирает отчет и даты, загружается снимок /account (офисы,
+    сотрудники, supplier_id) и продажи за последние days дней в sales_store.
+    Отчет затем берет снимок и свежие дни продаж без повторных запросов.
+
+    :param session: authorized franchise session
+    :param sales_store: local store for daily sales
+    :param days: number of recent days of sales including today
+    :return: account snapshot or None if /account request failed
+    """
+    parser = ParserWB(session, sales_store=sales_store)
+    if parser.get_account_snapshot() is None:
+        return None
+    # офисы и сотрудники берутся из уже полученного снимка
+    parser.fetch_offices()
+    parser.fetch_employees()
+    if sales_store is not None and days > 0:
+        date_to = date.today()
+        try:
+            for _ in parser.iter_sales_batches(date_from=date_to - timedelta(days=days - 1), date_to=date_to):
+                pass
+        except Exception as e:
+            logger.error(f"Failed to prefetch sales: {e}")
+    logger.info(f"Prefetch requests to WB API: {dict(parser.request_counts)}")
+    return parser.account_snapshot
+
+
+def build_report(request: ReportRequest, sales_store: SalesStore = None, day_store: DayStore = None,
+                 response_cache: ResponseCache = None, warehouse_reports: WarehouseReports = None,
+                 job: ReportJob = None) -> ReportResult:
+    """
+    Build report file - Формирование файла отчета
+
+    Синхронная выгрузка из API WB и запись csv во временный буфер, выполняется в потоке
+    пула ReportRunner. Если передана задача, в нее пишется прогресс, а ее отмена
+    прерывает загрузку исключением ReportCancelled. Буфер закрывается ReportResult.close().
+    Если задано хранилище отчетов, csv пишется запросами к нему, а из API загружаются
+    только отсутствующие в нем дни.
+
+    :param request: report parameters
+    :param sales_store: local store for daily sales
+    :param day_store: local store for daily operations and employee operations
+    :param response_cache: on-disk cache of API responses
+    :param warehouse_reports: SQL report builder over local warehouse
+    :param job: report job for progress and cancellation
+    :return: ReportResult with packaged report parts and account snapshot for reuse
+    """
+    parser = ParserWB(request.session, account_snapshot=request.account_snapshot, sales_store=sales_store,
+                      day_store=day_store, response_cache=response_cache,
+                      progress=job.set_progress if job else None,
+                      cancel_event=job.cancel_event if job else None)
+    # после получения всех строк остается только запись файла
+    writing = (lambda: job.update(ReportJob.WRITING)) if job else (lambda: None)
+    if job:
+        job.update(ReportJob.FETCHING)
+    parser._check_cancelled()
+    logger.info(" Begin to fetch offices")
+    parser.fetch_offices()
+    logger.info(" End of fetch offices")
+    logger.info(" Begin to fetch employees")
+    parser.fetch_employees()
+    logger.info(" End of fetch employees")
+    date_from_str, date_to_str = request.date_from, request.date_to
+    report = ReportFile(f"{REPORT_FILE_PREFIXES.get(request.report_type, request.report_type)}_"
+                        f"{date_from_str} - {date_to_str} - {request.phone}.csv")
+    try:
+        if warehouse_reports is not None and parser.supplier_id is not None:
+            _write_warehouse_report(warehouse_reports, parser, request, report.buffer, writing)
+        else:
+            _write_report(parser, request, report.buffer, writing)
+        report.package()
+    except BaseException:
+        report.close()
+        raise
+    logger.info(f"Requests to WB API: {dict(parser.request_counts)}")
+    logger.info(f"HTTP connection reuse: {session_registry.stats()}")
+    if response_cache is not None:
+        logger.info(f"Response cache: {dict(response_cache.stats)}")
+    if parser.request_errors:
+        logger.error(f"Report is incomplete, failed requests: {dict(parser.request_errors)}")
+    return ReportResult(report=report, account_snapshot=parser.account_snapshot,
+                        request_errors=parser.request_errors)
+
+
+def _write_report(parser: ParserWB, request: ReportRequest, buffer: IO[bytes], writing: Callable[[], None]):
+    """Выгрузка данных отчета пачками по колонкам и запись csv в буфер"""
+    date_from_str, date_to_str = request.date_from, request.date_to
+    if request.report_type == "sales":
+        logger.info("Begin to fetch sales data")
+        batches = _on_exhausted(parser.iter_sales_batches(date_from=date_from_str, date_to=date_to_str), writing)
+        batches = (batch.fillna(SaleBatch.REPORT_FILL) for batch in batches)
+        parser.save_batches_to_csv(batches, buffer, column_names_mapings=sale_data_column_names_mapping,
+                                   columns=list(SaleBatch.FIELDS))
+    elif request.report_type == "sales_summary":
+        logger.info("Begin to fetch sales data for summary")
+        batch = SaleBatch.concat(list(parser.iter_sales_batches(date_from=date_from_str, date_to=date_to_str)))
+        parser._check_cancelled()
+        writing()
+        rollups = [SalesRollup.from_batches([batch], grain, date_from_str) for grain in GRAINS]
+        write_summary_csv(rollups, buffer, parser.offices)
+    elif request.report_type == "operations":
+        logger.info("Begin to fetch operations data")
+        batches = _on_exhausted(parser.iter_operation_batches(date_from=date_from_str, date_to=date_to_str), writing)
+        parser.save_operation_batches_to_csv(batches, buffer)
+    elif request.report_type == "managers":
+        logger.info(f'Begin to fetch managers data')
+        batches = list(parser.iter_employee_operation_batches(date_from=date_from_str, date_to=date_to_str))
+        directory = EmployeeDirectory(parser.employees)
+        api_parser = AuthApi()
+        api_parser.get_token()
+        entries_by_phone = api_parser.get_employees_data(batch_phones(batches, directory))
+        # ШК офиса проставляется по журналу входов одним соединением по (телефон, дата)
+        for batch in batches:
+            attach_batch_barcodes(batch, directory, entries_by_phone)
+        parser._check_cancelled()
+        writing()
+        parser.save_managers_batches_to_csv(batches, buffer, directory)
+    elif request.report_type == "managers_kpi":
+        logger.info(f'Begin to fetch managers data for KPI')
+        directory = EmployeeDirectory(parser.employees)
+        batches = parser.iter_employee_operation_batches(date_from=date_from_str, date_to=date_to_str)
+        matrix = EmployeeDayMatrix.from_batches(batches, date_from_str, date_to_str, staff=directory.ids())
+        parser._check_cancelled()
+        writing()
+        matrix.write_kpi_csv(buffer, directory)
+
+
+def _write_warehouse_report(warehouse_reports: WarehouseReports, parser: ParserWB, request: ReportRequest,
+                            buffer: IO[bytes], writing: Callable[[], None]):
+    """Запись csv отчета из хранилища с догрузкой недостающих дней из API"""
+    date_from, date_to = to_date(request.date_from), to_date(request.date_to)
+    if request.report_type == "sales":
+        warehouse_reports.write_sales(parser, date_from, date_to, buffer, writing)
+    elif request.report_type == "sales_summary":
+        warehouse_reports.write_sales_summary(parser, date_from, date_to, buffer, writing)
+    elif request.report_type == "operations":
+        warehouse_reports.write_operations(parser, date_from, date_to, buffer, writing)
+    elif request.report_type == "managers":
+        def load_entries(phones: List[str]):
+            api_parser = AuthApi()
+            api_parser.get_token()
+            return api_parser.get_employees_data(phones)
+
+        warehouse_reports.write_managers(parser, date_from, date_to, buffer, load_entries, writing)
+    elif request.report_type == "managers_kpi":
+        warehouse_reports.write_manager_kpis(parser, date_from, date_to, buffer, writing)
+
+
+class ReportRunner:
+    """
+    Report worker pool - Пул потоков для формирования отчетов вне event loop бота
+
+    Всего одновременно формируется не более max_workers отчетов, остальные ждут
+    в очереди пула. Одному пользователю разрешено не более per_user отчетов
+    (выполняемых и ожидающих), следующий запрос отклоняется ReportLimitError.
+    Отчеты по подпискам выполняются без этого лимита: планировщик отправляет их по
+    одному, и отчет, запрошенный пользователем вручную, не отменяет отправку по расписанию.
+    Фоновая предзагрузка выполняется в отдельном пуле из prefetch_workers потоков,
+    поэтому поток авторизаций не занимает потоки отчетов.
+    """
+    def __init__(self, max_workers: int = REPORT_WORKERS, per_user: int = REPORTS_PER_USER,
+                 prefetch_workers: int = PREFETCH_WORKERS):
+        self.max_workers = max_workers
+        self.per_user = per_user
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='report')
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=prefetch_workers, thread_name_prefix='prefetch')
+        self._active: Dict[int, int] = Counter()
+        self._lock = threading.Lock()
+
+    def active(self, user_id: int) -> int:
+        """Количество отчетов пользователя в работе"""
+        with self._lock:
+            return self._active[user_id]
+
+    def _acquire(self, user_id: int):
+        with self._lock:
+            if self._active[user_id] >= self.per_user:
+                raise ReportLimitError(f'Пользователь {user_id} уже формирует {self._active[user_id]} отчет(а)')
+            self._active[user_id] += 1
+
+    def _release(self, user_id: int):
+        with self._lock:
+            self._active[user_id] -= 1
+            if self._active[user_id] <= 0:
+                del self._active[user_id]
+
+    async def run(self, user_id: int, func: Callable, *args, limited: bool = True, **kwargs) -> Any:
+        """
+        Run blocking function in pool - Выполнение блокирующей функции в пуле без блокировки event loop
+
+        Слот пользователя занимается сразу, поэтому лимит проверяется до постановки в очередь.
+
+        :param limited: apply per_user limit, False for scheduled reports
+        :raises ReportLimitError: if user has too many reports in progress
+        """
+        loop = asyncio.get_running_loop()
+        if not limited:
+            return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+        self._acquire(user_id)
+        try:
+            return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+        finally:
+            self._release(user_id)
+
+    async def prefetch(self, func: Callable, *args, **kwargs) -> Any:
+        """Фоновая предзагрузка в пуле предзагрузки, слот пользователя не занимается"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.prefetch_executor, partial(func, *args, **kwargs))
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+        self.prefetch_executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,165 @@
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Callable, List, Optional, Tuple
+import schedule
+from utils.env import LOCAL_STORE_PATH, SCHEDULE_WARM_TIME, SCHEDULE_REPORT_TIME
+from parser.store import SalesStore, DayStore
+from parser.warmup import warm_accounts
+from bot.logger import WBLogger
+
+logger = WBLogger(__name__).get_logger()
+
+FREQUENCIES = ('daily', 'weekly', 'monthly')
+
+
+def report_period(frequency: str, today: date) -> Tuple[date, date]:
+    """
+    Period of scheduled report - Период отчета по подписке
+
+    daily - вчерашний день, weekly - прошлая неделя с понедельника по воскресенье,
+    monthly - прошлый календарный месяц.
+    """
+    if frequency == 'daily':
+        day = today - timedelta(days=1)
+        return day, day
+    if frequency == 'weekly':
+        monday = today - timedelta(days=today.weekday() + 7)
+        return monday, monday + timedelta(days=6)
+    if frequency == 'monthly':
+        last_day = today.replace(day=1) - timedelta(days=1)
+        return last_day.replace(day=1), last_day
+    raise ValueError(f'Неизвестная периодичность {frequency}')
+
+
+def is_due(frequency: str, today: date) -> bool:
+    """Отчет отправляется ежедневно, по понедельникам или первого числа месяца"""
+    return (frequency == 'daily' or (frequency == 'weekly' and today.weekday() == 0)
+            or (frequency == 'monthly' and today.day == 1))
+
+
+@dataclass
+class Subscription:
+    subscription_id: int
+    user_id: int
+    chat_id: int
+    phone: str
+    report_type: str
+    frequency: str
+
+
+class SubscriptionStore:
+    """
+    Report subscriptions and known accounts - Подписки на отчеты и аккаунты для ночного прогрева (SQLite)
+    """
+    def __init__(self, path: str = LOCAL_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS report_subscriptions (
+                    subscription_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    chat_id INTEGER NOT NULL,
+                    phone TEXT NOT NULL,
+                    report_type TEXT NOT NULL,
+                    frequency TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    UNIQUE (user_id, phone, report_type, frequency)
+                )""")
+            # аккаунты, авторизованные в боте, данные по ним прогреваются ночью
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS known_accounts (
+                    phone TEXT PRIMARY KEY,
+                    last_seen REAL NOT NULL
+                )""")
+
+    def subscribe(self, user_id: int, chat_id: int, phone: str, report_type: str, frequency: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO report_subscriptions (user_id, chat_id, phone, report_type, frequency, "
+                "created_at) VALUES (?, ?, ?, ?, ?, ?)", (user_id, chat_id, phone, report_type, frequency, time.time()))
+
+    def unsubscribe(self, user_id: int) -> int:
+        """Удаление всех подписок пользователя, возвращает их количество"""
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM report_subscriptions WHERE user_id = ?", (user_id,)).rowcount
+
+    def subscriptions(self, user_id: Optional[int] = None) -> List[Subscription]:
+        query = "SELECT subscription_id, user_id, chat_id, phone, report_type, frequency FROM report_subscriptions"
+        params = ()
+        if user_id is not None:
+            query += " WHERE user_id = ?"
+            params = (user_id,)
+        with self._lock:
+            return [Subscription(*row) for row in self._conn.execute(query + " ORDER BY subscription_id", params)]
+
+    def touch_account(self, phone: str):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO known_accounts (phone, last_seen) VALUES (?, ?)",
+                               (phone, time.time()))
+
+    def accounts(self) -> List[str]:
+        """Аккаунты для прогрева - авторизованные в боте и с подписками"""
+        with self._lock:
+            rows = self._conn.execute("SELECT phone FROM known_accounts UNION SELECT phone FROM report_subscriptions")
+            return sorted(row[0] for row in rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class BotScheduler:
+    """
+    Background scheduler - Фоновый планировщик прогрева данных и отчетов по подпискам
+
+    Задачи schedule выполняются в отдельном потоке. Ночью прогреваются данные за
+    вчерашний день по всем известным аккаунтам, утром по подпискам, срок которых
+    наступил, вызывается deliver(subscription, date_from, date_to) - отправка отчета ботом.
+    """
+    def __init__(self, subscriptions: SubscriptionStore, sales_store: SalesStore, day_store: DayStore,
+                 deliver: Callable[[Subscription, date, date], None],
+                 warm_time: str = SCHEDULE_WARM_TIME, report_time: str = SCHEDULE_REPORT_TIME):
+        self.subscriptions = subscriptions
+        self.sales_store = sales_store
+        self.day_store = day_store
+        self.deliver = deliver
+        self.scheduler = schedule.Scheduler()
+        self.scheduler.every().day.at(warm_time).do(self.warm)
+        self.scheduler.every().day.at(report_time).do(self.push_reports)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='scheduler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.scheduler.run_pending()
+            except Exception as e:
+                logger.error(f'Ошибка задачи планировщика: {e}')
+            self._stop.wait(30)
+
+    def warm(self):
+        """Прогрев данных за вчерашний день"""
+        warm_accounts(self.subscriptions.accounts(), self.sales_store, self.day_store)
+
+    def push_reports(self, today: Optional[date] = None):
+        """Отправка отчетов по подпискам, срок которых наступил"""
+        today = today or date.today()
+        for subscription in self.subscriptions.subscriptions():
+            if not is_due(subscription.frequency, today):
+                continue
+            date_from, date_to = report_period(subscription.frequency, today)
+            try:
+                self.deliver(subscription, date_from, date_to)
+            except Exception as e:
+                logger.error(f'Ошибка отправки отчета по подписке {subscription.subscription_id}: {e}')
@@ -0,0 +1,288 @@
+import threading
+from datetime import date
+from typing import IO, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+import numpy as np
+from sqlalchemy import String, and_, bindparam, cast, func, select
+from sqlalchemy.engine import Connection
+from db.warehouse import Warehouse, daily_sales, reward_accruals, operations, employees, \
+    employee_daily_operations, entry_barcodes, ids_key
+from parser.api import ParserWB, EmployeeOperations, SaleBatch
+from parser.columnar import integral
+from parser.employees import EmployeeDirectory
+from parser.kpi import METRICS, EmployeeDayMatrix
+from parser.rollups import GRAINS, write_summary_csv
+from parser.column_names import sale_data_column_names_mapping
+from parser.csv_writer import StreamingCsvWriter
+from bot.logger import WBLogger
+
+logger = WBLogger(__name__).get_logger()
+
+
+# в хранилище суммы хранятся как float, integral() возвращает целые значения целыми, как в ответе API
+
+# колонки отчета по продажам в порядке полей SaleData
+SALES_COLUMNS = ['office_id', 'name', 'date', 'sale_count', 'return_count', 'sale_sum', 'return_sum', 'proceeds',
+                 'amount', 'bags_sum', 'office_rating', 'percent', 'office_rating_sum', 'supplier_return_sum']
+
+# продажи офиса за период: соединение продаж и вознаграждений по первичному ключу,
+# дата отдается строкой YYYY-MM-DD, как она выводится в csv, рейтинг дня без начисления (NULL) - нулем
+SALES_QUERY = select(
+    daily_sales.c.office_id, daily_sales.c.name, cast(daily_sales.c.date, String), daily_sales.c.sale_count,
+    daily_sales.c.return_count, daily_sales.c.sale_sum, daily_sales.c.return_sum, daily_sales.c.proceeds,
+    reward_accruals.c.amount, reward_accruals.c.bags_sum,
+    func.coalesce(reward_accruals.c.office_rating, SaleBatch.REPORT_FILL['office_rating']),
+    reward_accruals.c.percent, reward_accruals.c.office_rating_sum, reward_accruals.c.supplier_return_sum,
+).select_from(daily_sales.join(reward_accruals, and_(
+    reward_accruals.c.supplier_id == daily_sales.c.supplier_id,
+    reward_accruals.c.office_id == daily_sales.c.office_id,
+    reward_accruals.c.date == daily_sales.c.date,
+))).where(
+    daily_sales.c.supplier_id == bindparam('supplier_id'),
+    daily_sales.c.office_id == bindparam('office_id'),
+    daily_sales.c.date.between(bindparam('date_from'), bindparam('date_to')),
+).order_by(daily_sales.c.date)
+
+# операции за период в порядке ответа API: вложенные операции идут сразу за родительской
+OPERATIONS_QUERY = select(
+    cast(operations.c.date, String), operations.c.oper_type, operations.c.oper_amount, operations.c.comment,
+).where(
+    operations.c.supplier_id == bindparam('supplier_id'),
+    operations.c.date.between(bindparam('date_from'), bindparam('date_to')),
+).order_by(operations.c.date, operations.c.seq)
+
+# операции сотрудника по дням с данными сотрудника и ШК офиса из журнала входов по (телефон, дата)
+MANAGERS_QUERY = select(
+    cast(employee_daily_operations.c.date, String).label('date'), employee_daily_operations.c.on_place_cnt,
+    employee_daily_operations.c.return_count, employee_daily_operations.c.return_sum,
+    employee_daily_operations.c.sale_count, employee_daily_operations.c.sale_sum,
+    employees.c.last_name, employees.c.first_name, employees.c.middle_name, employees.c.phone,
+    employees.c.create_date, employees.c.rating, entry_barcodes.c.barcode,
+).select_from(employee_daily_operations.outerjoin(employees, and_(
+    employees.c.supplier_id == employee_daily_operations.c.supplier_id,
+    employees.c.employee_id == employee_daily_operations.c.employee_id,
+)).outerjoin(entry_barcodes, and_(
+    entry_barcodes.c.phone == employees.c.phone,
+    entry_barcodes.c.date == employee_daily_operations.c.date,
+))).where(
+    employee_daily_operations.c.supplier_id == bindparam('supplier_id'),
+    employee_daily_operations.c.employee_id == bindparam('employee_id'),
+    employee_daily_operations.c.date.between(bindparam('date_from'), bindparam('date_to')),
+).order_by(employee_daily_operations.c.date)
+
+# показатели всех сотрудников за период для матрицы KPI
+KPI_QUERY = select(
+    employee_daily_operations.c.employee_id, cast(employee_daily_operations.c.date, String),
+    *(employee_daily_operations.c[name] for name in METRICS),
+).where(
+    employee_daily_operations.c.supplier_id == bindparam('supplier_id'),
+    employee_daily_operations.c.date.between(bindparam('date_from'), bindparam('date_to')),
+)
+
+
+class WarehouseReports:
+    """
+    SQL report builder - Формирование отчетов запросами к хранилищу
+
+    Перед отчетом у API запрашиваются только дни, которых нет в хранилище или которые
+    устарели, они загружаются в хранилище и отмечаются загруженными. Затем csv пишется
+    запросами по первичным ключам таблиц в том же формате, что и при выгрузке из API.
+    Загрузка и чтение данных одного аккаунта выполняются под общей блокировкой, чтобы
+    одновременные отчеты не читали период, который в этот момент загружается заново.
+    """
+    def __init__(self, warehouse: Warehouse = None):
+        self.warehouse = warehouse or Warehouse()
+        self.warehouse.create_tables()
+        self._lock = threading.Lock()
+        self._account_locks: Dict[Tuple[int, str], threading.Lock] = {}
+
+    def lock(self, supplier_id: int, dataset: str) -> threading.Lock:
+        """Блокировка загрузки и чтения данных аккаунта"""
+        with self._lock:
+            return self._account_locks.setdefault((supplier_id, dataset), threading.Lock())
+
+    def _sync(self, parser: ParserWB, dataset: str, key: str, date_from: date, date_to: date,
+              load: Callable[[ParserWB, date, date], None]):
+        """Догрузка из API диапазонов, которых нет в хранилище"""
+        warehouse = self.warehouse
+        for range_from, range_to in warehouse.missing_ranges(parser.supplier_id, dataset, key, date_from, date_to):
+            logger.info(f'Загрузка {dataset} в хранилище за {range_from} - {range_to}')
+            errors = sum(parser.request_errors.values())
+            # исключение при загрузке откатывает ее транзакцию и прерывает синхронизацию до отметки
+            load(parser, range_from, range_to)
+            # диапазон с ошибками запросов, в том числе перехваченными парсером, не отмечается
+            # и будет запрошен снова
+            if sum(parser.request_errors.values()) == errors:
+                warehouse.mark_loaded(parser.supplier_id, dataset, key, range_from, range_to)
+
+    def _load_sales(self, parser: ParserWB, date_from: date, date_to: date):
+        self.warehouse.replace_sales(parser.supplier_id, date_from, date_to,
+                                     parser.iter_sales_batches(date_from=date_from, date_to=date_to))
+
+    def _load_operations(self, parser: ParserWB, date_from: date, date_to: date):
+        self.warehouse.replace_operations(parser.supplier_id, date_from, date_to,
+                                          parser.iter_operations(date_from=date_from, date_to=date_to))
+
+    def _load_employee_operations(self, parser: ParserWB, date_from: date, date_to: date):
+        self.warehouse.replace_employee_operations(parser.supplier_id, date_from, date_to,
+                                                   parser.iter_employee_operations(date_from=date_from,
+                                                                                   date_to=date_to))
+
+    def _sync_sales(self, parser: ParserWB, date_from: date, date_to: date):
+        self.warehouse.load_offices(parser.supplier_id, parser.offices)
+        self._sync(parser, 'sales', ids_key(office.id for office in parser.offices), date_from, date_to,
+                   self._load_sales)
+
+    def write_sales(self, parser: ParserWB, date_from: date, date_to: date, filename: Union[str, IO[bytes]],
+                    writing: Callable[[], None] = None):
+        """
+        Sales report - Отчет по продажам офисов из хранилища
+
+        :param parser: parser with fetched offices and supplier_id
+        :param writing: called after missing data is loaded
+        """
+        supplier_id = parser.supplier_id
+        with self.lock(supplier_id, 'sales'):
+            self._sync_sales(parser, date_from, date_to)
+            parser._check_cancelled()
+            if writing:
+                writing()
+            with self.warehouse.engine.connect() as connection:
+                StreamingCsvWriter(filename, column_names_mapping=sale_data_column_names_mapping,
+                                   columns=SALES_COLUMNS).write_tuples(
+                    self._iter_sales(connection, supplier_id, parser.offices, date_from, date_to))
+
+    @staticmethod
+    def _iter_sales(connection: Connection, supplier_id: int, offices: Iterable, date_from: date,
+                    date_to: date) -> Iterator[List]:
+        # офисы в порядке снимка аккаунта, как при выгрузке из API
+        for office in offices:
+            rows = connection.execute(SALES_QUERY, {'supplier_id': supplier_id, 'office_id': office.id,
+                                                    'date_from': date_from, 'date_to': date_to}).all()
+            yield from map(integral, rows)
+
+    def write_sales_summary(self, parser: ParserWB, date_from: date, date_to: date,
+                            filename: Union[str, IO[bytes]], writing: Callable[[], None] = None):
+        """
+        Sales summary report - Сводка по продажам офисов по неделям, месяцам и за период
+
+        Полные недели и месяцы берутся из сумм sales_rollups, которые обновляются при
+        загрузке дней, поэтому сводка за год не перебирает дневные строки года.
+        """
+        supplier_id = parser.supplier_id
+        office_ids = np.array([office.id for office in parser.offices], dtype=np.int64)
+        with self.lock(supplier_id, 'sales'):
+            self._sync_sales(parser, date_from, date_to)
+            parser._check_cancelled()
+            if writing:
+                writing()
+            rollups = [self.warehouse.sales_summary(supplier_id, grain, date_from, date_to) for grain in GRAINS]
+        # только офисы текущего снимка аккаунта, как при выгрузке из API
+        write_summary_csv([rollup.take(np.isin(rollup.office_ids, office_ids)) for rollup in rollups], filename,
+                          parser.offices)
+
+    def write_operations(self, parser: ParserWB, date_from: date, date_to: date, filename: Union[str, IO[bytes]],
+                         writing: Callable[[], None] = None):
+        """Operations report - Отчет по операциям из хранилища"""
+        supplier_id = parser.supplier_id
+        with self.lock(supplier_id, 'operations'):
+            self._sync(parser, 'operations', '', date_from, date_to, self._load_operations)
+            parser._check_cancelled()
+            if writing:
+                writing()
+            with self.warehouse.engine.connect() as connection:
+                rows = (dict(zip(('date', 'oper_type', 'oper_amount', 'comment'), integral(row)))
+                        for row in connection.execute(OPERATIONS_QUERY, {'supplier_id': supplier_id,
+                                                                         'date_from': date_from, 'date_to': date_to}))
+                parser.save_operation_rows_to_csv(rows, filename)
+
+    def _sync_employee_operations(self, parser: ParserWB, date_from: date, date_to: date):
+        self.warehouse.load_employees(parser.supplier_id, parser.employees)
+        self._sync(parser, 'employees_operations', ids_key(employee.employee_id for employee in parser.employees),
+                   date_from, date_to, self._load_employee_operations)
+
+    def write_managers(self, parser: ParserWB, date_from: date, date_to: date, filename: Union[str, IO[bytes]],
+                       entries_loader: Callable[[List[str]], Dict[str, Optional[List[Dict]]]],
+                       writing: Callable[[], None] = None):
+        """
+        Managers report - Отчет по операциям сотрудников из хранилища
+
+        :param parser: parser with fetched employees and supplier_id
+        :param entries_loader: phones -> entry log records, e.g. AuthApi.get_employees_data
+        """
+        supplier_id = parser.supplier_id
+        with self.lock(supplier_id, 'employees_operations'):
+            self._sync_employee_operations(parser, date_from, date_to)
+            self._sync_entry_barcodes(supplier_id, [employee.phone for employee in parser.employees if employee.phone],
+                                      date_from, date_to, entries_loader)
+            parser._check_cancelled()
+            if writing:
+                writing()
+            with self.warehouse.engine.connect() as connection:
+                parser.save_to_csv_mananagers_operations(
+                    data=self._iter_managers(connection, supplier_id, parser.employees, date_from, date_to),
+                    filename=filename)
+
+    def _sync_entry_barcodes(self, supplier_id: int, phones: List[str], date_from: date, date_to: date,
+                             entries_loader: Callable[[List[str]], Dict[str, Optional[List[Dict]]]]):
+        """
+        Entry barcodes sync - Догрузка журналов входов сотрудников, ШК которых за период нет в хранилище
+
+        Загруженные дни отмечаются в loaded_days по телефону, поэтому журналы запрашиваются
+        только у новых сотрудников и по устаревшим дням. Телефоны с ошибкой получения журнала
+        не отмечаются и будут запрошены снова.
+        """
+        warehouse = self.warehouse
+        missing = warehouse.missing_keys(supplier_id, 'entry_barcodes', phones, date_from, date_to)
+        if not missing:
+            return
+        logger.info(f'Загрузка журналов входов {len(missing)} из {len(phones)} сотрудников')
+        entries_by_phone = entries_loader(missing)
+        warehouse.load_entry_barcodes(entries_by_phone)
+        warehouse.mark_loaded_keys(supplier_id, 'entry_barcodes',
+                                   [phone for phone, entries in entries_by_phone.items() if entries is not None],
+                                   date_from, date_to)
+
+    def write_manager_kpis(self, parser: ParserWB, date_from: date, date_to: date, filename: Union[str, IO[bytes]],
+                           writing: Callable[[], None] = None):
+        """
+        Manager KPIs report - Отчет KPI менеджеров из хранилища
+
+        Показатели всех сотрудников за период читаются одним запросом в матрицу сотрудник x день.
+        """
+        supplier_id = parser.supplier_id
+        with self.lock(supplier_id, 'employees_operations'):
+            self._sync_employee_operations(parser, date_from, date_to)
+            parser._check_cancelled()
+            if writing:
+                writing()
+            with self.warehouse.engine.connect() as connection:
+                rows = connection.execute(KPI_QUERY, {'supplier_id': supplier_id, 'date_from': date_from,
+                                                      'date_to': date_to}).all()
+        columns = list(zip(*rows)) or [()] * (len(METRICS) + 2)
+        directory = EmployeeDirectory(parser.employees)
+        matrix = EmployeeDayMatrix.from_arrays(
+            np.array(columns[0], dtype=np.int64), np.array(columns[1], dtype='datetime64[D]'),
+            [np.array(column, dtype=np.float64) for column in columns[2:]], date_from, date_to, directory.ids())
+        matrix.write_kpi_csv(filename, directory)
+
+    @staticmethod
+    def _iter_managers(connection: Connection, supplier_id: int, staff: Iterable, date_from: date,
+                       date_to: date) -> Iterator[Dict]:
+        # сотрудники в порядке снимка аккаунта, как при выгрузке из API
+        for employee in staff:
+            rows = connection.execute(MANAGERS_QUERY, {'supplier_id': supplier_id,
+                                                       'employee_id': employee.employee_id,
+                                                       'date_from': date_from, 'date_to': date_to}).all()
+            if not rows:
+                continue
+            first = rows[0]
+            yield {
+                'employee_id': employee.employee_id,
+                'last_name': first.last_name,
+                'first_name': first.first_name,
+                'middle_name': first.middle_name,
+                'phone': first.phone,
+                'create_date': first.create_date,
+                'rating': integral([first.rating])[0],
+                'operations': [EmployeeOperations(*integral(row[:6]), barcode=row.barcode) for row in rows],
+            }
@@ -1,9 +1,8 @@
-# from sqlalchemy import create_engine
-# from sqlalchemy.orm import scoped_session, sessionmaker
-# from src.utils import env
-#
-# engine = create_engine(env.DATABASE_URL, pool_pre_ping=True)
-# db_session = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine))
-# SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+from utils.env import WAREHOUSE_URL
 
+# соединения с базой открываются при первом запросе, импорт модуля их не создает
+engine = create_engine(WAREHOUSE_URL, pool_pre_ping=True)
+db_session = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine))
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
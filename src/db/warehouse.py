@@ -0,0 +1,572 @@
+import csv
+import hashlib
+import io
+import time
+from contextlib import nullcontext
+from datetime import date, datetime, timedelta
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import Column, Date, DateTime, Float, Integer, MetaData, String, Table, and_, create_engine, \
+    delete, inspect, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Connection, Engine
+from parser.columnar import integral
+from parser.employees import build_barcode_index
+from parser.rollups import ROLLUP_FIELDS, SUM_FIELDS, SalesRollup, next_period_start, period_start
+from parser.store import DayFreshness, date_range, day_ranges
+from utils.env import WAREHOUSE_URL, WAREHOUSE_BATCH_SIZE
+from bot.logger import WBLogger
+
+logger = WBLogger(__name__).get_logger()
+
+metadata = MetaData()
+
+offices = Table(
+    'offices', metadata,
+    Column('supplier_id', Integer, primary_key=True),
+    Column('office_id', Integer, primary_key=True),
+    Column('name', String),
+    Column('office_shk', String),
+)
+
+employees = Table(
+    'employees', metadata,
+    Column('supplier_id', Integer, primary_key=True),
+    Column('employee_id', Integer, primary_key=True),
+    Column('last_name', String),
+    Column('first_name', String),
+    Column('middle_name', String),
+    Column('phone', String),
+    Column('create_date', DateTime),
+    Column('rating', Float),
+)
+
+daily_sales = Table(
+    'daily_sales', metadata,
+    Column('supplier_id', Integer, primary_key=True),
+    Column('office_id', Integer, primary_key=True),
+    Column('date', Date, primary_key=True),
+    Column('name', String),
+    Column('sale_count', Integer),
+    Column('return_count', Integer),
+    Column('sale_sum', Float),
+    Column('return_sum', Float),
+    Column('proceeds', Float),
+)
+
+reward_accruals = Table(
+    'reward_accruals', metadata,
+    Column('supplier_id', Integer, primary_key=True),
+    Column('office_id', Integer, primary_key=True),
+    Column('date', Date, primary_key=True),
+    Column('amount', Float),
+    Column('bags_sum', Float),
+    Column('office_rating', Float),
+    Column('percent', Float),
+    Column('office_rating_sum', Float),
+    Column('supplier_return_sum', Float),
+)
+
+# материализованные суммы продаж офисов по неделям и месяцам (parser.rollups.SalesRollup),
+# обновляются при каждой загрузке дней продаж
+sales_rollups = Table(
+    'sales_rollups', metadata,
+    Column('supplier_id', Integer, primary_key=True),
+    Column('grain', String, primary_key=True),
+    Column('office_id', Integer, primary_key=True),
+    Column('period_start', Date, primary_key=True),
+    *(Column(name, Float) for name in ROLLUP_FIELDS),
+)
+
+# периоды, суммы которых хранятся в sales_rollups
+MATERIALIZED_GRAINS = ('week', 'month')
+
+# операции дня в порядке ответа API: seq - номер операции за день,
+# parent_seq - номер операции, в которую вложена сгруппированная операция
+operations = Table(
+    'operations', metadata,
+    Column('supplier_id', Integer, primary_key=True),
+    Column('date', Date, primary_key=True),
+    Column('seq', Integer, primary_key=True),
+    Column('parent_seq', Integer),
+    Column('oper_type', String),
+    Column('oper_amount', Float),
+    Column('comment', String),
+)
+
+employee_daily_operations = Table(
+    'employee_daily_operations', metadata,
+    Column('supplier_id', Integer, primary_key=True),
+    Column('employee_id', Integer, primary_key=True),
+    Column('date', Date, primary_key=True),
+    Column('on_place_cnt', Integer),
+    Column('return_count', Integer),
+    Column('return_sum', Float),
+    Column('sale_count', Integer),
+    Column('sale_sum', Float),
+    Column('barcode', String),
+)
+
+# ШК офиса из журнала входов сотрудника: последний вход за день
+entry_barcodes = Table(
+    'entry_barcodes', metadata,
+    Column('phone', String, primary_key=True),
+    Column('date', Date, primary_key=True),
+    Column('barcode', String),
+)
+
+# дни, полностью загруженные из API: dataset - вид данных, key - набор офисов или сотрудников
+loaded_days = Table(
+    'loaded_days', metadata,
+    Column('supplier_id', Integer, primary_key=True),
+    Column('dataset', String, primary_key=True),
+    Column('key', String, primary_key=True),
+    Column('date', Date, primary_key=True),
+    Column('fetched_at', Float, nullable=False),
+)
+
+
+def batched(rows: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """Разбиение потока строк на пачки по size"""
+    iterator = iter(rows)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def ids_key(ids: Iterable[int]) -> str:
+    """Ключ набора офисов или сотрудников для учета загруженных дней"""
+    return hashlib.sha1(','.join(map(str, sorted(ids))).encode()).hexdigest()
+
+
+# колонки продаж и вознаграждений из строки продаж офиса за день
+SALE_FIELDS = ('name', 'sale_count', 'return_count', 'sale_sum', 'return_sum', 'proceeds')
+REWARD_FIELDS = ('amount', 'bags_sum', 'office_rating', 'percent', 'office_rating_sum', 'supplier_return_sum')
+
+
+def _day(value) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+class Warehouse:
+    """
+    Data warehouse - Хранилище загруженных данных в PostgreSQL или SQLite
+
+    Строки загружаются пачками по batch_size с идемпотентным upsert по естественному
+    ключу таблицы (первичный ключ): повторная загрузка того же периода обновляет строки.
+    В PostgreSQL пачка копируется COPY во временную таблицу и переносится одним
+    INSERT ... ON CONFLICT, в SQLite выполняется executemany INSERT ... ON CONFLICT,
+    каждая пачка - в своей транзакции. Операции заменяются целыми днями, так как у
+    них нет собственного идентификатора. Полностью загруженные дни отмечаются в
+    loaded_days и считаются актуальными по правилам freshness. Строки за период
+    заменяются удалением и загрузкой в одной транзакции (replace_days), продажи - через
+    replace_sales, который поддерживает суммы в sales_rollups.
+    """
+    def __init__(self, engine: Optional[Engine] = None, url: str = WAREHOUSE_URL,
+                 batch_size: int = WAREHOUSE_BATCH_SIZE, freshness: DayFreshness = None):
+        self.engine = engine or create_engine(url, pool_pre_ping=True)
+        self.batch_size = batch_size
+        self.freshness = freshness or DayFreshness()
+        self.dialect = self.engine.dialect.name
+        if self.dialect not in ('postgresql', 'sqlite'):
+            raise ValueError(f'Неподдерживаемая база хранилища: {self.dialect}')
+
+    def create_tables(self):
+        rollups_exist = inspect(self.engine).has_table(sales_rollups.name)
+        metadata.create_all(self.engine)
+        if not rollups_exist:
+            # суммы по продажам, загруженным до появления sales_rollups
+            self.rebuild_rollups()
+
+    def upsert(self, table: Table, rows: Iterable[Dict[str, Any]]) -> int:
+        """
+        Bulk upsert - Загрузка строк пачками с обновлением существующих по первичному ключу
+
+        :return: number of loaded rows
+        """
+        total = 0
+        for batch in batched(rows, self.batch_size):
+            with self.engine.begin() as connection:
+                self._upsert_batch(connection, table, batch)
+            total += len(batch)
+        logger.info(f'Загружено в {table.name}: {total} строк')
+        return total
+
+    def _upsert_batch(self, connection: Connection, table: Table, batch: List[Dict[str, Any]]):
+        if not batch:
+            return
+        if self.dialect == 'postgresql':
+            self._copy_upsert(connection, table, batch)
+        else:
+            self._executemany_upsert(connection, table, batch)
+
+    @staticmethod
+    def _update_columns(table: Table) -> List[str]:
+        return [column.name for column in table.columns if not column.primary_key]
+
+    def _executemany_upsert(self, connection: Connection, table: Table, batch: List[Dict[str, Any]]):
+        statement = sqlite_insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[column.name for column in table.primary_key.columns],
+            set_={name: statement.excluded[name] for name in self._update_columns(table)})
+        connection.execute(statement, batch)
+
+    def _copy_upsert(self, connection: Connection, table: Table, batch: List[Dict[str, Any]]):
+        """COPY пачки во временную таблицу и перенос в таблицу с ON CONFLICT DO UPDATE"""
+        columns = [column.name for column in table.columns]
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in batch:
+            # пустое значение без кавычек в формате csv COPY - NULL
+            writer.writerow(['' if row.get(name) is None else row[name] for name in columns])
+        buffer.seek(0)
+        staging = f'staging_{table.name}'
+        column_list = ', '.join(columns)
+        cursor = connection.connection.cursor()
+        try:
+            cursor.execute(f'CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {table.name}) ON COMMIT DELETE ROWS')
+            cursor.copy_expert(f'COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT csv)', buffer)
+            keys = ', '.join(column.name for column in table.primary_key.columns)
+            updates = ', '.join(f'{name} = EXCLUDED.{name}' for name in self._update_columns(table))
+            cursor.execute(f'INSERT INTO {table.name} ({column_list}) SELECT {column_list} FROM {staging} '
+                           f'ON CONFLICT ({keys}) DO UPDATE SET {updates}')
+            # следующая пачка той же транзакции копируется в пустую таблицу
+            cursor.execute(f'DELETE FROM {staging}')
+        finally:
+            cursor.close()
+
+    def missing_ranges(self, supplier_id: int, dataset: str, key: str,
+                       date_from: date, date_to: date) -> List[Tuple[date, date]]:
+        """Get date ranges to fetch - Диапазоны дат, которых нет в хранилище или которые устарели"""
+        with self.engine.connect() as connection:
+            covered = dict(connection.execute(
+                select(loaded_days.c.date, loaded_days.c.fetched_at).where(
+                    loaded_days.c.supplier_id == supplier_id, loaded_days.c.dataset == dataset,
+                    loaded_days.c.key == key, loaded_days.c.date.between(date_from, date_to))).all())
+        return day_ranges(date_from, date_to,
+                          lambda day: day in covered and self.freshness.is_reusable(day, covered[day]))
+
+    def missing_keys(self, supplier_id: int, dataset: str, keys: Iterable[str],
+                     date_from: date, date_to: date) -> List[str]:
+        """Ключи (например, телефоны сотрудников), у которых хотя бы один день периода не загружен или устарел"""
+        keys = list(dict.fromkeys(keys))
+        covered: Dict[str, Dict[date, float]] = {key: {} for key in keys}
+        with self.engine.connect() as connection:
+            for keys_batch in batched(keys, self.batch_size):
+                for key, day, fetched_at in connection.execute(
+                        select(loaded_days.c.key, loaded_days.c.date, loaded_days.c.fetched_at).where(
+                            loaded_days.c.supplier_id == supplier_id, loaded_days.c.dataset == dataset,
+                            loaded_days.c.key.in_(keys_batch), loaded_days.c.date.between(date_from, date_to))):
+                    covered[key][day] = fetched_at
+        days = list(date_range(date_from, date_to))
+        return [key for key, stored in covered.items()
+                if not all(day in stored and self.freshness.is_reusable(day, stored[day]) for day in days)]
+
+    def mark_loaded(self, supplier_id: int, dataset: str, key: str, date_from: date, date_to: date):
+        """Отметка дней диапазона как полностью загруженных"""
+        self.mark_loaded_keys(supplier_id, dataset, [key], date_from, date_to)
+
+    def mark_loaded_keys(self, supplier_id: int, dataset: str, keys: Iterable[str], date_from: date, date_to: date):
+        """Отметка дней диапазона как полностью загруженных для каждого ключа"""
+        fetched_at = time.time()
+        days = list(date_range(date_from, date_to))
+        self.upsert(loaded_days, ({'supplier_id': supplier_id, 'dataset': dataset, 'key': key, 'date': day,
+                                   'fetched_at': fetched_at} for key in keys for day in days))
+
+    def clear_days(self, table: Table, supplier_id: int, date_from: date, date_to: date):
+        """Удаление строк аккаунта за период перед повторной загрузкой"""
+        with self.engine.begin() as connection:
+            self._delete_days(connection, table, supplier_id, date_from, date_to)
+
+    @staticmethod
+    def _delete_days(connection: Connection, table: Table, supplier_id: int, date_from: date, date_to: date):
+        connection.execute(delete(table).where(table.c.supplier_id == supplier_id,
+                                               table.c.date.between(date_from, date_to)))
+
+    def replace_days(self, table: Table, supplier_id: int, date_from: date, date_to: date,
+                     rows: Iterable[Dict[str, Any]]) -> int:
+        """
+        Replace period rows - Замена строк аккаунта за период в одной транзакции
+
+        Строки читаются до начала транзакции, поэтому ошибка или отмена при получении
+        данных из API не затрагивает хранилище, а ошибка загрузки откатывает удаление.
+
+        :return: number of loaded rows
+        """
+        rows = list(rows)
+        with self.engine.begin() as connection:
+            self._delete_days(connection, table, supplier_id, date_from, date_to)
+            for batch in batched(rows, self.batch_size):
+                self._upsert_batch(connection, table, batch)
+        logger.info(f'Загружено в {table.name}: {len(rows)} строк')
+        return len(rows)
+
+    def load_offices(self, supplier_id: int, items: Iterable) -> int:
+        """Загрузка офисов (parser.api.Office)"""
+        return self.upsert(offices, ({'supplier_id': supplier_id, 'office_id': office.id, 'name': office.name,
+                                      'office_shk': office.office_shk} for office in items))
+
+    def load_employees(self, supplier_id: int, items: Iterable) -> int:
+        """Загрузка сотрудников (parser.api.Employee)"""
+        return self.upsert(employees, ({'supplier_id': supplier_id, 'employee_id': employee.employee_id,
+                                        'last_name': employee.last_name, 'first_name': employee.first_name,
+                                        'middle_name': employee.middle_name, 'phone': employee.phone,
+                                        'create_date': employee.create_date, 'rating': employee.rating}
+                                       for employee in items))
+
+    def load_sales(self, supplier_id: int, items: Iterable) -> int:
+        """
+        Load sales - Загрузка продаж (parser.api.SaleData) в daily_sales и reward_accruals
+
+        Строки читаются один раз, обе таблицы пополняются одними и теми же пачками.
+        """
+        total = 0
+        for batch in batched(items, self.batch_size):
+            sales = []
+            rewards = []
+            for sale in batch:
+                key = {'supplier_id': supplier_id, 'office_id': sale.office_id, 'date': _day(sale.date)}
+                sales.append({**key, 'name': sale.name, 'sale_count': sale.sale_count,
+                              'return_count': sale.return_count, 'sale_sum': sale.sale_sum,
+                              'return_sum': sale.return_sum, 'proceeds': sale.proceeds})
+                rewards.append({**key, 'amount': sale.amount, 'bags_sum': sale.bags_sum,
+                                'office_rating': sale.office_rating, 'percent': sale.percent,
+                                'office_rating_sum': sale.office_rating_sum,
+                                'supplier_return_sum': sale.supplier_return_sum})
+            self.upsert(daily_sales, sales)
+            self.upsert(reward_accruals, rewards)
+            total += len(batch)
+        return total
+
+    def load_sale_batches(self, supplier_id: int, batches: Iterable) -> int:
+        """
+        Load sale batches - Загрузка пачек продаж (parser.api.SaleBatch) без объектов строк
+
+        Колонки пачки переводятся в значения по одной, пропуски (NaN) загружаются как NULL.
+        Строки небольших пачек (по офису) копятся до batch_size, как в load_sales.
+        """
+        total = 0
+        for sales, rewards in self._sale_rows(supplier_id, batches):
+            self.upsert(daily_sales, sales)
+            self.upsert(reward_accruals, rewards)
+            total += len(sales)
+        return total
+
+    def _sale_rows(self, supplier_id: int, batches: Iterable) -> Iterator[Tuple[List[Dict], List[Dict]]]:
+        """Строки daily_sales и reward_accruals пачек продаж, не меньше batch_size кроме последних"""
+        sales = []
+        rewards = []
+        for batch in batches:
+            keys = [{'supplier_id': supplier_id, 'office_id': office_id, 'date': _day(day)}
+                    for office_id, day in batch.tuples(('office_id', 'date'))]
+            sale_columns = [integral(batch.values(name)) for name in SALE_FIELDS]
+            reward_columns = [integral(batch.values(name)) for name in REWARD_FIELDS]
+            sales += [{**key, **dict(zip(SALE_FIELDS, values))} for key, values in zip(keys, zip(*sale_columns))]
+            rewards += [{**key, **dict(zip(REWARD_FIELDS, values))}
+                        for key, values in zip(keys, zip(*reward_columns))]
+            if len(sales) >= self.batch_size:
+                yield sales, rewards
+                sales, rewards = [], []
+        if sales:
+            yield sales, rewards
+
+    def replace_sales(self, supplier_id: int, date_from: date, date_to: date, batches: Iterable) -> int:
+        """
+        Replace sales days - Замена продаж за период с обновлением сумм по периодам
+
+        Суммы по неделям и месяцам не пересчитываются по всем дням: из них вычитаются
+        суммы удаляемых дней периода и прибавляются суммы загруженных пачек. Пачки
+        получаются до начала транзакции, а удаление дней, загрузка и обновление
+        sales_rollups выполняются в одной транзакции, поэтому прерванная загрузка не
+        оставляет суммы, расходящиеся с дневными строками.
+
+        :param batches: parser.api.SaleBatch for the period
+        :return: number of loaded rows
+        """
+        batches = list(batches)
+        total = 0
+        with self.engine.begin() as connection:
+            removed = {grain: self.aggregate_sales(supplier_id, grain, date_from, date_to, connection)
+                       for grain in MATERIALIZED_GRAINS}
+            self._delete_days(connection, daily_sales, supplier_id, date_from, date_to)
+            self._delete_days(connection, reward_accruals, supplier_id, date_from, date_to)
+            for sales, rewards in self._sale_rows(supplier_id, batches):
+                for table, rows in ((daily_sales, sales), (reward_accruals, rewards)):
+                    for rows_batch in batched(rows, self.batch_size):
+                        self._upsert_batch(connection, table, rows_batch)
+                total += len(sales)
+            for grain in MATERIALIZED_GRAINS:
+                added = SalesRollup.from_batches(batches, grain)
+                self._apply_rollup(supplier_id, SalesRollup.combine([added, removed[grain].negate()], grain),
+                                   connection)
+        logger.info(f'Загружено в {daily_sales.name}: {total} строк')
+        return total
+
+    def _connect(self, connection: Optional[Connection]):
+        """Переданное соединение (внутри его транзакции) или новое соединение"""
+        return nullcontext(connection) if connection is not None else self.engine.connect()
+
+    def aggregate_sales(self, supplier_id: Optional[int], grain: str, date_from: date = None,
+                        date_to: date = None, connection: Connection = None) -> SalesRollup:
+        """Сводка по дневным строкам продаж аккаунта за период (для total начало периода - date_from)"""
+        query = select(daily_sales.c.office_id, daily_sales.c.date,
+                       *(daily_sales.c[name] if name in daily_sales.c else reward_accruals.c[name]
+                         for name in (*SUM_FIELDS, 'office_rating'))).select_from(
+            daily_sales.join(reward_accruals, and_(reward_accruals.c.supplier_id == daily_sales.c.supplier_id,
+                                                   reward_accruals.c.office_id == daily_sales.c.office_id,
+                                                   reward_accruals.c.date == daily_sales.c.date)))
+        if supplier_id is not None:
+            query = query.where(daily_sales.c.supplier_id == supplier_id)
+        if date_from is not None and date_to is not None:
+            query = query.where(daily_sales.c.date.between(date_from, date_to))
+        with self._connect(connection) as connection:
+            rows = connection.execute(query).all()
+        columns = list(zip(*rows)) or [()] * (len(SUM_FIELDS) + 3)
+        return SalesRollup.from_arrays(
+            grain, np.array(columns[0], dtype=np.int64), np.array(columns[1], dtype='datetime64[D]'),
+            {name: np.array(column, dtype=np.float64) for name, column in zip((*SUM_FIELDS, 'office_rating'),
+                                                                             columns[2:])}, date_from)
+
+    def materialized_rollup(self, supplier_id: int, grain: str, period_from: date, period_to: date,
+                            connection: Connection = None) -> SalesRollup:
+        """Суммы из sales_rollups для периодов, начинающихся в [period_from, period_to]"""
+        with self._connect(connection) as connection:
+            rows = connection.execute(select(
+                sales_rollups.c.office_id, sales_rollups.c.period_start,
+                *(sales_rollups.c[name] for name in ROLLUP_FIELDS)).where(
+                sales_rollups.c.supplier_id == supplier_id, sales_rollups.c.grain == grain,
+                sales_rollups.c.period_start.between(period_from, period_to))).all()
+        columns = list(zip(*rows)) or [()] * (len(ROLLUP_FIELDS) + 2)
+        return SalesRollup(grain, np.array(columns[0], dtype=np.int64), np.array(columns[1], dtype='datetime64[D]'),
+                           {name: np.array(column, dtype=np.float64)
+                            for name, column in zip(ROLLUP_FIELDS, columns[2:])})
+
+    def _apply_rollup(self, supplier_id: int, delta: SalesRollup, connection: Connection):
+        """Прибавление разницы сумм к sales_rollups в транзакции connection, периоды без дней удаляются"""
+        if not len(delta):
+            return
+        period_from, period_to = delta.period_starts.min().item(), delta.period_starts.max().item()
+        current = self.materialized_rollup(supplier_id, delta.grain, period_from, period_to, connection)
+        rollup = SalesRollup.combine([current, delta], delta.grain)
+        # затронутые разницей строки
+        keys = set(zip(delta.office_ids.tolist(), delta.period_starts.tolist()))
+        rollup = rollup.take(np.array([key in keys for key in zip(rollup.office_ids.tolist(),
+                                                                  rollup.period_starts.tolist())], dtype=bool))
+        rows = [{'supplier_id': supplier_id, 'grain': delta.grain, 'office_id': office_id, 'period_start': start,
+                 **dict(zip(ROLLUP_FIELDS, values))}
+                for office_id, start, *values in zip(rollup.office_ids.tolist(), rollup.period_starts.tolist(),
+                                                      *(rollup.sums[name].tolist() for name in ROLLUP_FIELDS))]
+        for batch in batched(rows, self.batch_size):
+            self._upsert_batch(connection, sales_rollups, batch)
+        connection.execute(delete(sales_rollups).where(
+            sales_rollups.c.supplier_id == supplier_id, sales_rollups.c.grain == delta.grain,
+            sales_rollups.c.period_start.between(period_from, period_to), sales_rollups.c.days < 0.5))
+
+    def rebuild_rollups(self, supplier_id: int = None):
+        """Пересчет sales_rollups по всем дневным строкам продаж аккаунта или всех аккаунтов"""
+        with self.engine.connect() as connection:
+            query = select(daily_sales.c.supplier_id).distinct()
+            if supplier_id is not None:
+                query = query.where(daily_sales.c.supplier_id == supplier_id)
+            supplier_ids = connection.execute(query).scalars().all()
+        for supplier in supplier_ids:
+            with self.engine.begin() as connection:
+                connection.execute(delete(sales_rollups).where(sales_rollups.c.supplier_id == supplier))
+                for grain in MATERIALIZED_GRAINS:
+                    self._apply_rollup(supplier, self.aggregate_sales(supplier, grain, connection=connection),
+                                       connection)
+
+    def sales_summary(self, supplier_id: int, grain: str, date_from: date, date_to: date) -> SalesRollup:
+        """
+        Sales summary - Сводка продаж за период по неделям, месяцам или за весь период
+
+        Периоды, полностью входящие в [date_from, date_to], берутся из sales_rollups,
+        по дневным строкам считаются только неполные периоды на краях. Итог за период
+        складывается из сводки по месяцам.
+        """
+        if grain == 'total':
+            return SalesRollup.combine([self.sales_summary(supplier_id, 'month', date_from, date_to)],
+                                       'total', date_from)
+        # полные периоды: начинаются не раньше date_from и заканчиваются не позже date_to
+        first_full = date_from if period_start(date_from, grain) == date_from \
+            else next_period_start(date_from, grain)
+        after_full = period_start(date_to + timedelta(days=1), grain)
+        if first_full >= after_full:
+            return self.aggregate_sales(supplier_id, grain, date_from, date_to)
+        parts = [self.materialized_rollup(supplier_id, grain, first_full, after_full - timedelta(days=1))]
+        if date_from < first_full:
+            parts.append(self.aggregate_sales(supplier_id, grain, date_from, first_full - timedelta(days=1)))
+        if after_full <= date_to:
+            parts.append(self.aggregate_sales(supplier_id, grain, after_full, date_to))
+        return SalesRollup.combine(parts, grain)
+
+    def load_operations(self, supplier_id: int, items: Iterable) -> int:
+        """
+        Load operations - Загрузка операций (parser.api.OperationsByDate)
+
+        Операции каждого полученного дня заменяют ранее загруженные за этот день.
+        """
+        total = 0
+        for batch in batched(items, max(1, self.batch_size // 100)):
+            days = [_day(day.date) for day in batch]
+            rows = list(self._operation_rows(supplier_id, batch))
+            # удаление дней и вставка их операций в одной транзакции
+            with self.engine.begin() as connection:
+                connection.execute(delete(operations).where(operations.c.supplier_id == supplier_id,
+                                                            operations.c.date.in_(days)))
+                for rows_batch in batched(rows, self.batch_size):
+                    self._upsert_batch(connection, operations, rows_batch)
+            total += len(rows)
+        logger.info(f'Загружено в {operations.name}: {total} строк')
+        return total
+
+    def replace_operations(self, supplier_id: int, date_from: date, date_to: date, items: Iterable) -> int:
+        """Замена операций за период, в том числе дней без операций в ответе, см. replace_days"""
+        return self.replace_days(operations, supplier_id, date_from, date_to,
+                                 self._operation_rows(supplier_id, items))
+
+    @staticmethod
+    def _operation_rows(supplier_id: int, items: Iterable) -> Iterator[Dict[str, Any]]:
+        """Строки operations: вложенные операции идут сразу за родительской"""
+        for operations_by_date in items:
+            day = _day(operations_by_date.date)
+            seq = 0
+            for operation in operations_by_date.operations:
+                parent = seq
+                yield {'supplier_id': supplier_id, 'date': day, 'seq': seq, 'parent_seq': None,
+                       'oper_type': operation.oper_type, 'oper_amount': operation.oper_amount,
+                       'comment': operation.comment}
+                seq += 1
+                for grouped in operation.grouped:
+                    yield {'supplier_id': supplier_id, 'date': day, 'seq': seq, 'parent_seq': parent,
+                           'oper_type': grouped.oper_type, 'oper_amount': grouped.oper_amount,
+                           'comment': grouped.comment}
+                    seq += 1
+
+    def load_employee_operations(self, supplier_id: int, items: Iterable[Dict]) -> int:
+        """Загрузка операций сотрудников по дням (результат ParserWB.iter_employee_operations)"""
+        return self.upsert(employee_daily_operations, self._employee_operation_rows(supplier_id, items))
+
+    def replace_employee_operations(self, supplier_id: int, date_from: date, date_to: date,
+                                    items: Iterable[Dict]) -> int:
+        """Замена операций сотрудников за период, см. replace_days"""
+        return self.replace_days(employee_daily_operations, supplier_id, date_from, date_to,
+                                 self._employee_operation_rows(supplier_id, items))
+
+    @staticmethod
+    def _employee_operation_rows(supplier_id: int, items: Iterable[Dict]) -> Iterator[Dict[str, Any]]:
+        return ({'supplier_id': supplier_id, 'employee_id': employee['employee_id'], 'date': _day(operation.date),
+                 'on_place_cnt': operation.on_place_cnt, 'return_count': operation.return_count,
+                 'return_sum': operation.return_sum, 'sale_count': operation.sale_count,
+                 'sale_sum': operation.sale_sum, 'barcode': operation.barcode}
+                for employee in items for operation in employee.get('operations') or [])
+
+    def load_entry_barcodes(self, entries_by_phone: Dict[str, Optional[List[Dict]]]) -> int:
+        """Загрузка ШК офиса из журналов входов (результат AuthApi.get_employees_data)"""
+        return self.upsert(entry_barcodes, ({'phone': phone, 'date': _day(day), 'barcode': barcode}
+                                            for (phone, day), barcode in build_barcode_index(entries_by_phone).items()
+                                            if day))
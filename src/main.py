@@ -1,6 +1,10 @@
-from parser.api import ParserWB
+from db.warehouse import Warehouse
+from parser.api import ParserWB, to_date
 from parser.auth_fr import Auth
 from parser.column_names import sale_data_column_names_mapping
+from parser.store import SalesStore, DayStore
+from parser.warmup import warm_accounts
+from utils.env import SCHEDULE_WARM_TIME
 import argparse
 import logging
 import schedule
@@ -21,6 +25,10 @@ args_parser.add_argument('--managers_operations', action='store_true', help='Par
 args_parser.add_argument('--operations', action='store_true', help='Parse operations data')
 args_parser.add_argument('--date_from', type=str, help='Date from in format YYYY-MM-DD')
 args_parser.add_argument('--date_to', type=str, help='Date to in format YYYY-MM-DD')
+args_parser.add_argument('--schedule', action='store_true',
+                         help='Prefetch yesterday data to local stores every night')
+args_parser.add_argument('--warehouse', action='store_true',
+                         help='Load offices, employees, sales and operations for the period into warehouse')
 
 
 
@@ -33,10 +41,16 @@ def main():
     --operations - запуск парсинга данных по операциям
     --date_from - дата начала периода в формате YYYY-MM-DD
     --date_to - дата окончания периода в формате YYYY-MM-DD
+    --schedule - ночной прогрев локальных хранилищ данными за вчера
+    --warehouse - загрузка данных за период в хранилище WAREHOUSE_URL
     данные сохраняются в csv файлы в корне проекта
     """
     args = args_parser.parse_args()
 
+    if args.schedule:
+        run_scheduler(args)
+        return
+
     if not args.date_from or not args.date_to:
         print('Please specify date_from and date_to')
         return
@@ -47,6 +61,8 @@ def main():
         logging.error(f"Failed to get franchise session")
         return
     parser = ParserWB(session=session)
+    if args.warehouse:
+        run_warehouse_load(args, parser)
     # if args.sales:
     #     run_sales_report(args)
     #     pass
@@ -128,7 +144,7 @@ def run_operations_report(args, session):
     parser = ParserWB(session=session)
     logging.info(f"Fetching operations data")
     try:
-        operations_data = parser.fetch_operations_data(date_from=args.date_from, date_to=args.date_to)
+        operations_data = parser.iter_operations(date_from=args.date_from, date_to=args.date_to)
         parser.safe_to_csv_operations(data=operations_data,
                                       filename=f"operations_data_{args.date_from} - {args.date_to} - {args.phone}.csv",
                                       )
@@ -136,6 +152,44 @@ def run_operations_report(args, session):
         logging.error(f"Failed to get operations data: {e}")
 
 
+def run_warehouse_load(args, parser: ParserWB):
+    """ Загрузка офисов, сотрудников, продаж и операций за период в хранилище """
+    warehouse = Warehouse()
+    warehouse.create_tables()
+    parser.fetch_offices()
+    parser.fetch_employees()
+    if parser.supplier_id is None:
+        logging.error(f"Failed to get supplier_id")
+        return
+    try:
+        warehouse.load_offices(parser.supplier_id, parser.offices)
+        warehouse.load_employees(parser.supplier_id, parser.employees)
+        warehouse.replace_sales(parser.supplier_id, to_date(args.date_from), to_date(args.date_to),
+                                parser.iter_sales_batches(date_from=args.date_from, date_to=args.date_to))
+        warehouse.load_operations(parser.supplier_id,
+                                  parser.iter_operations(date_from=args.date_from, date_to=args.date_to))
+        warehouse.load_employee_operations(parser.supplier_id, parser.iter_employee_operations(
+            date_from=args.date_from, date_to=args.date_to))
+    except Exception as e:
+        logging.error(f"Failed to load warehouse: {e}")
+
+
+def run_scheduler(args):
+    """ Прогрев данных за вчера в SCHEDULE_WARM_TIME по аккаунту --phone или всем сохраненным токенам """
+    sales_store = SalesStore()
+    day_store = DayStore()
+
+    def warm():
+        phones = [args.phone] if args.phone else Auth.saved_phones()
+        warm_accounts(phones, sales_store, day_store)
+
+    schedule.every().day.at(SCHEDULE_WARM_TIME).do(warm)
+    logging.info(f"Prefetch scheduled at {SCHEDULE_WARM_TIME}")
+    while True:
+        schedule.run_pending()
+        time.sleep(30)
+
+
 if __name__ == '__main__':
     main()
 
@@ -2,15 +2,24 @@ from telegram import Update
 from telegram.ext import (CommandHandler, ContextTypes, ConversationHandler,
                           CallbackContext, ApplicationBuilder, MessageHandler, filters)
 from bot.utility import validate_phone_number, validate_date
-from parser.auth_api import AuthApi
 from parser.auth_fr import Auth
 from bot.logger import WBLogger
-from parser.api import ParserWB
-from parser.column_names import sale_data_column_names_mapping
-from utils.env import TELEGRAM_TOKEN
-from telegram import ReplyKeyboardMarkup
+from bot.reports import prefetch_account, ReportRequest, ReportRunner, ReportLimitError, build_report
+from bot.report_jobs import ReportJob, ReportJobs, TelegramProgress
+from bot.report_cache import ReportCache
+from parser.api import ReportCancelled
+from parser.store import SalesStore, DayStore
+from parser.response_cache import ResponseCache
+from db.reports import WarehouseReports
+from bot.scheduler import BotScheduler, Subscription, SubscriptionStore
+from utils.env import TELEGRAM_TOKEN, WAREHOUSE_REPORTS
+from telegram import ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram.error import TelegramError
 from bot.utility import restricted
+import asyncio
 import sys
+from datetime import date
+from typing import List
 import os
 
 
@@ -21,6 +30,36 @@ logger = WBLogger(__name__).get_logger()
 
 GREET, GET_PHONE, GET_CODE, GET_START_DATE, GET_END_DATE = range(5)
 SALES_REPORT, OPERATIONS_REPORT = range(6,8)
+SCHEDULE_TYPE, SCHEDULE_FREQUENCY = range(8, 10)
+
+REPORT_TYPES = {
+    "Отчет по продажам": 'sales',
+    "Сводка по продажам": 'sales_summary',
+    "Отчет по операциям": 'operations',
+    "Отчет по менеджерам": 'managers',
+    "KPI менеджеров": 'managers_kpi',
+}
+FREQUENCIES = {
+    "Ежедневно": 'daily',
+    "Еженедельно": 'weekly',
+    "Ежемесячно": 'monthly',
+}
+
+# общие для всех пользователей хранилища дневных продаж и ответов API
+sales_store = SalesStore()
+day_store = DayStore()
+# кеш ответов API по продажам и операциям сотрудников
+response_cache = ResponseCache()
+# отчеты из хранилища с догрузкой из API только недостающих дней
+warehouse_reports = WarehouseReports() if WAREHOUSE_REPORTS else None
+# подписки на отчеты и аккаунты для ночного прогрева
+subscriptions = SubscriptionStore()
+# пул формирования отчетов вне event loop
+report_runner = ReportRunner()
+# задачи отчетов для /status_report и /cancel_report
+report_jobs = ReportJobs()
+# file_id отправленных отчетов
+report_cache = ReportCache()
 
 
 @restricted
@@ -50,6 +89,9 @@ async def get_phone(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         return GET_PHONE
     context.user_data['auth'] = Auth()
     context.user_data["phone"] = phone
+    # новая авторизация - данные аккаунта запрашиваются заново
+    context.user_data.pop('account_snapshot', None)
+    context.user_data.pop('prefetch', None)
     session = context.user_data['auth'].get_franchise_session(phone)
     auth_status = context.user_data['auth'].get_auth_status()
     if auth_status == "NEED_CODE":
@@ -61,6 +103,8 @@ async def get_phone(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     else:
         await update.message.reply_text(f"Вы уже авторизованы с номером {phone}!")
         context.user_data['session'] = session
+        subscriptions.touch_account(phone)
+        start_prefetch(context)
         return await show_menu(update)
 
 
@@ -77,6 +121,8 @@ async def get_code(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     logger.info(f'Session after connect with code  - {session}')
     if session:
         context.user_data['session'] = session
+        subscriptions.touch_account(phone)
+        start_prefetch(context)
         await update.message.reply_text("Вы успешно авторизованы!")
         return await show_menu(update)
     else:
@@ -84,6 +130,28 @@ async def get_code(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         return GET_PHONE
 
 
+def start_prefetch(context: ContextTypes.DEFAULT_TYPE):
+    """ Фоновая загрузка данных аккаунта, пока пользователь выбирает отчет и даты """
+    phone = context.user_data['phone']
+    task = context.application.create_task(
+        report_runner.prefetch(prefetch_account, context.user_data['session'], sales_store=sales_store))
+    context.user_data['prefetch'] = (phone, task)
+
+
+async def take_prefetch(user_data: dict, phone: str):
+    """ Снимок аккаунта из фоновой загрузки, отчет дожидается ее окончания, чтобы не дублировать запросы """
+    prefetch = user_data.get('prefetch')
+    if prefetch is None or prefetch[0] != phone:
+        return None
+    try:
+        return await prefetch[1]
+    except Exception as e:
+        logger.error(f"Prefetch failed for {phone}: {e}")
+        return None
+    finally:
+        user_data.pop('prefetch', None)
+
+
 # async def sales_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 #     query = update.callback_query
 #     await query.answer()
@@ -118,72 +186,133 @@ async def get_end_date(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         await update.message.reply_text("Неверный формат даты. Попробуйте еще раз")
         return GET_END_DATE
     context.user_data['end_date'] = end_date
-    await update.message.reply_text("Отчет готовится. Пожалуйста, подождите")
-    await send_report(update, context)
+    if report_runner.active(update.effective_user.id) >= report_runner.per_user:
+        await update.message.reply_text("Предыдущий отчет еще формируется. Дождитесь его отправки "
+                                        "или отмените его командой /cancel_report")
+        return await show_menu(update)
+    # параметры отчета фиксируются до постановки в очередь, чтобы следующий запрос их не изменил
+    request = ReportRequest(
+        user_id=update.effective_user.id,
+        chat_id=update.effective_chat.id,
+        phone=context.user_data['phone'],
+        report_type=context.user_data.get('report_type'),
+        date_from=context.user_data['start_date'].strftime('%Y-%m-%d'),
+        date_to=context.user_data['end_date'].strftime('%Y-%m-%d'),
+        session=context.user_data['session'],
+        account_snapshot=context.user_data.get('account_snapshot'))
+    job = await create_report_job(context.bot, request)
+    # отчет формируется в фоне, диалог сразу возвращается в меню
+    context.application.create_task(send_report(context.bot, context.user_data, request, job), update=update)
     return await show_menu(update)
 
 
-async def send_report(update: Update, context: CallbackContext):
-    """ Отправка отчета """
-    logger.info("Begin to send report")
-    session = context.user_data['session']
-    logger.info(f"Session: {session}")
-    parser = ParserWB(session)
-    logger.info(" Begin to fetch offices")
-    parser.fetch_offices()
-    logger.info(" End of fetch offices")
-    logger.info(" Begin to fetch employees")
-    parser.fetch_employees()
-    logger.info(" End of fetch employees")
-    date_from_str = context.user_data['start_date'].strftime('%Y-%m-%d')
-    date_to_str = context.user_data['end_date'].strftime('%Y-%m-%d')
-    report_type = context.user_data.get('report_type')
-    filename = ''
-    if report_type == "sales":
-        logger.info("Begin to fetch sales data")
-        data = parser.fetch_sales_data(date_from=date_from_str, date_to=date_to_str)
-        logger.info(f"Get data - {data}")
-        filename = f"sales_data/sales_data_{date_from_str} - {date_to_str} - {context.user_data['phone']}.csv"
-        parser.save_to_csv(data=data, filename=filename, column_names_mapings=sale_data_column_names_mapping)
-    elif report_type == "operations":
-        logger.info("Begin to fetch operations data")
-        operations_data = parser.fetch_operations_data(date_from=date_from_str, date_to=date_to_str)
-        filename = f"operations_data/operations_data_{date_from_str} - {date_to_str} - {context.user_data['phone']}.csv"
-        parser.safe_to_csv_operations(data=operations_data, filename=filename)
-    elif report_type == "managers":
-        logger.info(f'Begin to fetch managers data')
-        managers_data = parser.fetch_employee_data(date_from=date_from_str, date_to=date_to_str)
-        api_parser = AuthApi()
-        api_parser.get_token()
-        for employee in managers_data:
-            phone_number = employee.get('phone')
-            logger.info(f'Phone number - {phone_number}')
-            api_data = api_parser.get_employee_data(phone_number)
-            logger.info(f'API data - {api_data}')
-            if api_data:
-                for day in api_data:
-                    api_date = day.get('date_created').split('T')[0]  # получаем дату записи входа
-                    api_barcode = day.get('barcode') # получаем ШК офиса
-                    for operation in employee.get('operations'):
-                        operation_date = operation.date
-                        if api_date == operation_date:
-                            operation.barcode = api_barcode
-        filename = f"operations_data/manager_operations_data_{date_from_str} - {date_to_str} - {context.user_data['phone']}.csv"
-        parser.save_to_csv_mananagers_operations(data=managers_data, filename=filename)
-    await update.message.reply_text("Отчет сформирован")
-    with open(filename, 'rb') as file:
-        await context.bot.send_document(chat_id=update.effective_chat.id, document=file, filename=filename)
-    await update.message.reply_text("Отчет отправлен")
-    return GREET
+async def create_report_job(bot, request: ReportRequest) -> ReportJob:
+    """Задача отчета, прогресс которой показывается в одном редактируемом сообщении"""
+    job = report_jobs.create(request.user_id, request.report_type, request.date_from, request.date_to)
+    message = await bot.send_message(chat_id=request.chat_id, text=job.describe())
+    job.listeners.append(TelegramProgress(bot, asyncio.get_running_loop(), message.chat_id, message.message_id))
+    return job
+
+
+async def send_report(bot, user_data: dict, request: ReportRequest, job: ReportJob):
+    """ Отправка отчета
+
+    Отчет формируется в пуле потоков report_runner, обработчик диалога к этому
+    моменту уже вернул управление.
+
+    :param bot: telegram bot
+    :param user_data: user data for account snapshot reuse
+    :param request: report parameters
+    :param job: report job
+    """
+    logger.info(f"Begin to send report {job.job_id}")
+    logger.info(f"Session: {request.session}")
+    cache_key = (request.phone, request.report_type, request.date_from, request.date_to)
+    # отчет за закрытый период отправляется повторно по file_id без выгрузки из API
+    if await send_cached_report(bot, request.chat_id, report_cache.get_closed(*cache_key)):
+        job.update(ReportJob.DONE)
+        return
+    # данные, загруженные сразу после авторизации, берутся из снимка и локального хранилища
+    if snapshot := await take_prefetch(user_data, request.phone):
+        request.account_snapshot = snapshot
+    try:
+        result = await report_runner.run(request.user_id, build_report, request, limited=not request.scheduled,
+                                         sales_store=sales_store, day_store=day_store, response_cache=response_cache,
+                                         warehouse_reports=warehouse_reports, job=job)
+    except ReportCancelled:
+        logger.info(f"Report {job.job_id} cancelled by user {request.user_id}")
+        job.update(ReportJob.CANCELLED)
+        return
+    except ReportLimitError as e:
+        logger.info(e)
+        job.update(ReportJob.FAILED)
+        await bot.send_message(chat_id=request.chat_id, text="Предыдущий отчет еще формируется. Дождитесь его отправки")
+        return
+    except Exception as e:
+        logger.error(f"Failed to build report {request.report_type} for {request.phone}: {e}")
+        job.update(ReportJob.FAILED)
+        await bot.send_message(chat_id=request.chat_id, text="Не удалось сформировать отчет")
+        return
+    # снимок /account переиспользуется следующими отчетами пользователя
+    user_data['account_snapshot'] = result.account_snapshot
+    try:
+        # неизменившийся отчет за открытый период не загружается в Telegram повторно
+        if await send_cached_report(bot, request.chat_id, report_cache.get(*cache_key, result.content_hash)):
+            job.update(ReportJob.DONE)
+            return
+        file_ids = []
+        for part in result.parts:
+            message = await bot.send_document(chat_id=request.chat_id, document=part.file, filename=part.filename)
+            file_ids.append(message.document.file_id)
+        if result.request_errors:
+            # неполный отчет не кешируется, следующий запрос выгрузит данные заново
+            await bot.send_message(chat_id=request.chat_id,
+                                   text="Отчет неполный: часть данных не получена от WB. Повторите запрос позднее")
+        else:
+            report_cache.put(*cache_key, result.content_hash, file_ids)
+        job.update(ReportJob.DONE)
+    finally:
+        # временные файлы отчета удаляются сразу после отправки
+        result.close()
+
+
+async def send_cached_report(bot, chat_id: int, file_ids: List[str]) -> bool:
+    """Отправка ранее загруженного отчета по file_id частей, False если отправить не удалось"""
+    if not file_ids:
+        return False
+    try:
+        for file_id in file_ids:
+            await bot.send_document(chat_id=chat_id, document=file_id)
+        return True
+    except TelegramError as e:
+        logger.error(f"Cached report {file_ids} was not accepted: {e}")
+        return False
+
+
+@restricted
+async def status_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Статус отчетов пользователя - выполняемые и последние завершенные"""
+    jobs = report_jobs.user_jobs(update.effective_user.id)
+    lines = [job.describe() for job in jobs]
+    user_subscriptions = subscriptions.subscriptions(update.effective_user.id)
+    if user_subscriptions:
+        lines.append("Подписки:")
+        lines.extend(describe_subscription(subscription) for subscription in user_subscriptions)
+    await update.message.reply_text("\n".join(lines) if lines else "Отчетов нет")
+
+
+@restricted
+async def cancel_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Отмена выполняемых отчетов пользователя"""
+    jobs = report_jobs.cancel(update.effective_user.id)
+    if not jobs:
+        await update.message.reply_text("Нет отчетов в работе")
+        return
+    await update.message.reply_text("\n".join(job.describe() for job in jobs))
 
 
 async def show_menu(update: Update) -> int:
-    keyboard = [
-        ["Отчет по продажам"],
-        ["Отчет по операциям"],
-        ["Отчет по менеджерам"],
-        ["Отмена"]
-    ]
+    keyboard = [[name] for name in REPORT_TYPES] + [["Отмена"]]
     reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
     await update.message.reply_text("Выберите действие", reply_markup=reply_markup)
     return GREET
@@ -191,12 +320,8 @@ async def show_menu(update: Update) -> int:
 
 async def choose_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_choice = update.message.text
-    if user_choice == "Отчет по продажам":
-        context.user_data['report_type'] = 'sales'
-    elif user_choice == "Отчет по операциям":
-        context.user_data['report_type'] = 'operations'
-    elif user_choice == "Отчет по менеджерам":
-        context.user_data['report_type'] = 'managers'
+    if user_choice in REPORT_TYPES:
+        context.user_data['report_type'] = REPORT_TYPES[user_choice]
     elif user_choice == "Отмена":
         await update.message.reply_text("Выберите действие или начните заново командой /start")
         return GREET
@@ -212,8 +337,119 @@ async def get_plugin_data(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     pass
 
 
+def describe_subscription(subscription: Subscription) -> str:
+    report_type = next((name for name, value in REPORT_TYPES.items() if value == subscription.report_type),
+                       subscription.report_type)
+    frequency = next((name for name, value in FREQUENCIES.items() if value == subscription.frequency),
+                     subscription.frequency)
+    return f"{report_type} - {frequency.lower()} ({subscription.phone})"
+
+
+@restricted
+async def schedule_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """ Подписка на отчет по расписанию: выбор типа отчета """
+    if 'session' not in context.user_data:
+        await update.message.reply_text("Сначала авторизуйтесь командой /start")
+        return ConversationHandler.END
+    keyboard = [[name] for name in REPORT_TYPES] + [["Отмена"]]
+    await update.message.reply_text("Выберите отчет для отправки по расписанию",
+                                    reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True))
+    return SCHEDULE_TYPE
+
+
+async def schedule_report_type(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """ Подписка на отчет по расписанию: выбор периодичности """
+    user_choice = update.message.text
+    if user_choice not in REPORT_TYPES:
+        await show_menu(update)
+        return ConversationHandler.END
+    context.user_data['schedule_report_type'] = REPORT_TYPES[user_choice]
+    keyboard = [[name] for name in FREQUENCIES] + [["Отмена"]]
+    await update.message.reply_text("Как часто отправлять отчет? Ежедневно - за вчера, еженедельно - "
+                                    "за прошлую неделю по понедельникам, ежемесячно - за прошлый месяц 1 числа",
+                                    reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True))
+    return SCHEDULE_FREQUENCY
+
+
+async def schedule_report_frequency(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """ Подписка на отчет по расписанию: сохранение подписки """
+    user_choice = update.message.text
+    if user_choice in FREQUENCIES:
+        subscriptions.subscribe(update.effective_user.id, update.effective_chat.id, context.user_data['phone'],
+                                context.user_data['schedule_report_type'], FREQUENCIES[user_choice])
+        await update.message.reply_text("Подписка сохранена. Отменить подписки можно командой /unschedule_report")
+    await show_menu(update)
+    return ConversationHandler.END
+
+
+async def cancel_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """ Выход из диалога подписки по /cancel или /start без сохранения подписки """
+    context.user_data.pop('schedule_report_type', None)
+    if update.message.text.startswith('/start'):
+        # /start обработан диалогом подписки, основной диалог его не получит
+        await update.message.reply_text("Подписка не сохранена. Отправьте /start еще раз, чтобы начать заново",
+                                        reply_markup=ReplyKeyboardRemove())
+    else:
+        await update.message.reply_text("Подписка не сохранена")
+        await show_menu(update)
+    return ConversationHandler.END
+
+
+@restricted
+async def unschedule_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Удаление подписок пользователя на отчеты"""
+    removed = subscriptions.unsubscribe(update.effective_user.id)
+    await update.message.reply_text(f"Удалено подписок: {removed}" if removed else "Подписок нет")
+
+
+async def deliver_scheduled_report(application, subscription: Subscription, date_from: date, date_to: date):
+    """ Отправка отчета по подписке, вызывается из потока планировщика в event loop бота """
+    session = await asyncio.to_thread(Auth().get_saved_session, subscription.phone)
+    if session is None:
+        await application.bot.send_message(chat_id=subscription.chat_id,
+                                           text=f"Не удалось отправить отчет по расписанию для {subscription.phone}: "
+                                                f"авторизуйтесь заново командой /start")
+        return
+    user_data = application.user_data.get(subscription.user_id, {})
+    request = ReportRequest(
+        user_id=subscription.user_id,
+        chat_id=subscription.chat_id,
+        phone=subscription.phone,
+        report_type=subscription.report_type,
+        date_from=date_from.strftime('%Y-%m-%d'),
+        date_to=date_to.strftime('%Y-%m-%d'),
+        session=session,
+        account_snapshot=user_data.get('account_snapshot') if user_data.get('phone') == subscription.phone else None,
+        scheduled=True)
+    job = await create_report_job(application.bot, request)
+    await send_report(application.bot, user_data, request, job)
+
+
+async def post_init(application) -> None:
+    """ Запуск планировщика прогрева данных и отчетов по подпискам """
+    loop = asyncio.get_running_loop()
+
+    def deliver(subscription: Subscription, date_from: date, date_to: date):
+        asyncio.run_coroutine_threadsafe(
+            deliver_scheduled_report(application, subscription, date_from, date_to), loop).result()
+
+    application.bot_data['scheduler'] = BotScheduler(subscriptions, sales_store, day_store, deliver)
+    application.bot_data['scheduler'].start()
+
+
 def main() -> None:
-    application = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+    application = ApplicationBuilder().token(TELEGRAM_TOKEN).post_init(post_init).build()
+    # диалог подписки добавляется первым, чтобы его ответы не перехватывал основной диалог
+    schedule_handler = ConversationHandler(
+        entry_points=[CommandHandler("schedule_report", schedule_report)],
+        states={
+            SCHEDULE_TYPE: [MessageHandler(filters=filters.TEXT & ~filters.COMMAND, callback=schedule_report_type)],
+            SCHEDULE_FREQUENCY: [MessageHandler(filters=filters.TEXT & ~filters.COMMAND,
+                                                callback=schedule_report_frequency)],
+        },
+        fallbacks=[CommandHandler(["cancel", "start"], cancel_schedule)],
+        per_user=True
+    )
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler("start", start)],
         states={
@@ -227,7 +463,11 @@ def main() -> None:
         per_user=True
     )
 
+    application.add_handler(schedule_handler)
     application.add_handler(conv_handler)
+    application.add_handler(CommandHandler("status_report", status_report))
+    application.add_handler(CommandHandler("cancel_report", cancel_report))
+    application.add_handler(CommandHandler("unschedule_report", unschedule_report))
     application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
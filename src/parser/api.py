@@ -1,16 +1,51 @@
 import csv
-from typing import Dict, Any, Callable, Union
-from utils.env import base_url_v2, base_url_v1, refresh_url, operations_url
-from datetime import datetime, timedelta
-import pandas as pd
-from typing import List, Optional
+import hashlib
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import closing
+from itertools import repeat
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import IO, Dict, Any, Callable, Union, Tuple
+from utils.env import base_url_v2, base_url_v1, refresh_url, operations_url, FETCH_WORKERS, ACCOUNT_TTL, \
+    OPERATIONS_WINDOW_DAYS, JSON_STREAM_CHUNK_SIZE
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Iterable, Iterator
 from dataclasses import dataclass, asdict, field
+import numpy as np
 from parser.column_names import oper_type_mapping
+from parser.store import SalesStore, DayStore, date_range
+from parser.csv_writer import StreamingCsvWriter, flatten_operations, open_csv_output
+from parser.json_stream import iter_json_array
+from parser.rate_limit import RateLimiter, rate_limiter as default_rate_limiter
+from parser.response_cache import ResponseCache, CachedResponse, response_key
+from parser.single_flight import SingleFlight, single_flight as default_single_flight
+from parser.employees import EmployeeDirectory
+from parser.columnar import ColumnBatch, integral, object_array
 from bot.logger import WBLogger
 
 logger = WBLogger(__name__).get_logger()
 
-@dataclass
+
+class ReportCancelled(BaseException):
+    """
+    Report was cancelled - Формирование отчета отменено пользователем
+
+    Наследуется от BaseException, как asyncio.CancelledError, чтобы отмена не
+    перехватывалась обработчиками except Exception при разборе ответов.
+    """
+
+
+def to_date(value: Union[str, date, datetime]) -> date:
+    """Приведение даты из строки YYYY-MM-DD или datetime к date"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value[:10], '%Y-%m-%d').date()
+
+@dataclass(slots=True)
 class Employee:
     """Класс для хранения данных о сотруднике"""
     employee_id: int
@@ -38,7 +73,7 @@ class Employee:
             return None
 
 
-@dataclass
+@dataclass(slots=True)
 class EmployeeOperations:
     """Класс для хранения операций сотрудника"""
     date: str
@@ -66,7 +101,7 @@ class EmployeeOperations:
 
 
 # класс для хранения  операций
-@dataclass
+@dataclass(slots=True)
 class Operation:
     """Класс для хранения операций"""
     # dt: datetime # поле для хранения даты операции
@@ -97,7 +132,7 @@ class Operation:
 
 
 #  Класс для хранения операция по дате
-@dataclass
+@dataclass(slots=True)
 class OperationsByDate:
     """Класс для хранения операций по дате"""
     date: datetime
@@ -119,6 +154,8 @@ class OperationsByDate:
 # класс для хранения офисов
 class Office:
     """Класс для хранения офисов"""
+    __slots__ = ('id', 'name', 'office_shk')
+
     def __init__(self, id: int, name: str, office_shk: str):
         self.id = id
         self.name = name
@@ -127,7 +164,11 @@ class Office:
 
 # класс для хранения данных о продажах
 class SaleData:
-    """Класс для хранения данных о продажах"""
+    """Класс для хранения данных о продажах, строка SaleBatch"""
+    # порядок полей - порядок колонок отчета
+    __slots__ = ('office_id', 'name', 'date', 'sale_count', 'return_count', 'sale_sum', 'return_sum', 'proceeds',
+                 'amount', 'bags_sum', 'office_rating', 'percent', 'office_rating_sum', 'supplier_return_sum')
+
     def __init__(self, office_id: int,
                  name: str,
                  date: datetime,
@@ -159,21 +200,214 @@ class SaleData:
         self.supplier_return_sum = supplier_return_sum
 
     def to_dict(self):
-        return self.__dict__
+        """Преобразование объекта в новый словарь"""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class SaleBatch(ColumnBatch):
+    """
+    Продажи офисов по дням в колонках, названия офисов - категории
+
+    Рейтинг дня без начисления - NaN, чтобы он не учитывался в среднем рейтинге сводки,
+    отчет по продажам выводит такие дни нулями (REPORT_FILL).
+    """
+    FIELDS = {
+        'office_id': 'int',
+        'name': 'category',
+        'date': 'date',
+        'sale_count': 'number',
+        'return_count': 'number',
+        'sale_sum': 'number',
+        'return_sum': 'number',
+        'proceeds': 'number',
+        'amount': 'number',
+        'bags_sum': 'number',
+        'office_rating': 'number',
+        'percent': 'number',
+        'office_rating_sum': 'number',
+        'supplier_return_sum': 'number',
+    }
+    ROW = SaleData
+    # значения пропусков в отчете по продажам
+    REPORT_FILL = {'office_rating': 0}
+
+
+class EmployeeOperationsBatch(ColumnBatch):
+    """Операции сотрудников по дням в колонках, ШК офиса - категории"""
+    FIELDS = {
+        'employee_id': 'int',
+        'date': 'isodate',
+        'on_place_cnt': 'number',
+        'return_count': 'number',
+        'return_sum': 'number',
+        'sale_count': 'number',
+        'sale_sum': 'number',
+        'barcode': 'category',
+    }
+    ROW = EmployeeOperations
+    ROW_FIELDS = ('date', 'on_place_cnt', 'return_count', 'return_sum', 'sale_count', 'sale_sum', 'barcode')
+
+
+class OperationBatch(ColumnBatch):
+    """
+    Operations in columns - Операции по дням в колонках
+
+    seq - номер операции за день, parent_seq - номер операции, в которую вложена
+    сгруппированная операция, или -1. Вложенность - один уровень, как в отчете.
+    """
+    FIELDS = {
+        'date': 'date',
+        'seq': 'int',
+        'parent_seq': 'int',
+        'oper_type': 'category',
+        'oper_amount': 'number',
+        'comment': 'object',
+    }
+
+    def rows(self) -> Iterator[OperationsByDate]:
+        """Операции, сгруппированные по дням, как OperationsByDate"""
+        day = None
+        for day_date, _, parent_seq, oper_type, oper_amount, comment in self.tuples():
+            if day is None or day.date != day_date:
+                if day is not None:
+                    yield day
+                day = OperationsByDate(date=day_date, operations=[])
+            operation = Operation(oper_type=oper_type, oper_amount=oper_amount, comment=comment)
+            if parent_seq < 0:
+                day.operations.append(operation)
+            else:
+                day.operations[-1].grouped.append(operation)
+        if day is not None:
+            yield day
+
+
+@dataclass
+class AccountSnapshot:
+    """Класс для хранения данных аккаунта из одного запроса /account: офисы, сотрудники, supplier_id"""
+    supplier_id: Optional[int]
+    offices: List[Office]
+    employees: List[Employee]
+    fetched_at: float = field(default_factory=time.monotonic)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'AccountSnapshot':
+        """Создание объекта из словаря"""
+        offices = []
+        for office in data.get('offices') or []:
+            logger.info(f"Office ID: {office['id']}, Office name: {office['name']}")
+            if office['is_site_active'] is False:
+                continue
+            offices.append(Office(id=office['id'], name=office['name'], office_shk=office['office_shk']))
+        employees = []
+        for employee_data in data.get('employees') or []:
+            employee = Employee.from_dict(employee_data)
+            # check if employee is not deleted
+            if employee:
+                employees.append(employee)
+        return cls(supplier_id=data.get('supplier_id'), offices=offices, employees=employees)
+
+    def is_fresh(self, ttl: float) -> bool:
+        """Проверка, что снимок не старше ttl секунд"""
+        return time.monotonic() - self.fetched_at < ttl
+
+
+def filter_operations(details: Iterable[Dict], date_from: date = None,
+                      date_to: date = None) -> Iterator[OperationsByDate]:
+    """Filter operations by date - Операции за период, объекты создаются только для подходящих дней"""
+    return (OperationsByDate.from_dict(item) for item in filter_operation_items(details, date_from, date_to))
+
+
+def filter_operation_items(details: Iterable[Dict], date_from: date = None, date_to: date = None) -> Iterator[Dict]:
+    """
+    Filter raw operations by date - Фильтрация элементов details по датам без разбора в объекты
+
+    Даты сравниваются по строке из ответа. Если ответ упорядочен по дате,
+    разбор прекращается после выхода за границу периода.
+
+    :param details: items of 'details' array from operations response
+    :param date_from: date from or None
+    :param date_to: date to or None
+    """
+    if not (date_from and date_to):
+        yield from details
+        return
+    str_from, str_to = date_from.strftime('%Y-%m-%d'), date_to.strftime('%Y-%m-%d')
+    previous = None
+    # направление сортировки ответа: 1 - по возрастанию, -1 - по убыванию, 0 - неизвестно/не упорядочен
+    order = None
+    for item in details:
+        item_date = item.get('date', '')[:10]
+        if previous is not None and item_date != previous:
+            direction = 1 if item_date > previous else -1
+            order = direction if order in (None, direction) else 0
+        previous = item_date
+        if str_from <= item_date <= str_to:
+            yield item
+        elif (order == 1 and item_date > str_to) or (order == -1 and item_date < str_from):
+            return
+
+
+# колонки отчета по операциям
+OPERATIONS_CSV_COLUMNS = ['date', 'oper_type', 'oper_amount', 'comment', 'grouped']
+OPERATIONS_CSV_NAMES = {
+    'date': 'Дата',
+    'oper_type': 'Тип операции',
+    'oper_amount': 'Сумма',
+    'comment': 'Комментарий',
+}
+
+# колонки отчета по менеджерам
+MANAGERS_CSV_FIELDS = ['ID сотрудника', 'Фамилия', 'Имя', 'Отчество', 'Телефон', 'Дата трудоустройства', 'Рейтинг',
+                       'Дата операции', 'Принято вещей', 'Возвраты', 'Возвраты (сумма)', 'Продажи', 'Продажи (сумма)',
+                       'ШК офиса']
 
 
 class ParserWB:
     """Parser for WB API"""
-    def __init__(self, session):
+    def __init__(self, session, max_workers: int = FETCH_WORKERS, account_snapshot: AccountSnapshot = None,
+                 account_ttl: float = ACCOUNT_TTL, sales_store: SalesStore = None,
+                 progress: Callable[[int, int], None] = None, cancel_event: threading.Event = None,
+                 day_store: DayStore = None, rate_limiter: RateLimiter = None,
+                 response_cache: ResponseCache = None, single_flight: SingleFlight = None):
         self.base_url_v1 = base_url_v1
         self.base_url_v2 = base_url_v2
         self.refresh_url = refresh_url
+        self.operations_url = operations_url
         # self.login_url = login_url
         self.session = session
         self.access_token = None
         self.offices = []
         self.employees = []
         self.supplier_id = None
+        # количество параллельных запросов к API WB
+        self.max_workers = max_workers
+        # снимок /account переиспользуется всеми fetch_* в пределах account_ttl секунд
+        self.account_snapshot = account_snapshot
+        self.account_ttl = account_ttl
+        self._account_lock = threading.Lock()
+        # счетчики запросов к API по префиксам и попаданий в снимок аккаунта
+        self.request_counts = Counter()
+        # ответы API с ошибкой по префиксам
+        self.request_errors = Counter()
+        # локальное хранилище дневных продаж, если None - все дни запрашиваются у API
+        self.sales_store = sales_store
+        # хранилище дневных ответов API по операциям и операциям сотрудников
+        self.day_store = day_store
+        # размер окна дат при запросе операций
+        self.operations_window_days = OPERATIONS_WINDOW_DAYS
+        # False, если сервер не учитывает границы дат в запросе операций
+        self.operations_windows_supported = None
+        # кеш ответов по продажам, вознаграждениям и операциям сотрудников
+        self.response_cache = response_cache
+        # одинаковые одновременные запросы разных отчетов выполняются один раз
+        self.single_flight = single_flight or default_single_flight
+        # словари категориальных колонок пачек: названия офисов, типы операций, ШК
+        self.batch_categories = {}
+        # ограничение частоты и повторы запросов, общие для всех отчетов процесса
+        self.rate_limiter = rate_limiter or default_rate_limiter
+        # прогресс загрузки (выполнено, всего) по офисам или окнам дат и флаг отмены отчета
+        self.progress = progress
+        self.cancel_event = cancel_event
         self.headers = {
             "Accept": "application/json.txt, text/plain, */*",
             "Referer": "https://franchise.wildberries.ru/",
@@ -183,256 +417,753 @@ class ParserWB:
         }
         self.session.headers.update(self.headers)
 
+    # ответы, которые можно кешировать: данные за закрытые дни не меняются
+    CACHEABLE_PREFIXES = ('sales', 'reward', 'employees_operations')
+
+    ERROR_STATUS = {
+        "auth": "Ошибка авторизации",
+        "account": "Ошибка получения данных аккаунта",
+        "office": "Ошибка получения данных по офисам",
+        "sales": "Ошибка получения данных по продажам",
+        "reward": "Ошибка получения данных по вознаграждениям",
+        "operations": "Ошибка получения данных по операциям",
+        "employees": "Ошибка получения данных по сотрудникам",
+        "employees_operations": "Ошибка получения данных по операциям сотрудников",
+    }
+
+    def _check_cancelled(self):
+        """Raise ReportCancelled if report was cancelled - Прерывание загрузки после отмены отчета"""
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise ReportCancelled()
+
+    def _report_progress(self, done: int, total: int):
+        if self.progress:
+            self.progress(done, total)
+
     def _get_response_data_wb(self, *, url: str, params: dict, prefix: str):
         """
         Get response data from wb api
 
+        Запрос выполняется через rate_limiter: при 429/5xx он повторяется, None
+        возвращается только после неудачи всех попыток. Ответы CACHEABLE_PREFIXES
+        берутся из response_cache, если он задан и известен supplier_id аккаунта.
+        Одновременные запросы с тем же аккаунтом, url и параметрами из разных
+        отчетов объединяются single_flight: все получают один разобранный ответ,
+        который не должен изменяться.
+
         :param url: url for request
         :param params: params for request
         :param prefix: prefix for logging
 
         """
-        response = self.session.get(url=url, params=params)
-        ERROR_STATUS = {
-            "auth": f"Ошибка авторизации {response.status_code}",
-            "office": f"Ошибка получения данных по офисам {response.status_code}",
-            "sales": f"Ошибка получения данных по продажам {response.status_code}",
-            "reward": f"Ошибка получения данных по вознаграждениям {response.status_code}",
-            "operations": f"Ошибка получения данных по операциям {response.status_code}",
-            "employees": f"Ошибка получения данных по сотрудникам {response.status_code}",
-            "employees_operations": f"Ошибка получения данных по операциям сотрудников {response.status_code}",
-        }
+        # после отмены новые запросы к API не отправляются
+        self._check_cancelled()
+        by_supplier = prefix in self.CACHEABLE_PREFIXES and self.supplier_id is not None
+        # данные по офисам общие для аккаунта поставщика, остальные ответы зависят от пользователя
+        key = response_key(self.supplier_id if by_supplier else self.session.headers.get('Authorization'), url, params)
+        cache_key = cached = None
+        if self.response_cache is not None and by_supplier:
+            cache_key = key
+            cached = self.response_cache.get(cache_key)
+            if cached is not None and cached.is_fresh():
+                self.request_counts[f'{prefix}_cache_hit'] += 1
+                return cached.json()
+        try:
+            data, shared = self.single_flight.do(
+                key, lambda: self._fetch_response_data_wb(url, params, prefix, cache_key, cached),
+                check=self._check_cancelled)
+        except Exception as e:
+            # ConnectionError, Timeout и другие исключения после всех попыток - тоже ошибка запроса
+            self.request_errors[prefix] += 1
+            logger.error(f"{self.ERROR_STATUS.get(prefix, '')} {e!r}")
+            raise
+        if shared:
+            self.request_counts[f'{prefix}_shared'] += 1
+            if data is None:
+                self.request_errors[prefix] += 1
+        return data
+
+    def _fetch_response_data_wb(self, url: str, params: dict, prefix: str, cache_key: Optional[str],
+                                cached: Optional[CachedResponse]):
+        """Запрос к API с проверкой устаревшего ответа из кеша и сохранением нового"""
+        self.request_counts[prefix] += 1
+        response = self.rate_limiter.request(self.session, 'GET', url, prefix, params=params,
+                                             headers=cached.validators() if cached else None,
+                                             check=self._check_cancelled)
+        if cached is not None and response.status_code == 304:
+            self.response_cache.revalidated(cache_key, self.response_cache.expires_at(params.get('to')))
+            return cached.json()
         if response.status_code != 200:
-            logger.error(f"{ERROR_STATUS.get(prefix, '')} Response: {response.text}")
-        return response.json() if response.status_code == 200 else None
+            self.request_errors[prefix] += 1
+            logger.error(f"{self.ERROR_STATUS.get(prefix, '')} {response.status_code} Response: {response.text}")
+            return None
+        if cache_key is not None:
+            self.response_cache.put(cache_key, response.content, response.headers.get('ETag'),
+                                    response.headers.get('Last-Modified'),
+                                    self.response_cache.expires_at(params.get('to')))
+        return response.json()
+
+    def _iter_response_items_wb(self, *, url: str, params: dict, prefix: str, key: str,
+                                stream: bool = True) -> Iterator[Any]:
+        """
+        Iterate items of response array from wb api - Потоковое получение элементов массива из ответа
 
-    def _get_supplier_id(self):
-        """Get supplier id from wb api - получение ID - supplier_id работника"""
-        url = f"{self.base_url_v1}/account"
-        params = {'in_short': 'false'}
+        В потоковом режиме ответ читается с stream=True и массив под ключом key
+        разбирается по одному элементу, соединение закрывается при остановке перебора.
+
+        :param url: url for request
+        :param params: params for request
+        :param prefix: prefix for logging
+        :param key: top-level key of array in response
+        :param stream: parse response incrementally instead of response.json()
+        """
+        if not stream:
+            response_data = self._get_response_data_wb(url=url, params=params, prefix=prefix)
+            yield from (response_data or {}).get(key) or []
+            return
+        self._check_cancelled()
+        self.request_counts[prefix] += 1
         try:
-            if response := self._get_response_data_wb(url=url, params=params, prefix='auth'):
-                self.supplier_id = response['supplier_id']
+            with self.rate_limiter.request(self.session, 'GET', url, prefix, params=params, stream=True,
+                                           check=self._check_cancelled) as response:
+                if response.status_code != 200:
+                    self.request_errors[prefix] += 1
+                    logger.error(f"{self.ERROR_STATUS.get(prefix, '')} {response.status_code} "
+                                 f"Response: {response.text}")
+                    return
+                yield from iter_json_array(response.iter_content(chunk_size=JSON_STREAM_CHUNK_SIZE), key)
         except Exception as e:
-            logger.error(e)
+            # обрыв соединения или ошибка разбора посреди ответа
+            self.request_errors[prefix] += 1
+            logger.error(f"{self.ERROR_STATUS.get(prefix, '')} {e!r}")
+            raise
+
+    def get_account_snapshot(self, force: bool = False) -> Optional[AccountSnapshot]:
+        """
+        Get account snapshot - Получение данных аккаунта с кешированием
+
+        Запрос /account выполняется только если снимка нет, он устарел или force=True.
+
+        :param force: ignore cached snapshot
+        """
+        with self._account_lock:
+            if not force and self.account_snapshot and self.account_snapshot.is_fresh(self.account_ttl):
+                self.request_counts['account_cache_hit'] += 1
+                return self.account_snapshot
+            url = f"{self.base_url_v1}/account"
+            params = {'in_short': 'false'}
+            try:
+                if response := self._get_response_data_wb(url=url, params=params, prefix='account'):
+                    self.account_snapshot = AccountSnapshot.from_dict(response)
+            except Exception as e:
+                logger.error(e)
+            return self.account_snapshot
+
+    def invalidate_account_snapshot(self):
+        """Сброс снимка аккаунта, следующий запрос заново получит /account"""
+        with self._account_lock:
+            self.account_snapshot = None
+
+    def _get_supplier_id(self):
+        """Get supplier id from wb api - получение ID - supplier_id работника"""
+        if snapshot := self.get_account_snapshot():
+            self.supplier_id = snapshot.supplier_id
 
     def fetch_employees(self):
         """Get list of employees from wb api - Получение списка сотрудников и запись экземпляр класса"""
-        url = f"{self.base_url_v1}/account"
-        params = {'in_short': 'false'}
-        try:
-            if response := self._get_response_data_wb(url=url, params=params, prefix='employees'):
-                for employee_data in response['employees']:
-                    employee = Employee.from_dict(employee_data)
-                    # check if employee is not deleted
-                    if employee:
-                        self.employees.append(employee)
-        except Exception as e:
-            logger.error(e)
+        if snapshot := self.get_account_snapshot():
+            self.employees = list(snapshot.employees)
 
     def fetch_employee_data(self, date_from: datetime, date_to: datetime) -> List[Dict]:
+        """Get employee operations by date - Получение операций пользователя по диапазону дат, см. iter_employee_operations"""
+        return list(self.iter_employee_operations(date_from=date_from, date_to=date_to))
+
+    def iter_employee_operations(self, date_from: datetime, date_to: datetime) -> Iterator[Dict]:
         """
-        Get employee operations by date - Получение операций пользователя по диапазону дат
+        Iterate employee operations by date - Потоковое получение операций сотрудников по диапазону дат
+
+        Если задано хранилище дневных данных, у API запрашиваются только отсутствующие
+        в нем дни для текущего набора сотрудников.
 
         :param date_from: date from
         :param date_to: date to
-        :return: dict with employee operations
+        :return: dicts with employee info and operations, one per employee
+        """
+        directory = EmployeeDirectory(self.employees)
+        errors = self.request_errors['employees_operations']
+        try:
+            response = self._get_employee_operations_response(directory.ids(), date_from, date_to)
+            for employee_data in response or []:
+                operations_employee = []
+                for data in (employee_data.get('by_date') or []):
+                    operation = EmployeeOperations.from_dict(data)
+                    if operation:
+                        operations_employee.append(operation)
+                employee_info = directory.get(employee_data['employee_id'])
+                yield {
+                    'employee_id': employee_data['employee_id'],
+                    'last_name': employee_info.last_name if employee_info else None,
+                    'first_name': employee_info.first_name if employee_info else None,
+                    'middle_name': employee_info.middle_name if employee_info else None,
+                    'phone': employee_info.phone if employee_info else None,
+                    'create_date': employee_info.create_date if employee_info else None,
+                    'rating': employee_info.rating if employee_info else None,
+                    'operations': operations_employee
+                }
+
+        except Exception as e:
+            self._record_error('employees_operations', errors, e)
+
+    def iter_employee_operation_batches(self, date_from: datetime,
+                                        date_to: datetime) -> Iterator[EmployeeOperationsBatch]:
         """
+        Iterate employee operations batches - Операции сотрудников по дням пачкой без объектов строк
+
+        Данные те же, что у iter_employee_operations, строки идут по сотрудникам в порядке
+        ответа и по дням. ШК офиса не заполнен, см. parser.employees.attach_batch_barcodes.
+        """
+        errors = self.request_errors['employees_operations']
+        try:
+            response = self._get_employee_operations_response(EmployeeDirectory(self.employees).ids(),
+                                                              date_from, date_to)
+            builder = EmployeeOperationsBatch.builder(self.batch_categories)
+            for employee_data in response or []:
+                employee_id = employee_data['employee_id']
+                for data in (employee_data.get('by_date') or []):
+                    builder.append(employee_id, data['date'], data['on_place_cnt'], data['return_count'],
+                                   data['return_sum'], data['sale_count'], data['sale_sum'], None)
+            if len(builder):
+                yield builder.build()
+        except Exception as e:
+            self._record_error('employees_operations', errors, e)
+
+    def _record_error(self, prefix: str, errors: int, error: Exception):
+        """
+        Record swallowed error - Учет перехваченной ошибки в request_errors
+
+        Ошибка запроса уже посчитана в _get_response_data_wb, поэтому счетчик увеличивается,
+        только если он не изменился с начала обработки (ошибка разбора или хранилища).
+
+        :param errors: request_errors[prefix] before processing
+        """
+        if self.request_errors[prefix] == errors:
+            self.request_errors[prefix] += 1
+        logger.error(f"{self.ERROR_STATUS.get(prefix, '')} {error!r}")
+
+    def _get_employee_operations_response(self, employee_ids: List[int], date_from: Union[str, date, datetime],
+                                          date_to: Union[str, date, datetime]) -> Optional[List[Dict]]:
+        """Ответ /employees/proceeds за период, из хранилища дневных данных, если оно задано"""
+        logger.info(f'Employee ids - {employee_ids}')
+        if self.day_store and self.supplier_id is None:
+            self._get_supplier_id()
+        if self.day_store and self.supplier_id is not None:
+            return self._get_employee_operations_stored(employee_ids, to_date(date_from), to_date(date_to))
+        return self._get_employee_operations(employee_ids, date_from, date_to)
+
+    def _get_employee_operations(self, employee_ids: List[int], date_from: Union[str, date],
+                                 date_to: Union[str, date]) -> Optional[List[Dict]]:
+        """Request /employees/proceeds - Запрос операций сотрудников за период"""
         url = f"{self.base_url_v2}/employees/proceeds"
         logger.info(f'Url - {url}')
-        # get employee list ids from self.employees - получаем список id всех пользователей
-        employee_ids = [employee.employee_id for employee in self.employees]
-        logger.info(f'Employee ids - {employee_ids}')
         params = {
             'employee_ids': ','.join(map(str, employee_ids)),
             'from': date_from,
             'to': date_to,
             'employee_type': 0
         }
-        all_operations = []
-        try:
-            if response := self._get_response_data_wb(url=url, params=params, prefix='employees_operations'):
-                for employee_data in response:
-                    operations_employee = []
-                    for data in (employee_data.get('by_date') or []):
-                        operation = EmployeeOperations.from_dict(data)
-                        if operation:
-                            operations_employee.append(operation)
-                    employee_info = next((e for e in self.employees if e.employee_id == employee_data['employee_id']), None)
-                    all_operations.append({
-                        'employee_id': employee_data['employee_id'],
-                        'last_name': employee_info.last_name if employee_info else None,
-                        'first_name': employee_info.first_name if employee_info else None,
-                        'middle_name': employee_info.middle_name if employee_info else None,
-                        'phone': employee_info.phone if employee_info else None,
-                        'create_date': employee_info.create_date if employee_info else None,
-                        'rating': employee_info.rating if employee_info else None,
-                        'operations': operations_employee
-                    })
+        return self._get_response_data_wb(url=url, params=params, prefix='employees_operations')
 
-        except Exception as e:
-            logger.error(e)
-        return all_operations
+    def _get_employee_operations_stored(self, employee_ids: List[int], date_from: date,
+                                        date_to: date) -> Optional[List[Dict]]:
+        """
+        Employee operations from local store and API - Операции сотрудников из хранилища с догрузкой из API
+
+        Данные хранятся по дням как {employee_id: элемент by_date}, ключ хранилища - хеш
+        набора сотрудников, поэтому при изменении состава сотрудников дни запрашиваются заново.
+
+        :return: response-like list of {'employee_id', 'by_date'} or None on API error
+        """
+        store = self.day_store
+        key = hashlib.sha1(','.join(map(str, sorted(employee_ids))).encode()).hexdigest()
+        for range_from, range_to in store.missing_ranges('employees_operations', self.supplier_id, key,
+                                                         date_from, date_to):
+            response = self._get_employee_operations(employee_ids, range_from.strftime('%Y-%m-%d'),
+                                                     range_to.strftime('%Y-%m-%d'))
+            if response is None:
+                return None
+            payloads = defaultdict(dict)
+            for employee_data in response:
+                for data in (employee_data.get('by_date') or []):
+                    payloads[data['date'][:10]][str(employee_data['employee_id'])] = data
+            store.save('employees_operations', self.supplier_id, key, range_from, range_to, payloads, empty={})
+        by_employee = {employee_id: [] for employee_id in employee_ids}
+        for _, payload in store.load('employees_operations', self.supplier_id, key, date_from, date_to):
+            for employee_id, data in payload.items():
+                by_employee.setdefault(int(employee_id), []).append(data)
+        return [{'employee_id': employee_id, 'by_date': by_date} for employee_id, by_date in by_employee.items()]
 
     def fetch_offices(self):
         """Get offices from wb api - Получение всех офисов из API WB"""
-        url = f"{self.base_url_v1}/account"
-        params = {'in_short': 'false'}
+        if snapshot := self.get_account_snapshot():
+            self.supplier_id = snapshot.supplier_id
+            self.offices = list(snapshot.offices)
+
+    def fetch_sales_data(self, date_from: datetime = None, date_to: datetime = None,
+                         max_workers: int = None) -> Union[list[Any], list[SaleData]]:
+        """Get sales data from wb api - Получение данных по продажам, см. iter_sales"""
+        return list(self.iter_sales(date_from=date_from, date_to=date_to, max_workers=max_workers))
+
+    def iter_sales(self, date_from: datetime = None, date_to: datetime = None,
+                   max_workers: int = None) -> Iterator[SaleData]:
+        """
+        Iterate sales data from wb api - Потоковое получение продаж по строкам, см. iter_sales_batches
+
+        Пропуски в строках заполняются как в отчете по продажам (SaleBatch.REPORT_FILL).
+        """
+        with closing(self.iter_sales_batches(date_from=date_from, date_to=date_to, max_workers=max_workers)) as batches:
+            for batch in batches:
+                yield from batch.fillna(SaleBatch.REPORT_FILL).rows()
+
+    def iter_sales_batches(self, date_from: datetime = None, date_to: datetime = None,
+                           max_workers: int = None) -> Iterator[SaleBatch]:
+        """
+        Iterate sales batches from wb api - Потоковое получение данных по продажам пачками по офисам
+
+        Запросы /proceeds и /accruals по офисам выполняются параллельно, пачки отдаются
+        по мере готовности офисов в порядке офисов, строки пачки - в порядке дат. Одновременно в работе не больше
+        2 * max_workers офисов. Если задано локальное хранилище, у API запрашиваются
+        только отсутствующие в нем и еще не закрытые дни. После каждого офиса
+        вызывается progress, при отмене ожидающие запросы снимаются с пула.
+
+        :param date_from: date from
+        :param date_to: date to
+        :param max_workers: number of concurrent requests, defaults to self.max_workers
+        """
+        date_from = to_date(date_from) if date_from else (datetime.now() - timedelta(days=30)).date()
+        date_to = to_date(date_to) if date_to else datetime.now().date()
+        max_workers = max_workers or self.max_workers
+        store = self.sales_store
+        if store and self.supplier_id is None:
+            self._get_supplier_id()
+        if store and self.supplier_id is None:
+            logger.error('Не удалось получить supplier_id, локальное хранилище продаж не используется')
+            store = None
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        pending = deque()
+        total, done = len(self.offices), 0
+        self._report_progress(done, total)
         try:
-            if response := self._get_response_data_wb(url=url, params=params, prefix='office'):
-                self._get_supplier_id()
-                for office in response['offices']:
-                    logger.info(f"Office ID: {office['id']}, Office name: {office['name']}")
-                    if office['is_site_active'] is False:
-                        continue
-                    self.offices.append(Office(id=office['id'], name=office['name'], office_shk=office['office_shk']))
+            for office in self.offices:
+                self._check_cancelled()
+                if store:
+                    ranges = store.missing_ranges(self.supplier_id, office.id, date_from, date_to)
+                else:
+                    ranges = [(date_from, date_to)]
+                # запросы по продажам и вознаграждениям уходят в пул одновременно
+                pending.append((office, [(range_from, range_to,
+                                          *self._submit_office_sales(executor, office, range_from, range_to))
+                                         for range_from, range_to in ranges]))
+                if len(pending) >= 2 * max_workers:
+                    batch = self._collect_office_ranges(*pending.popleft(), date_from, date_to, store)
+                    if len(batch):
+                        yield batch
+                    done += 1
+                    self._report_progress(done, total)
+            while pending:
+                self._check_cancelled()
+                batch = self._collect_office_ranges(*pending.popleft(), date_from, date_to, store)
+                if len(batch):
+                    yield batch
+                done += 1
+                self._report_progress(done, total)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _collect_office_ranges(self, office: Office, office_futures: List[Tuple], date_from: date, date_to: date,
+                               store: Optional[SalesStore]) -> SaleBatch:
+        """
+        Build office sales from fetched ranges and local store - Сборка продаж офиса из ответов API и хранилища
 
-        except Exception as e:
-            logger.error(e)
-
-    def fetch_sales_data(self, date_from: datetime = None, date_to: datetime = None) -> Union[
-        list[Any], list[SaleData]]:
-        """Get sales data from wb api - Получение данных по продажам """
-        result = []
-        date_from = date_from or (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
-        date_to = date_to or datetime.now().strftime('%Y-%m-%d')
+        :param office: office
+        :param office_futures: list of (range_from, range_to, sale_future, reward_future)
+        :param date_from: report date from
+        :param date_to: report date to
+        :param store: local sales store or None
+        """
+        batches = []
+        fetched_dates = set()
+        for range_from, range_to, sale_future, reward_future in office_futures:
+            batch = self._collect_office_sales(office, sale_future, reward_future)
+            if batch is None:
+                continue
+            batches.append(batch)
+            if sale_future.result() is None:
+                continue
+            fetched_dates.update(date_range(range_from, range_to))
+            # в хранилище попадают только полностью полученные диапазоны
+            if store and reward_future.result() is not None:
+                store.save(self.supplier_id, office.id, range_from, range_to, batch.to_dicts())
+        if not store:
+            return SaleBatch.concat(batches)
+        builder = SaleBatch.builder(self.batch_categories)
+        for row in store.load(self.supplier_id, office.id, date_from, date_to):
+            row['date'] = datetime.strptime(row['date'], '%Y-%m-%d')
+            if row['date'].date() not in fetched_dates:
+                builder.append_dict(row)
+        batches.append(builder.build())
+        return SaleBatch.concat(batches).sort_by('date')
+
+    def _submit_office_sales(self, executor: ThreadPoolExecutor, office: Office,
+                             date_from: date, date_to: date) -> Tuple[Future, Future]:
+        """Submit /proceeds and /accruals requests for one office - Запуск запросов по одному офису"""
         params = {
-            # 'office_ids': office_id,
-            'from': date_from,
-            'to': date_to
+            'office_ids': office.id,
+            'from': date_from.strftime('%Y-%m-%d'),
+            'to': date_to.strftime('%Y-%m-%d')
         }
-        for office in self.offices:
-            office_id = office.id
-            params['office_ids'] = office_id
-            url_sales = f"{self.base_url_v2}/proceeds"
-            url_reward = f"{self.base_url_v1}/accruals"
+        sale_future = executor.submit(self._get_response_data_wb, url=f"{self.base_url_v2}/proceeds",
+                                      params=params, prefix='sales')
+        reward_future = executor.submit(self._get_response_data_wb, url=f"{self.base_url_v1}/accruals",
+                                        params=params, prefix='reward')
+        return sale_future, reward_future
+
+    def _collect_office_sales(self, office: Office, sale_future: Future,
+                              reward_future: Future) -> Optional[SaleBatch]:
+        """
+        Build sales batch for one office - Сборка пачки данных по продажам одного офиса
+
+        Ошибка по одному офису логируется, учитывается в request_errors и не прерывает
+        формирование всего отчета, в этом случае возвращается None.
 
-            # запрос данных по продажам
+        :param office: office
+        :param sale_future: future with /proceeds response
+        :param reward_future: future with /accruals response
+        """
+        office_id = office.id
+        builder = SaleBatch.builder(self.batch_categories)
+        try:
+            sale_response = sale_future.result()
+            reward_response = reward_future.result()
+        except Exception as e:
+            # исключение запроса уже учтено в request_errors
+            logger.error(f'Ошибка запроса данных для офиса {office_id}: {e!r}')
+            return None
+        try:
+            # данные по продажам
+            sales_data = {}
             sales_data_dict = {}
-            sales_data = []
-            if sale_response := self._get_response_data_wb(url=url_sales, params=params, prefix='sales'):
-                try:
-                    sales_data = sale_response[0]
-                    sales_data_dict = {sale['date']: sale for sale in sales_data['by_office']}
-                except Exception as e:
-                    logger.error(f'Ошибка при обработке данных для офиса {office_id}: {e}')
-                    return []
-
-            # запрос данных по вознаграждениям
-            rewards_data_dict = {}
-            if reward_response := self._get_response_data_wb(url=url_reward, params=params, prefix='reward'):
+            if sale_response:
+                sales_data = sale_response[0]
+                sales_data_dict = {sale['date']: sale for sale in sales_data['by_office']}
 
+            # данные по вознаграждениям
+            rewards_data_dict = {}
+            if reward_response:
                 rewards_data_dict = {reward['date']: reward for reward in reward_response}
 
-            for date, sale in sales_data_dict.items():
+            for date in sorted(sales_data_dict):
+                sale = sales_data_dict[date]
                 reward_data = rewards_data_dict.get(date, None)
-                amount = reward_data['amount'] if reward_data else 0
-                bags_sum = reward_data['ext_data']['bags_sum'] if reward_data else 0
-                office_rating = reward_data['ext_data']['office_rating'] if reward_data else 0
-                percent = reward_data['ext_data']['percent'][0] if reward_data else 0
-                office_rating_sum = reward_data['ext_data']['office_rating_sum'] if reward_data else 0
-                supplier_return_sum = reward_data['ext_data']['supplier_return_sum'] if reward_data else 0
-
-                sale_object = SaleData(
-                    date=datetime.strptime(date, '%Y-%m-%d'),
-                    office_id=office_id,
-                    name=sales_data['office_name'],
-                    sale_count=sale['sale_count'],
-                    return_count=sale['return_count'],
-                    sale_sum=sale['sale_sum'],
-                    return_sum=sale['return_sum'],
-                    proceeds=sale['proceeds'],
-                    amount=amount,
-                    bags_sum=bags_sum,
-                    office_rating=office_rating,
-                    percent=percent,
-                    office_rating_sum=office_rating_sum,
-                    supplier_return_sum=supplier_return_sum,
-
+                ext_data = reward_data['ext_data'] if reward_data else None
+                # значения пишутся в порядке колонок SaleBatch.FIELDS
+                builder.append(
+                    office_id,
+                    sales_data['office_name'],
+                    date,
+                    sale['sale_count'],
+                    sale['return_count'],
+                    sale['sale_sum'],
+                    sale['return_sum'],
+                    sale['proceeds'],
+                    reward_data['amount'] if reward_data else 0,
+                    ext_data['bags_sum'] if ext_data else 0,
+                    # без начисления рейтинг за день неизвестен, а не равен нулю
+                    ext_data['office_rating'] if ext_data else None,
+                    ext_data['percent'][0] if ext_data else 0,
+                    ext_data['office_rating_sum'] if ext_data else 0,
+                    ext_data['supplier_return_sum'] if ext_data else 0,
                 )
-                logger.info(f'Обработана дата {date} для офиса {office_id} -- {sale_object.name}')
-                result.append(sale_object)
+                logger.info(f'Обработана дата {date} для офиса {office_id} -- {sales_data["office_name"]}')
+            return builder.build()
+        except Exception as e:
+            self.request_errors['sales'] += 1
+            logger.error(f'Ошибка при обработке данных для офиса {office_id}: {e!r}')
+            return None
+
+    def fetch_operations_data(self, date_from: datetime = None, date_to: datetime = None) -> List[OperationsByDate]:
+        """Get operations from wb api - Получение операций, см. iter_operations"""
+        return list(self.iter_operations(date_from=date_from, date_to=date_to))
+
+    def iter_operations(self, date_from: datetime = None, date_to: datetime = None,
+                        windowed: bool = True, stream: bool = True) -> Iterator[OperationsByDate]:
+        """
+        Iterate operations by date - Потоковое получение операций по датам
+
+        Если заданы даты, период запрашивается окнами по OPERATIONS_WINDOW_DAYS дней
+        с границами дат в параметрах запроса. Если сервер границы не учитывает,
+        выполняется один запрос всей истории с фильтрацией на стороне клиента.
+        В потоковом режиме массив details разбирается по одному дню прямо из ответа.
+        Если задано хранилище дневных данных, у API запрашиваются только дни,
+        которых нет в нем или которые еще могут измениться.
+
+        :param date_from: date from, string YYYY-MM-DD or datetime
+        :param date_to: date to, string YYYY-MM-DD or datetime
+        :param windowed: request date windows instead of the whole history
+        :param stream: parse responses incrementally
+        """
+        with closing(self._iter_operation_source(date_from, date_to, windowed, stream)) as items:
+            for item in items:
+                yield OperationsByDate.from_dict(item)
+
+    def iter_operation_batches(self, date_from: datetime = None, date_to: datetime = None,
+                               windowed: bool = True, stream: bool = True,
+                               batch_days: int = None) -> Iterator[OperationBatch]:
+        """
+        Iterate operations batches - Потоковое получение операций пачками по batch_days дней
 
-        return result
+        Элементы ответа пишутся в колонки сразу, без объектов Operation и OperationsByDate.
+        Данные и порядок дней те же, что у iter_operations.
 
-    def fetch_operations_data(self, date_from: datetime = None, date_to: datetime = None):
+        :param batch_days: days per batch, defaults to operations window
+        """
+        batch_days = batch_days or self.operations_window_days
+        builder = OperationBatch.builder(self.batch_categories)
+        days = 0
+        with closing(self._iter_operation_source(date_from, date_to, windowed, stream)) as items:
+            for item in items:
+                day = item.get('date', '')
+                seq = 0
+                for operation in item.get('operations') or []:
+                    parent = seq
+                    builder.append(day, seq, -1, oper_type_mapping.get(operation.get('oper_type', ''), ''),
+                                   operation.get('oper_amount', 0), operation.get('comment'))
+                    seq += 1
+                    grouped = operation.get('grouped')
+                    for op in grouped if isinstance(grouped, list) else []:
+                        builder.append(day, seq, parent, oper_type_mapping.get(op.get('oper_type', ''), ''),
+                                       op.get('oper_amount', 0), op.get('comment'))
+                        seq += 1
+                days += 1
+                if days >= batch_days:
+                    yield builder.build()
+                    days = 0
+        if len(builder):
+            yield builder.build()
+
+    def _iter_operation_source(self, date_from: datetime = None, date_to: datetime = None,
+                               windowed: bool = True, stream: bool = True) -> Iterator[Dict]:
+        """Элементы details за период из API или хранилища, см. iter_operations"""
         self._get_supplier_id()
+        if not (date_from and date_to):
+            return self._iter_operation_items_all(stream=stream)
+        date_from, date_to = to_date(date_from), to_date(date_to)
+        if self.day_store and self.supplier_id is not None:
+            return self._iter_operation_items_stored(date_from, date_to, windowed, stream)
+        return self._iter_operation_items(date_from, date_to, windowed, stream)
+
+    def _iter_operation_items(self, date_from: date, date_to: date, windowed: bool = True, stream: bool = True,
+                              report_progress: bool = True) -> Iterator[Dict]:
+        """Raw operations items by date windows - Элементы details за период, см. iter_operations"""
+        if not windowed or self.operations_windows_supported is False:
+            yield from self._iter_operation_items_all(date_from, date_to, stream=stream)
+            return
+        window_from = date_from
+        window_days = self.operations_window_days
+        total = ((date_to - date_from).days // window_days) + 1
+        if report_progress:
+            self._report_progress(0, total)
+        while window_from <= date_to:
+            self._check_cancelled()
+            window_to = min(window_from + timedelta(days=window_days - 1), date_to)
+            params = {
+                'supplier_id': self.supplier_id,
+                'from': window_from.strftime('%Y-%m-%d'),
+                'to': window_to.strftime('%Y-%m-%d'),
+            }
+            # дни текущего окна, уже отданные потребителю
+            yielded = set()
+            with closing(self._iter_response_items_wb(url=self.operations_url, params=params, prefix='operations',
+                                                      key='details', stream=stream)) as details:
+                for item in details:
+                    item_date = item.get('date', '')[:10]
+                    if not params['from'] <= item_date <= params['to']:
+                        break
+                    yielded.add(item_date)
+                    yield item
+                else:
+                    if report_progress:
+                        self._report_progress((window_to - date_from).days // window_days + 1, total)
+                    window_from = window_to + timedelta(days=1)
+                    continue
+            logger.warning('Сервер не учитывает границы дат для операций, фильтрация на стороне клиента')
+            self.operations_windows_supported = False
+            for item in self._iter_operation_items_all(window_from, date_to, stream=stream):
+                if item.get('date', '')[:10] not in yielded:
+                    yield item
+            return
+
+    def _iter_operation_items_all(self, date_from: date = None, date_to: date = None,
+                                  stream: bool = True) -> Iterator[Dict]:
+        """Get whole operations history with client-side filter - Запрос всей истории операций с фильтрацией по датам"""
         params = {
             'supplier_id': self.supplier_id,
             'all': 'true',
         }
-        if operations_response := self._get_response_data_wb(url=operations_url, params=params, prefix='operations'):
-            details_data = operations_response['details']
-            all_operations = [OperationsByDate.from_dict(item) for item in details_data]
-
-            # Фильтрация операций по датам, если они были переданы
-            if date_from and date_to:
-                filtered_operations = [op for op in all_operations if date_from <= op.date <= date_to]
-                return filtered_operations
-            else:
-                return all_operations
+        with closing(self._iter_response_items_wb(url=self.operations_url, params=params, prefix='operations',
+                                                  key='details', stream=stream)) as details:
+            yield from filter_operation_items(details, date_from, date_to)
+
+    def _iter_operation_items_stored(self, date_from: date, date_to: date, windowed: bool = True,
+                                     stream: bool = True) -> Iterator[Dict]:
+        """
+        Operations items from local store and API - Элементы details из хранилища с догрузкой из API
+
+        Отсутствующие дни запрашиваются частями не больше окна дат и сохраняются
+        после каждой полностью полученной части, поэтому в памяти не бывает больше окна.
+        """
+        store = self.day_store
+        total = (date_to - date_from).days + 1
+        self._report_progress(0, total)
+        cursor = date_from
+        for range_from, range_to in store.missing_ranges('operations', self.supplier_id, '', date_from, date_to):
+            if cursor < range_from:
+                yield from self._load_operation_items(cursor, range_from - timedelta(days=1))
+            part_from = range_from
+            while part_from <= range_to:
+                if windowed and self.operations_windows_supported is not False:
+                    part_to = min(part_from + timedelta(days=self.operations_window_days - 1), range_to)
+                else:
+                    part_to = range_to
+                payloads = defaultdict(list)
+                errors = self.request_errors['operations']
+                with closing(self._iter_operation_items(part_from, part_to, windowed, stream,
+                                                        report_progress=False)) as items:
+                    for item in items:
+                        payloads[item.get('date', '')[:10]].append(item)
+                        yield item
+                # часть с ошибкой ответа не сохраняется и будет запрошена снова
+                if self.request_errors['operations'] == errors:
+                    store.save('operations', self.supplier_id, '', part_from, part_to, payloads, empty=[])
+                self._report_progress((part_to - date_from).days + 1, total)
+                part_from = part_to + timedelta(days=1)
+            cursor = range_to + timedelta(days=1)
+        if cursor <= date_to:
+            yield from self._load_operation_items(cursor, date_to)
+        self._report_progress(total, total)
+
+    def _load_operation_items(self, date_from: date, date_to: date) -> Iterator[Dict]:
+        for _, items in self.day_store.load('operations', self.supplier_id, '', date_from, date_to):
+            yield from items
 
     def save_to_csv(self,
-                    data: List[object],
-                    filename: str,
+                    data: Iterable[object],
+                    filename: Union[str, IO[bytes]],
                     column_names_mapings: Dict[str, str],
                     oper_type_mapings: Dict[int, str] = None):
-        data_to_save = [item.to_dict() for item in data]
-        df = pd.DataFrame(data_to_save)
-        # Проверка на наличие колонки operations
-        if 'operations' in df.columns:
-            df = df.explode('operations')
-            # Разбиваем операции на отдельные колонки
-            operations_df = pd.DataFrame(df['operations'].to_list())
-            df = pd.concat([df.drop(['operations'], axis=1).reset_index(drop=True), operations_df.reset_index(drop=True)], axis=1)
-
-            if oper_type_mapings:
-                df['oper_type'] = df['oper_type'].map(oper_type_mapings)
-
-        if 'grouped' in df.columns:
-            df = df.explode('grouped')
-            grouped_df = pd.DataFrame(df['grouped'].dropna().to_list())
-            df = pd.concat([df.drop(['grouped'], axis=1).reset_index(drop=True), grouped_df.reset_index(drop=True)], axis=1)
-        df.rename(columns=column_names_mapings, inplace=True)
-        df.to_csv(filename, index=False)
+        """
+        Save data to csv - Потоковая запись данных в csv
+
+        Вложенные operations и grouped разворачиваются в отдельные строки.
+
+        :param data: objects with to_dict method
+        :param filename: csv filename or binary file object
+        :param column_names_mapings: column names for csv header
+        :param oper_type_mapings: mapping for oper_type values
+        """
+        rows = flatten_operations((item.to_dict() for item in data), oper_type_mapping=oper_type_mapings)
+        StreamingCsvWriter(filename, column_names_mapping=column_names_mapings).write(rows)
         return None
 
     def safe_to_csv_operations(self,
-                               data: List[OperationsByDate],
-                               filename: str):
-        data_to_save = []
-        for item in data:
-            for operation in item.operations:
-                operations = [operation]
-                operations.extend(operation.grouped)
-                for op in operations:
-                    data_to_save.append({
-                        'date': item.date,
-                        'oper_type': op.oper_type,
-                        'oper_amount': op.oper_amount,
-                        'comment': op.comment,
-                        'grouped': None
-                    })
-        df = pd.DataFrame(data_to_save)
-
-        df['comment'] = df['comment'].str.replace('\D+', '', regex=True)
-        # rename
-
-        "" ""
-        df.rename(columns={
-            'date': 'Дата',
-            'oper_type': 'Тип операции',
-            'oper_amount': 'Сумма',
-            'comment': 'Комментарий',
-        }, inplace=True)
-        df.to_csv(filename, index=False)
-
-    def save_to_csv_mananagers_operations(self, data: List[Dict], filename: str):
-        with open(filename, 'w', newline='') as csvfile:
-            fieldnames = ['ID сотрудника', 'Фамилия', 'Имя', 'Отчество', 'Телефон', 'Дата трудоустройства', 'Рейтинг',
-                          'Дата операции', 'Принято вещей', 'Возвраты', 'Возвраты (сумма)', 'Продажи', 'Продажи (сумма)',
-                          'ШК офиса']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+                               data: Iterable[OperationsByDate],
+                               filename: Union[str, IO[bytes]]):
+        """
+        Save operations to csv - Потоковая запись операций в csv
+
+        Каждая операция и ее вложенные операции пишутся отдельными строками.
+        """
+        def rows():
+            for item in data:
+                for operation in item.operations:
+                    operations = [operation]
+                    operations.extend(operation.grouped)
+                    for op in operations:
+                        yield {
+                            'date': item.date,
+                            'oper_type': op.oper_type,
+                            'oper_amount': op.oper_amount,
+                            'comment': op.comment,
+                        }
+
+        self.save_operation_rows_to_csv(rows(), filename)
+
+    @staticmethod
+    def save_operation_rows_to_csv(rows: Iterable[Dict], filename: Union[str, IO[bytes]]):
+        """
+        Save flat operation rows to csv - Запись плоских строк операций в csv
+
+        В комментарии остаются только цифры (ШК товара).
+
+        :param rows: dicts with date, oper_type, oper_amount and comment
+        """
+        def cleaned():
+            for row in rows:
+                comment = row.get('comment')
+                yield {**row, 'comment': re.sub(r'\D+', '', comment) if isinstance(comment, str) else None,
+                       'grouped': None}
+
+        StreamingCsvWriter(filename, column_names_mapping=OPERATIONS_CSV_NAMES,
+                           columns=OPERATIONS_CSV_COLUMNS).write(cleaned())
+
+    def save_operation_batches_to_csv(self, batches: Iterable[OperationBatch], filename: Union[str, IO[bytes]]):
+        """Save operations batches to csv - Запись пачек операций в csv, как safe_to_csv_operations"""
+        def rows():
+            for batch in batches:
+                dates, oper_types, amounts, comments = batch.value_lists(['date', 'oper_type', 'oper_amount', 'comment'])
+                comments = [re.sub(r'\D+', '', comment) if isinstance(comment, str) else None for comment in comments]
+                yield from zip(dates, oper_types, amounts, comments, repeat(None))
+
+        StreamingCsvWriter(filename, column_names_mapping=OPERATIONS_CSV_NAMES,
+                           columns=OPERATIONS_CSV_COLUMNS).write_tuples(rows())
+
+    def save_batches_to_csv(self, batches: Iterable[ColumnBatch], filename: Union[str, IO[bytes]],
+                            column_names_mapings: Dict[str, str], columns: List[str]):
+        """
+        Save batches to csv - Потоковая запись пачек в csv без объектов строк, как save_to_csv
+
+        :param columns: batch fields in order of csv columns
+        """
+        rows = (values for batch in batches for values in batch.tuples(columns))
+        StreamingCsvWriter(filename, column_names_mapping=column_names_mapings, columns=columns).write_tuples(rows)
+
+    def save_managers_batches_to_csv(self, batches: Iterable[EmployeeOperationsBatch], filename: Union[str, IO[bytes]],
+                                     directory: EmployeeDirectory = None):
+        """
+        Save employee operations batches to csv - Запись пачек операций сотрудников в csv
+
+        Формат тот же, что у save_to_csv_mananagers_operations, данные сотрудника берутся
+        из справочника один раз на сотрудника.
+
+        :param directory: employees, defaults to self.employees
+        """
+        directory = directory or EmployeeDirectory(self.employees)
+        with open_csv_output(filename) as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(MANAGERS_CSV_FIELDS)
+            for batch in batches:
+                employee_ids = batch.column('employee_id')
+                unique_ids, positions = np.unique(employee_ids, return_inverse=True)
+                staff = [directory.get(employee_id) for employee_id in unique_ids.tolist()]
+                info = [object_array([getattr(employee, name) if employee else None for employee in staff])[positions]
+                        .tolist() for name in ('last_name', 'first_name', 'middle_name', 'phone', 'create_date',
+                                               'rating')]
+                values = [integral(batch.values(name)) if kind == 'number' else batch.values(name)
+                          for name, kind in batch.FIELDS.items() if name != 'employee_id']
+                writer.writerows(zip(employee_ids.tolist(), *info, *values))
+
+    def save_to_csv_mananagers_operations(self, data: Iterable[Dict], filename: Union[str, IO[bytes]]):
+        with open_csv_output(filename) as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=MANAGERS_CSV_FIELDS)
             writer.writeheader()
             for employee in data:
                 for operation in employee['operations']:
@@ -455,19 +1186,3 @@ class ParserWB:
                         })
                     else:
                         logger.info(f'Нет данных по операциям для сотрудника {employee["employee_id"]}')
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
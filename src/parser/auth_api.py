@@ -1,6 +1,8 @@
-import requests
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
 from bot.logger import WBLogger
-from utils.env import API_URL, BASIC_API, TOKEN_URL_FASTAPI, EMPLOYEE_URL
+from parser.sessions import session_registry
+from utils.env import API_URL, BASIC_API, TOKEN_URL_FASTAPI, EMPLOYEE_URL, ENTRY_LOG_WORKERS
 import os
 from datetime import datetime
 import glob
@@ -19,19 +21,27 @@ class AuthApi:
         "Referer": "chrome-extension"
     }
 
-    def __init__(self):
+    def __init__(self, max_workers: int = ENTRY_LOG_WORKERS):
         self.token = None
         self.token_url = TOKEN_URL_FASTAPI
         self.employee_url = EMPLOYEE_URL
-        self.session = requests.Session()
+        # общая сессия сервиса сотрудников, размер пула соединений задается HTTP_POOL_SIZE(S)
+        self.session = session_registry.session('employee-api')
         self.session.headers.update(self.headers)
+        self.max_workers = max_workers
+        # версия токена общей сессии: обновление выполняется один раз на все запросы, получившие 401,
+        # в том числе запросы других экземпляров AuthApi
+        self._token_state = session_registry.token('employee-api')
 
     def get_token(self):
         try:
-            response = self.session.get(url=self.token_url, headers=self.headers)
+            with self._token_state.lock:
+                response = self.session.get(url=self.token_url, headers=self.headers)
+                if response.status_code == 200:
+                    self.token = response.json()['token']
+                    self.session.headers.update({"employee-api": f'{self.token}'})
+                    self._token_state.version += 1
             if response.status_code == 200:
-                self.token = response.json()['token']
-                self.session.headers.update({"employee-api": f'{self.token}'})
                 logger.info(f"Token is {self.token}")
                 return self.session
             else:
@@ -41,26 +51,40 @@ class AuthApi:
             logger.error(f"Error while connect with key: {e}")
             return None
 
+    def _refresh_token(self, failed_version: int):
+        """Обновление токена, если его еще не обновил другой поток после неудачного запроса"""
+        with self._token_state.lock:
+            if self._token_state.version == failed_version:
+                self.get_token()
+
     def get_employee_data(self, phone_number: str):
+        """Get entry log for employee - Получение журнала входов сотрудника, при 401 токен обновляется и запрос повторяется"""
         try:
+            token_version = self._token_state.version
             enpoint_url = f'{self.employee_url}/{phone_number}'
             response = self.session.get(url=enpoint_url)
+            if response.status_code == 401:
+                logger.error(f"Response for get employee data is {response.status_code}")
+                self._refresh_token(token_version)
+                response = self.session.get(url=enpoint_url)
             if response.status_code == 200:
                 return response.json()
-            elif response.status_code == 404:
+            else:
                 logger.error(f"Response for get employee data is {response.status_code}")
                 return None
-            elif response.status_code == 401:
-                logger.error(f"Response for get employee data is {response.status_code}")
-                self.get_token()
-                return None
         except Exception as e:
             logger.error(f"Error while get employee data: {e}")
             return None
 
+    def get_employees_data(self, phones: Iterable[str]) -> Dict[str, Optional[List[Dict]]]:
+        """
+        Get entry logs for employees - Получение журналов входов нескольких сотрудников
 
+        Запросы выполняются параллельно не более чем в max_workers потоков через общую сессию.
 
-
-
-
-
+        :param phones: employee phones, empty values are skipped
+        :return: phone -> entry log records or None
+        """
+        phones = list(dict.fromkeys(phone for phone in phones if phone))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return dict(zip(phones, executor.map(self.get_employee_data, phones)))
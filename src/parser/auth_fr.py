@@ -1,9 +1,9 @@
-import requests
+from typing import Optional
 from bot.logger import WBLogger
-from utils.env import basic, LOGIN_FR_URL, TOKEN_URL
-import os
-from datetime import datetime
-import glob
+from parser.sessions import session_registry
+from parser.rate_limit import rate_limiter
+from parser.token_store import TokenStore, default_token_store
+from utils.env import basic, LOGIN_FR_URL, TOKEN_URL, ACCESS_TOKEN_TTL
 
 # set up logging
 logger = WBLogger(__name__).get_logger()
@@ -21,51 +21,41 @@ class Auth:
         "User-Agent": "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:91.0) Gecko/20100101 Firefox/91.0"
     }
 
-    def __init__(self):
+    def __init__(self, token_store: TokenStore = None):
         self.token = None
         self.refresh_token = None
         self.login_url = LOGIN_FR_URL
-        self.session = requests.Session()
-        self.session.headers.update(self.headers)
+        # запросы к серверу авторизации идут через общую сессию с Basic авторизацией,
+        # сессия аккаунта с Bearer токеном берется из реестра после получения токена
+        self.auth_session = session_registry.session('franchise-auth')
+        self.auth_session.headers.update(self.headers)
+        self.session = self.auth_session
         self.token_url = TOKEN_URL
         self.auth_status = None
+        # токены хранятся между запусками, по умолчанию одно хранилище на процесс
+        self.token_store = token_store or default_token_store()
 
     def get_auth_status(self):
         return self.auth_status
 
     def get_franchise_session(self, phone: str):
+        # действующий access токен или refresh токен из хранилища
+        session = self.get_saved_session(phone)
+        if session is not None:
+            logger.info("Session is OK")
+            return session
 
-        self.refresh_token = self._load_refresh_token(phone)
-        logger.info(f"Refresh token is {self.refresh_token}")
-        # Init status code
-        status_code = None
-        # If refresh token is not None then connect with refresh token
-        if self.refresh_token:
-            self.session, status_code = self.connect_with_token()
-            logger.info(f"Status code after connect with refresh token is {status_code}")
-            logger.info(f"Session after connect with refresh token is {self.session}")
-            if self.session and status_code != 400:
-                logger.info("Session is OK")
-                return self.session
-            else:
-                self._remove_refresh_token_file(phone)
-                logger.error(" Refresh token is expired. Trying to connect with phone and code")
-
-        # If status code is 400 then refresh token is expired
-        # else connect with phone and code
+        # If there is no valid token then connect with phone and code
         params = {
             'phone': phone
         }
         try:
-            response = self.session.get(url=LOGIN_FR_URL, headers=self.headers, params=params)
+            # запрос кода отправляет СМС, поэтому не повторяется
+            response = rate_limiter.request(self.auth_session, 'GET', self.login_url, 'auth', retry=False,
+                                            headers=self.headers, params=params)
             logger.info(f"Response for login franchise is {response.json()}")
             if response.status_code == 200 and response.json()['isSuccess']:
                 logger.info(f"Response for login franchise is OK")
-                # send code from LK WB and pass it to _connect_with_code
-                # code = input('Enter code from LK WB: ')
-                # if code:
-                #     self._connect_with_code(phone, code)
-                # else:
                 self.auth_status = "NEED_CODE"
             else:
                 self.auth_status = response.json()['message']
@@ -74,14 +64,43 @@ class Auth:
             self.auth_status = "ERROR"
         return self.session
 
-    def _remove_refresh_token_file(self, phone):
-        try:
-            files = glob.glob(f"refresh_token_{phone}_*.txt")
-            for f in files:
-                os.remove(f)
-            logger.info(f"Refresh token file for {phone} is removed")
-        except Exception as e:
-            logger.error(f"Error while removing refresh token file {e}")
+    def get_saved_session(self, phone: str):
+        """
+        Get session by saved tokens - Сессия по сохраненным токенам без запроса кода
+
+        Действующий access токен используется без запросов к серверу авторизации.
+        Если до его истечения осталось меньше TOKEN_REFRESH_MARGIN, токен обновляется
+        по refresh токену один раз на все параллельные запросы по телефону.
+        Используется и фоновыми задачами, где ввести код из ЛК некому.
+
+        :return: session or None if there is no valid refresh token
+        """
+        tokens = self.token_store.get(phone)
+        if tokens is None:
+            return None
+        if not tokens.is_access_valid():
+            with self.token_store.lock(phone):
+                # токен мог обновить другой поток, пока ожидалась блокировка
+                tokens = self.token_store.get(phone)
+                if tokens is None:
+                    return None
+                if not tokens.is_access_valid():
+                    self.refresh_token = tokens.refresh_token
+                    session, status_code = self.connect_with_token(phone)
+                    if session and status_code == 200:
+                        return session
+                    if status_code in (400, 401):
+                        self.token_store.delete(phone)
+                        logger.error(f"Refresh token for {phone} is expired")
+                    return None
+        self._use_access_token(phone, tokens.access_token)
+        self.refresh_token = tokens.refresh_token
+        return self.session
+
+    @staticmethod
+    def saved_phones():
+        """Телефоны, для которых сохранен refresh токен"""
+        return default_token_store().phones()
 
     def connect_with_code(self, phone, code):
         payload = {
@@ -90,14 +109,11 @@ class Auth:
             'password': code
         }
         try:
-            response = self.session.post(url=TOKEN_URL, data=payload)
+            response = rate_limiter.request(self.auth_session, 'POST', self.token_url, 'auth', data=payload,
+                                            headers=self.headers)
             if response.status_code == 200:
-                self.token = response.json()['access_token']
-                self.session.headers.update({'Authorization': f"Bearer {self.token}"})
-                self.refresh_token = response.json()['refresh_token']
-                self._save_refresh_token(self.refresh_token, phone)
-                # os.environ['refresh_token'] = self.refresh_token
-                logger.info(f"New Refresh token is taken {self.refresh_token}")
+                self._save_tokens(phone, response.json())
+                logger.info(f"New Refresh token is taken for {phone}")
                 return self.session
             else:
                 logger.error(f"Error while connecting with code {response.json()}")
@@ -106,17 +122,16 @@ class Auth:
             logger.error(f"Error while connecting with code {e}")
             return None
 
-    def connect_with_token(self):
+    def connect_with_token(self, phone: str = None):
         payload = {
             'refresh_token': self.refresh_token,
             'grant_type': 'refresh_token'
         }
-        logger.info(f"Payload for refresh token is {payload}")
         try:
-            response = self.session.post(url=self.token_url, data=payload, headers=self.headers)
+            response = rate_limiter.request(self.auth_session, 'POST', self.token_url, 'auth', data=payload,
+                                            headers=self.headers)
             if response.status_code == 200:
-                self.token = response.json()['access_token']
-                self.session.headers.update({'Authorization': f"Bearer {self.token}"})
+                self._save_tokens(phone, response.json())
                 return self.session, response.status_code
             else:
                 logger.error(f'Status code: {response.status_code}')
@@ -125,19 +140,15 @@ class Auth:
             logger.error(f"Error while connecting with token {e}")
             return None, None
 
-    def _save_refresh_token(self, refresh_token, phone):
-        date_str = datetime.now().strftime("%d-%m-%Y_%H:%M:%S")
-        filename = f'refresh_token_{phone}_{date_str}.txt'
-        with open(filename, 'w') as f:
-            f.write(refresh_token)
-
-    def _load_refresh_token(self, phone):
-        try:
-            files = glob.glob(f'refresh_token_{phone}_*.txt')
-            latest_file = max(files, key=os.path.getctime)
-            with open(latest_file, 'r') as f:
-                return f.read()
-        except Exception as e:
-            logger.error(f"Error while loading refresh token {e}")
-            return None
+    def _use_access_token(self, phone: Optional[str], token: str):
+        """Bearer токен в сессии аккаунта, общей для всех отчетов по телефону"""
+        self.token = token
+        self.session = session_registry.session(f'franchise:{phone}')
+        self.session.headers.update({'Authorization': f"Bearer {self.token}"})
 
+    def _save_tokens(self, phone: Optional[str], data: dict):
+        """Токены из ответа сервера авторизации, refresh токен сохраняется прежним, если новый не выдан"""
+        self._use_access_token(phone, data['access_token'])
+        self.refresh_token = data.get('refresh_token') or self.refresh_token
+        if phone:
+            self.token_store.save(phone, self.token, self.refresh_token, data.get('expires_in') or ACCESS_TOKEN_TTL)
@@ -30,3 +30,41 @@ oper_type_mapping= {
     5: 'Вывод средств на реквизиты',
     6: 'Вознаграждения по продажам'
 }
+
+manager_kpi_column_names_mapping = {
+    'employee_id': 'ID сотрудника',
+    'last_name': 'Фамилия',
+    'first_name': 'Имя',
+    'middle_name': 'Отчество',
+    'phone': 'Телефон',
+    'shifts': 'Смены',
+    'on_place_cnt': 'Принято товаров',
+    'on_place_per_shift': 'Принято за смену',
+    'sale_count': 'Продажи',
+    'sale_sum': 'Продажи РУБ',
+    'sale_sum_per_shift': 'Продажи РУБ за смену',
+    'return_count': 'Возвраты',
+    'return_sum': 'Возвраты РУБ',
+    'return_rate': 'Доля возвратов',
+    'best_window_sale_sum': 'Лучшие продажи РУБ за {window} дн.',
+    'sale_sum_rank': 'Место по продажам',
+}
+
+sales_summary_column_names_mapping = {
+    'grain': 'Период',
+    'period_start': 'Начало периода',
+    'office_id': 'ID офиса',
+    'name': 'Название офиса',
+    'days': 'Дней',
+    'sale_count': 'Продажи',
+    'return_count': 'Возвраты',
+    'sale_sum': 'Продажи РУБ',
+    'return_sum': 'Возвраты РУБ',
+    'proceeds': 'Объем продаж РУБ',
+    'amount': 'Вознаграждение РУБ',
+    'bags_sum': 'Пакеты РУБ',
+    'office_rating_sum': 'Рейтинг ПВЗ РУБ',
+    'supplier_return_sum': 'Возвраты поставщику РУБ',
+    'average_rating': 'Средний рейтинг ПВЗ',
+    'weighted_rating': 'Рейтинг ПВЗ, взвешенный по выручке',
+}
@@ -0,0 +1,237 @@
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+
+# виды колонок:
+# int - целые числа (int64)
+# number - суммы и количества из ответа API: int64, если все значения целые, иначе float64 с NaN вместо None
+# date - день (datetime64[D]), в строках - datetime на начало дня
+# isodate - день (datetime64[D]), в строках - строка YYYY-MM-DD
+# category - коды значений (int32) в словаре Categories, например названия офисов
+# object - значения как есть (object)
+
+
+class Categories:
+    """Словарь значений категориальной колонки: значение -> код"""
+    def __init__(self, values: Iterable[Any] = ()):
+        self.values: List[Any] = []
+        self._codes: Dict[Any, int] = {}
+        for value in values:
+            self.code(value)
+
+    def code(self, value: Any) -> int:
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def codes(self, values: Iterable[Any]) -> np.ndarray:
+        return np.fromiter(map(self.code, values), dtype=np.int32)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return object_array(self.values)[codes]
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+def object_array(values: Sequence[Any]) -> np.ndarray:
+    """Массив object без разбора вложенных последовательностей в измерения"""
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def _to_day(value: Any) -> Optional[np.datetime64]:
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        value = value.date()
+    elif not isinstance(value, date):
+        value = str(value)[:10]
+    return np.datetime64(value, 'D')
+
+
+def _number_array(values: List[Any]) -> np.ndarray:
+    if all(type(value) is int for value in values):
+        return np.array(values, dtype=np.int64)
+    return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+
+
+class ColumnBatch:
+    """
+    Columnar batch - Пачка строк по колонкам (массивы NumPy)
+
+    Колонки и их виды задаются в FIELDS наследника в порядке полей строки, ROW - класс
+    строки для кода, которому нужны объекты, ROW_FIELDS - передаваемые ему колонки.
+    Категориальные колонки хранят коды в словарях Categories, общих для пачек одного
+    источника.
+    """
+    FIELDS: Dict[str, str] = {}
+    ROW: Callable = None
+    ROW_FIELDS: Sequence[str] = None
+
+    def __init__(self, columns: Dict[str, np.ndarray], categories: Dict[str, Categories] = None):
+        self.columns = columns
+        self.categories = categories or {}
+
+    def __len__(self) -> int:
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    @classmethod
+    def builder(cls, categories: Dict[str, Categories] = None) -> 'BatchBuilder':
+        return BatchBuilder(cls, categories)
+
+    @classmethod
+    def empty(cls, categories: Dict[str, Categories] = None) -> 'ColumnBatch':
+        return cls.builder(categories).build()
+
+    def column(self, name: str) -> np.ndarray:
+        """Массив колонки, для категориальной - коды"""
+        return self.columns[name]
+
+    def decoded(self, name: str) -> np.ndarray:
+        """Массив значений колонки, категориальные коды заменены значениями"""
+        if self.FIELDS[name] == 'category':
+            return self.categories[name].decode(self.columns[name])
+        return self.columns[name]
+
+    def values(self, name: str) -> List[Any]:
+        """Значения колонки как объекты Python в виде, в котором они хранятся в строках"""
+        kind = self.FIELDS[name]
+        column = self.columns[name]
+        if kind == 'date':
+            return column.astype('datetime64[us]').tolist()
+        if kind == 'isodate':
+            return np.datetime_as_string(column, unit='D').tolist()
+        if kind == 'category':
+            return self.decoded(name).tolist()
+        return column.tolist()
+
+    def value_lists(self, names: Sequence[str] = None) -> List[List[Any]]:
+        return [self.values(name) for name in names or self.FIELDS]
+
+    def tuples(self, names: Sequence[str] = None) -> Iterator[tuple]:
+        """Строки значений в порядке names без создания объектов строк"""
+        return zip(*self.value_lists(names))
+
+    def rows(self) -> Iterator[Any]:
+        """Строки в виде объектов ROW"""
+        names = list(self.ROW_FIELDS or self.FIELDS)
+        for values in self.tuples(names):
+            yield self.ROW(**dict(zip(names, values)))
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        names = list(self.FIELDS)
+        return [dict(zip(names, values)) for values in self.tuples(names)]
+
+    def fillna(self, values: Dict[str, Any]) -> 'ColumnBatch':
+        """
+        Fill missing values - Пачка с пропусками (NaN) числовых колонок, замененными значениями
+
+        Колонка, все значения которой после замены целые, становится int64, как если бы
+        значения пришли целыми при сборке пачки.
+        """
+        columns = dict(self.columns)
+        for name, value in values.items():
+            column = columns[name]
+            missing = np.isnan(column) if column.dtype == np.float64 else None
+            if missing is None or not missing.any():
+                continue
+            column = np.where(missing, value, column)
+            if np.array_equal(column, np.floor(column)):
+                column = column.astype(np.int64)
+            columns[name] = column
+        return type(self)(columns, self.categories)
+
+    def take(self, indices: np.ndarray) -> 'ColumnBatch':
+        """Пачка из строк с индексами или по маске"""
+        return type(self)({name: column[indices] for name, column in self.columns.items()}, self.categories)
+
+    def sort_by(self, name: str) -> 'ColumnBatch':
+        return self.take(np.argsort(self.columns[name], kind='stable'))
+
+    @classmethod
+    def concat(cls, batches: Sequence['ColumnBatch']) -> 'ColumnBatch':
+        """
+        Concatenate batches - Объединение пачек
+
+        Категориальные коды перекодируются в словари первой пачки, если словари пачек разные.
+        """
+        batches = [batch for batch in batches if len(batch)]
+        if not batches:
+            return cls.empty()
+        if len(batches) == 1:
+            return batches[0]
+        categories = batches[0].categories
+        columns = {}
+        for name, kind in cls.FIELDS.items():
+            parts = []
+            for batch in batches:
+                part = batch.columns[name]
+                if kind == 'category' and batch.categories[name] is not categories[name]:
+                    part = categories[name].codes(batch.decoded(name).tolist())
+                parts.append(part)
+            if kind == 'number' and len({part.dtype for part in parts}) > 1:
+                parts = [part.astype(np.float64) for part in parts]
+            columns[name] = np.concatenate(parts)
+        return cls(columns, categories)
+
+    def nbytes(self) -> int:
+        """Размер массивов колонок в байтах (без объектов колонок object и словарей категорий)"""
+        return sum(column.nbytes for column in self.columns.values())
+
+
+class BatchBuilder:
+    """
+    Batch builder - Заполнение пачки по строкам
+
+    Значения копятся в списках по колонкам и один раз переводятся в массивы в build().
+    """
+    def __init__(self, batch_class: type, categories: Dict[str, Categories] = None):
+        self.batch_class = batch_class
+        self.fields: List[Tuple[str, str]] = list(batch_class.FIELDS.items())
+        self.categories = categories if categories is not None else {}
+        for name, kind in self.fields:
+            if kind == 'category':
+                self.categories.setdefault(name, Categories())
+        self._values: List[List[Any]] = [[] for _ in self.fields]
+
+    def __len__(self) -> int:
+        return len(self._values[0])
+
+    def append(self, *values: Any):
+        """Добавление строки значениями в порядке FIELDS"""
+        for column, value in zip(self._values, values):
+            column.append(value)
+
+    def append_dict(self, row: Dict[str, Any]):
+        for column, (name, _) in zip(self._values, self.fields):
+            column.append(row.get(name))
+
+    def build(self) -> ColumnBatch:
+        columns = {}
+        for (name, kind), values in zip(self.fields, self._values):
+            if kind == 'int':
+                columns[name] = np.array(values, dtype=np.int64)
+            elif kind == 'number':
+                columns[name] = _number_array(values)
+            elif kind in ('date', 'isodate'):
+                columns[name] = np.array([_to_day(value) for value in values], dtype='datetime64[D]')
+            elif kind == 'category':
+                columns[name] = self.categories[name].codes(values)
+            else:
+                columns[name] = object_array(values)
+        self._values = [[] for _ in self.fields]
+        return self.batch_class(columns, self.categories)
+
+
+def integral(values: Iterable[Any]) -> List[Any]:
+    """
+    Integral floats as int - Целые значения float как int, NaN как None
+
+    Как в ответе API, где суммы без дробной части приходят целыми.
+    """
+    return [(int(value) if value.is_integer() else None if value != value else value)
+            if type(value) is float else value for value in values]
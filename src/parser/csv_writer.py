@@ -0,0 +1,182 @@
+import csv
+import io
+import os
+import pickle
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import islice
+from typing import IO, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Union
+from utils.env import CSV_CHUNK_SIZE
+
+NoneType = type(None)
+
+
+def flatten_operations(rows: Iterable[Dict], oper_type_mapping: Dict = None) -> Iterator[Dict]:
+    """
+    Flatten nested operations - Разворачивание вложенных operations и grouped в плоские строки
+
+    Каждая операция и каждая ее вложенная операция из grouped становятся отдельной
+    строкой с полями родительской записи. Строки без operations отдаются как есть.
+
+    :param rows: dicts, e.g. from OperationsByDate.to_dict()
+    :param oper_type_mapping: mapping for oper_type values
+    """
+    for row in rows:
+        if 'operations' not in row:
+            yield row
+            continue
+        parent = {key: value for key, value in row.items() if key != 'operations'}
+        for operation in row['operations'] or []:
+            for op in [operation, *(operation.get('grouped') or [])]:
+                flat = dict(parent)
+                flat.update((key, value) for key, value in op.items() if key != 'grouped')
+                if oper_type_mapping:
+                    flat['oper_type'] = oper_type_mapping.get(flat.get('oper_type'))
+                yield flat
+
+
+@contextmanager
+def open_csv_output(target: Union[str, os.PathLike, IO[bytes]]) -> Iterator[IO[str]]:
+    """
+    Text stream for csv output - Текстовый поток для записи csv в файл или бинарный буфер
+
+    :param target: file path or writable binary file object, the object is left open
+    """
+    if isinstance(target, (str, os.PathLike)):
+        with open(target, 'w', newline='', encoding='utf-8') as csvfile:
+            yield csvfile
+        return
+    csvfile = io.TextIOWrapper(target, encoding='utf-8', newline='')
+    try:
+        yield csvfile
+    finally:
+        csvfile.flush()
+        csvfile.detach()
+
+
+class StreamingCsvWriter:
+    """
+    Streaming CSV writer - Потоковая запись CSV без построения DataFrame
+
+    Строки пачками по chunk_size складываются во временный файл, по ходу отслеживаются
+    типы значений в колонках. Затем пачки записываются в CSV с тем же форматированием,
+    что дает DataFrame.to_csv(index=False): колонки целых чисел с пропусками пишутся
+    как float, колонки дат без времени - как YYYY-MM-DD, пропуски - пустой строкой.
+    В памяти одновременно находится только одна пачка. Вместо имени файла можно
+    передать бинарный файловый объект, например буфер отчета.
+    """
+    def __init__(self, filename: Union[str, IO[bytes]], column_names_mapping: Dict[str, str] = None,
+                 columns: List[str] = None, chunk_size: int = CSV_CHUNK_SIZE):
+        self.filename = filename
+        self.column_names_mapping = column_names_mapping or {}
+        self.columns = list(columns or [])
+        self.chunk_size = chunk_size
+        self.rows_written = 0
+        # типы значений и наличие времени в датах по каждой колонке
+        self._types: List[set] = [set() for _ in self.columns]
+        self._has_time: List[bool] = [False for _ in self.columns]
+        self._has_microseconds: List[bool] = [False for _ in self.columns]
+
+    def write(self, rows: Iterable[Dict]) -> int:
+        """
+        Write rows to csv file - Запись строк в csv файл
+
+        :param rows: iterable of dicts, columns are taken in order of first appearance
+        :return: number of written rows
+        """
+        return self._write_chunks(self._iter_chunks(rows))
+
+    def write_tuples(self, rows: Iterable[Sequence]) -> int:
+        """
+        Write value rows to csv file - Запись строк значений в порядке columns без построения словарей
+
+        :param rows: iterable of sequences with values in order of self.columns
+        :return: number of written rows
+        """
+        return self._write_chunks(self._iter_tuple_chunks(rows))
+
+    def _write_chunks(self, chunks_iterator: Iterator[List[tuple]]) -> int:
+        with tempfile.TemporaryFile() as spool:
+            chunks = 0
+            for chunk in chunks_iterator:
+                self._track_types(chunk)
+                pickle.dump(chunk, spool, protocol=pickle.HIGHEST_PROTOCOL)
+                chunks += 1
+            spool.seek(0)
+            formatters = [self._get_formatter(index) for index in range(len(self.columns))]
+            with open_csv_output(self.filename) as csvfile:
+                writer = csv.writer(csvfile, lineterminator=os.linesep)
+                writer.writerow([self.column_names_mapping.get(column, column) for column in self.columns])
+                for _ in range(chunks):
+                    chunk = pickle.load(spool)
+                    columns = [values if formatter is None else list(map(formatter, values))
+                               for values, formatter in zip(self._transpose(chunk), formatters)]
+                    writer.writerows(zip(*columns))
+                    self.rows_written += len(chunk)
+        return self.rows_written
+
+    def _iter_chunks(self, rows: Iterable[Dict]) -> Iterator[List[tuple]]:
+        """Разбиение строк на пачки кортежей в порядке колонок"""
+        positions = {column: index for index, column in enumerate(self.columns)}
+        chunk = []
+        for row in rows:
+            for column in row:
+                if column not in positions:
+                    positions[column] = len(self.columns)
+                    self.columns.append(column)
+                    self._types.append(set())
+                    self._has_time.append(False)
+                    self._has_microseconds.append(False)
+            chunk.append(tuple(row.get(column) for column in self.columns))
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _iter_tuple_chunks(self, rows: Iterable[Sequence]) -> Iterator[List[tuple]]:
+        iterator = iter(rows)
+        while chunk := [tuple(row) for row in islice(iterator, self.chunk_size)]:
+            yield chunk
+
+    def _transpose(self, chunk: List[tuple]) -> List[tuple]:
+        """Значения пачки по колонкам, короткие строки дополняются None"""
+        width = len(self.columns)
+        if any(len(row) < width for row in chunk):
+            chunk = [row + (None,) * (width - len(row)) for row in chunk]
+        return list(zip(*chunk)) if chunk else [() for _ in range(width)]
+
+    def _track_types(self, chunk: List[tuple]):
+        for index, values in enumerate(self._transpose(chunk)):
+            types = set(map(type, values))
+            self._types[index] |= types
+            if datetime in types:
+                dates = [value for value in values if type(value) is datetime]
+                self._has_time[index] |= any(value.hour or value.minute or value.second or value.microsecond
+                                             for value in dates)
+                self._has_microseconds[index] |= any(value.microsecond for value in dates)
+
+    def _get_formatter(self, index: int) -> Optional[Callable]:
+        """
+        Formatter for column values by pandas dtype rules - Форматирование значений колонки как в pandas
+
+        None означает, что значения передаются в csv.writer без изменений.
+        """
+        types = self._types[index] - {NoneType}
+        has_none = NoneType in self._types[index]
+        if types == {datetime}:
+            if self._has_microseconds[index]:
+                date_format = '%Y-%m-%d %H:%M:%S.%f'
+            elif self._has_time[index]:
+                date_format = '%Y-%m-%d %H:%M:%S'
+            else:
+                date_format = '%Y-%m-%d'
+            return lambda value: '' if value is None else value.strftime(date_format)
+        if types == {int} and not has_none:
+            return None
+        if types and types <= {int, float}:
+            # числовая колонка с дробями или пропусками - float64 в pandas
+            return lambda value: '' if value is None or value != value else repr(float(value))
+        # object колонка - строковое представление, пропуски пустые
+        return lambda value: '' if value is None or (type(value) is float and value != value) else value
@@ -0,0 +1,96 @@
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from parser.api import Employee, EmployeeOperationsBatch
+
+
+class EmployeeDirectory:
+    """Справочник сотрудников с индексами по employee_id и телефону"""
+    def __init__(self, employees: Iterable['Employee'] = ()):
+        self._by_id: Dict[int, 'Employee'] = {}
+        self._by_phone: Dict[str, 'Employee'] = {}
+        for employee in employees:
+            self.add(employee)
+
+    def add(self, employee: 'Employee'):
+        self._by_id[employee.employee_id] = employee
+        if employee.phone:
+            self._by_phone[employee.phone] = employee
+
+    def get(self, employee_id: int) -> Optional['Employee']:
+        """Поиск сотрудника по employee_id"""
+        return self._by_id.get(employee_id)
+
+    def get_by_phone(self, phone: str) -> Optional['Employee']:
+        """Поиск сотрудника по телефону"""
+        return self._by_phone.get(phone)
+
+    def ids(self) -> List[int]:
+        return list(self._by_id)
+
+    def __iter__(self) -> Iterator['Employee']:
+        return iter(self._by_id.values())
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+
+def build_barcode_index(entries_by_phone: Dict[str, Optional[List[Dict]]]) -> Dict[Tuple[str, str], str]:
+    """
+    Build (phone, date) -> barcode index - Индекс ШК офиса по телефону и дате входа
+
+    При нескольких входах за день берется последний, как и при прежнем переборе.
+
+    :param entries_by_phone: entry log records from FastAPI service by phone
+    """
+    index = {}
+    for phone, entries in entries_by_phone.items():
+        for entry in entries or []:
+            # получаем дату записи входа без времени
+            index[(phone, (entry.get('date_created') or '').split('T')[0])] = entry.get('barcode')
+    return index
+
+
+def attach_entry_barcodes(managers_data: Iterable[Dict], entries_by_phone: Dict[str, Optional[List[Dict]]]):
+    """
+    Set office barcode for employee operations - Проставление ШК офиса в операции сотрудников
+
+    Хеш-соединение операций всех сотрудников с журналом входов по (телефон, дата).
+
+    :param managers_data: result of ParserWB.fetch_employee_data
+    :param entries_by_phone: entry log records from FastAPI service by phone
+    """
+    index = build_barcode_index(entries_by_phone)
+    for employee in managers_data:
+        phone = employee.get('phone')
+        for operation in employee.get('operations') or []:
+            key = (phone, operation.date)
+            if key in index:
+                operation.barcode = index[key]
+
+
+def attach_batch_barcodes(batch: 'EmployeeOperationsBatch', directory: EmployeeDirectory,
+                          entries_by_phone: Dict[str, Optional[List[Dict]]]):
+    """
+    Set office barcode for employee operations batch - Проставление ШК офиса в пачку операций сотрудников
+
+    То же соединение по (телефон, дата), телефон ищется один раз на сотрудника.
+
+    :param batch: result of ParserWB.iter_employee_operation_batches
+    :param directory: employees
+    :param entries_by_phone: entry log records from FastAPI service by phone
+    """
+    index = build_barcode_index(entries_by_phone)
+    phones = {}
+    for employee_id in set(batch.column('employee_id').tolist()):
+        employee = directory.get(employee_id)
+        phones[employee_id] = employee.phone if employee else None
+    barcodes = [index.get((phones[employee_id], day), barcode) for employee_id, day, barcode
+                in batch.tuples(['employee_id', 'date', 'barcode'])]
+    batch.columns['barcode'] = batch.categories['barcode'].codes(barcodes)
+
+
+def batch_phones(batches: Iterable['EmployeeOperationsBatch'], directory: EmployeeDirectory) -> List[str]:
+    """Телефоны сотрудников, у которых есть операции в пачках"""
+    employee_ids = dict.fromkeys(employee_id for batch in batches for employee_id in batch.column('employee_id').tolist())
+    return [employee.phone for employee in map(directory.get, employee_ids) if employee and employee.phone]
@@ -0,0 +1,106 @@
+import codecs
+import json
+from typing import Any, Iterable, Iterator
+
+WHITESPACE = ' \t\n\r'
+NUMBER_CHARS = '0123456789.eE+-'
+
+
+class JsonArrayStream:
+    """
+    Incremental JSON array parser - Потоковый разбор массива из JSON объекта верхнего уровня
+
+    Ответ читается кусками байт, элементы массива под ключом key разбираются
+    по одному через json.JSONDecoder.raw_decode. В памяти находится только
+    текущий элемент и необработанный остаток буфера. Остальные поля объекта
+    разбираются целиком и пропускаются.
+    """
+    def __init__(self, chunks: Iterable[bytes], key: str):
+        self.chunks = iter(chunks)
+        self.key = key
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        """Чтение следующего куска ответа в буфер, False если ответ закончился"""
+        if self.eof:
+            return False
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.eof = True
+            text = self.text_decoder.decode(b'', final=True)
+        else:
+            text = self.text_decoder.decode(chunk)
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        return chunk is not None
+
+    def _peek(self) -> str:
+        """Следующий значимый символ без его извлечения, пустая строка в конце ответа"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, chars: str) -> str:
+        char = self._peek()
+        if not char or char not in chars:
+            raise ValueError(f'Ожидался один из символов {chars!r} в позиции {self.pos}, получено {char!r}')
+        self.pos += 1
+        return char
+
+    def _decode_value(self) -> Any:
+        """Разбор одного значения, при нехватке данных буфер дочитывается"""
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # число в конце буфера может продолжиться в следующем куске
+            if (end == len(self.buffer) or self._is_number_tail(value, end)) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def _is_number_tail(self, value: Any, end: int) -> bool:
+        """Число, за которым в буфере нет разделителя, может быть прочитано не полностью"""
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return False
+        return all(char in NUMBER_CHARS for char in self.buffer[end:])
+
+    def __iter__(self) -> Iterator[Any]:
+        self._expect('{')
+        if self._peek() == '}':
+            return
+        while True:
+            key = self._decode_value()
+            self._expect(':')
+            if key == self.key and self._peek() == '[':
+                yield from self._iter_array()
+                return
+            self._decode_value()
+            if self._expect(',}') == '}':
+                return
+
+    def _iter_array(self) -> Iterator[Any]:
+        self._expect('[')
+        if self._peek() == ']':
+            return
+        while True:
+            yield self._decode_value()
+            if self._expect(',]') == ']':
+                return
+
+
+def iter_json_array(chunks: Iterable[bytes], key: str) -> Iterator[Any]:
+    """Items of array under top-level key - Элементы массива по ключу верхнего уровня из потока байт"""
+    return iter(JsonArrayStream(chunks, key))
@@ -0,0 +1,197 @@
+from datetime import date, datetime
+from typing import IO, Dict, Iterable, List, Optional, Sequence, Union
+import numpy as np
+from parser.api import EmployeeOperationsBatch, to_date
+from parser.column_names import manager_kpi_column_names_mapping
+from parser.columnar import integral
+from parser.csv_writer import StreamingCsvWriter
+from parser.employees import EmployeeDirectory
+from utils.env import KPI_WINDOW_DAYS
+
+# показатели сотрудника за день в порядке последней оси матрицы
+METRICS = ('on_place_cnt', 'return_count', 'return_sum', 'sale_count', 'sale_sum')
+
+# колонки отчета KPI менеджеров
+KPI_COLUMNS = ['employee_id', 'last_name', 'first_name', 'middle_name', 'phone', 'shifts', 'on_place_cnt',
+               'on_place_per_shift', 'sale_count', 'sale_sum', 'sale_sum_per_shift', 'return_count', 'return_sum',
+               'return_rate', 'best_window_sale_sum', 'sale_sum_rank']
+
+
+def ratio(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    """Поэлементное деление, NaN там, где знаменатель равен нулю"""
+    numerator = np.asarray(numerator, dtype=np.float64)
+    result = np.full(np.broadcast(numerator, denominator).shape, np.nan)
+    np.divide(numerator, denominator, out=result, where=np.asarray(denominator) != 0)
+    return result
+
+
+def rank(values: np.ndarray, descending: bool = True) -> np.ndarray:
+    """
+    Rank values - Места по значениям: равные значения делят место, NaN - в конце
+
+    :param values: 1-d array
+    :param descending: first place for the largest value
+    :return: int64 array of places starting from 1
+    """
+    keys = np.asarray(values, dtype=np.float64)
+    keys = -keys if descending else keys.copy()
+    keys[np.isnan(keys)] = np.inf
+    return np.searchsorted(np.sort(keys), keys, side='left') + 1
+
+
+class EmployeeDayMatrix:
+    """
+    Employee x day matrix - Показатели сотрудников по дням в плотном массиве
+
+    values[сотрудник, день, показатель] - показатели METRICS за каждый день периода,
+    дни без операций заполнены нулями, worked[сотрудник, день] отмечает дни, за которые
+    у сотрудника есть строка операций (смены). Все расчеты выполняются над осями
+    массива без перебора сотрудников и дней.
+    """
+    def __init__(self, employee_ids: np.ndarray, dates: np.ndarray, values: np.ndarray, worked: np.ndarray):
+        self.employee_ids = employee_ids
+        self.dates = dates
+        self.values = values
+        self.worked = worked
+
+    @classmethod
+    def from_arrays(cls, employee_ids: np.ndarray, dates: np.ndarray, metrics: Sequence[np.ndarray],
+                    date_from: Union[str, date, datetime], date_to: Union[str, date, datetime],
+                    staff: Sequence[int] = None) -> 'EmployeeDayMatrix':
+        """
+        Build matrix from columns - Заполнение матрицы из колонок строк (сотрудник, день, показатели)
+
+        :param employee_ids: employee id of each row
+        :param dates: day of each row, datetime64[D]
+        :param metrics: columns in METRICS order, NaN is treated as zero
+        :param staff: employee ids in report order, employees from rows missing in staff go after them
+        """
+        day_from = np.datetime64(to_date(date_from), 'D')
+        day_to = np.datetime64(to_date(date_to), 'D')
+        days = max(int((day_to - day_from).astype(np.int64)) + 1, 0)
+        employee_ids = np.asarray(employee_ids, dtype=np.int64)
+        offsets = (np.asarray(dates, dtype='datetime64[D]') - day_from).astype(np.int64)
+        # строки вне периода не попадают в матрицу
+        inside = (offsets >= 0) & (offsets < days)
+        employee_ids, offsets = employee_ids[inside], offsets[inside]
+        # сотрудники строк в порядке первого появления после сотрудников staff
+        unique_ids, first = np.unique(employee_ids, return_index=True)
+        row_ids = unique_ids[np.argsort(first, kind='stable')]
+        known = np.asarray(staff if staff is not None else [], dtype=np.int64)
+        ids = np.concatenate([known, row_ids[~np.isin(row_ids, known)]])
+        sorter = np.argsort(ids, kind='stable')
+        rows = sorter[np.searchsorted(ids, employee_ids, sorter=sorter)]
+
+        values = np.zeros((len(ids), days, len(METRICS)))
+        worked = np.zeros((len(ids), days), dtype=bool)
+        # строки раскладываются по плоским индексам ячеек (сотрудник, день)
+        cells = rows * days + offsets
+        flat_values = values.reshape(-1)
+        for index, metric in enumerate(metrics):
+            column = np.asarray(metric, dtype=np.float64)[inside]
+            flat_values[cells * len(METRICS) + index] = np.where(np.isnan(column), 0.0, column)
+        worked.reshape(-1)[cells] = True
+        return cls(ids, day_from + np.arange(days), values, worked)
+
+    @classmethod
+    def from_batches(cls, batches: Iterable[EmployeeOperationsBatch], date_from: Union[str, date, datetime],
+                     date_to: Union[str, date, datetime], staff: Sequence[int] = None) -> 'EmployeeDayMatrix':
+        """Матрица из пачек ParserWB.iter_employee_operation_batches"""
+        batch = EmployeeOperationsBatch.concat(list(batches))
+        return cls.from_arrays(batch.column('employee_id'), batch.column('date'),
+                               [batch.column(name) for name in METRICS], date_from, date_to, staff)
+
+    @classmethod
+    def from_employee_data(cls, managers_data: Iterable[Dict], date_from: Union[str, date, datetime],
+                           date_to: Union[str, date, datetime], staff: Sequence[int] = None) -> 'EmployeeDayMatrix':
+        """Матрица из результата ParserWB.fetch_employee_data"""
+        employee_ids, dates = [], []
+        metrics: List[List] = [[] for _ in METRICS]
+        for employee in managers_data:
+            for operation in employee.get('operations') or []:
+                employee_ids.append(employee['employee_id'])
+                dates.append(operation.date[:10])
+                for column, name in zip(metrics, METRICS):
+                    column.append(getattr(operation, name))
+        metric_arrays = [np.array([np.nan if value is None else value for value in column], dtype=np.float64)
+                         for column in metrics]
+        return cls.from_arrays(np.array(employee_ids, dtype=np.int64), np.array(dates, dtype='datetime64[D]'),
+                               metric_arrays, date_from, date_to, staff)
+
+    def metric(self, name: str) -> np.ndarray:
+        """Показатель по сотрудникам и дням, массив (сотрудники, дни)"""
+        return self.values[:, :, METRICS.index(name)]
+
+    def totals(self) -> Dict[str, np.ndarray]:
+        """Суммы показателей за период по сотрудникам"""
+        sums = self.values.sum(axis=1)
+        return {name: sums[:, index] for index, name in enumerate(METRICS)}
+
+    def shifts(self) -> np.ndarray:
+        """Количество смен (дней с операциями) по сотрудникам"""
+        return self.worked.sum(axis=1)
+
+    def rolling(self, name: str, window: int) -> np.ndarray:
+        """
+        Rolling sum - Сумма показателя за window последних дней на каждый день периода
+
+        В первые window - 1 дней суммируются дни с начала периода.
+        """
+        cumulative = np.zeros((len(self.employee_ids), len(self.dates) + 1))
+        np.cumsum(self.metric(name), axis=1, out=cumulative[:, 1:])
+        ends = np.arange(1, len(self.dates) + 1)
+        return cumulative[:, ends] - cumulative[:, np.maximum(ends - window, 0)]
+
+    def kpis(self, window: int = KPI_WINDOW_DAYS) -> Dict[str, np.ndarray]:
+        """
+        Manager KPIs - Показатели менеджеров за период
+
+        Суммы показателей, количество смен, принято товаров и продажи на смену, доля
+        возвратов от продаж, лучшая сумма продаж за window дней подряд и место по продажам.
+        """
+        totals = self.totals()
+        shifts = self.shifts()
+        best_window = self.rolling('sale_sum', window).max(axis=1) if len(self.dates) \
+            else np.zeros(len(self.employee_ids))
+        return {
+            **totals,
+            'shifts': shifts,
+            'on_place_per_shift': ratio(totals['on_place_cnt'], shifts),
+            'sale_sum_per_shift': ratio(totals['sale_sum'], shifts),
+            'return_rate': ratio(totals['return_count'], totals['sale_count']),
+            'best_window_sale_sum': best_window,
+            'sale_sum_rank': rank(totals['sale_sum']),
+        }
+
+    def write_kpi_csv(self, filename: Union[str, IO[bytes]], directory: Optional[EmployeeDirectory] = None,
+                      window: int = KPI_WINDOW_DAYS) -> int:
+        """
+        Write manager KPIs to csv - Запись KPI менеджеров, одна строка на сотрудника
+
+        Сотрудники идут в порядке матрицы, места по продажам - отдельной колонкой.
+
+        :param filename: file name or binary file object
+        :param directory: employees for names and phones
+        :return: number of written rows
+        """
+        kpis = self.kpis(window)
+        directory = directory or EmployeeDirectory()
+        staff = [directory.get(employee_id) for employee_id in self.employee_ids.tolist()]
+        columns = {
+            'employee_id': self.employee_ids.tolist(),
+            'last_name': [employee.last_name if employee else None for employee in staff],
+            'first_name': [employee.first_name if employee else None for employee in staff],
+            'middle_name': [employee.middle_name if employee else None for employee in staff],
+            'phone': [employee.phone if employee else None for employee in staff],
+            'shifts': kpis['shifts'].tolist(),
+            'sale_sum_rank': kpis['sale_sum_rank'].tolist(),
+        }
+        for name in ('on_place_cnt', 'sale_count', 'sale_sum', 'return_count', 'return_sum',
+                     'best_window_sale_sum'):
+            columns[name] = integral(kpis[name].tolist())
+        for name, decimals in (('on_place_per_shift', 2), ('sale_sum_per_shift', 2), ('return_rate', 4)):
+            columns[name] = integral(np.round(kpis[name], decimals).tolist())
+        column_names = {column: name.format(window=window)
+                        for column, name in manager_kpi_column_names_mapping.items()}
+        writer = StreamingCsvWriter(filename, column_names_mapping=column_names, columns=KPI_COLUMNS)
+        return writer.write_tuples(zip(*(columns[name] for name in KPI_COLUMNS)))
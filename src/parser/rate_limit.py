@@ -0,0 +1,212 @@
+import random
+import threading
+import time
+from collections import Counter
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import urlparse
+import requests
+from utils.env import RATE_LIMIT_RPS, RATE_LIMIT_BURST, RATE_LIMIT_CONCURRENCY, RATE_LIMIT_MAX_CONCURRENCY, \
+    RETRY_ATTEMPTS, RETRY_BACKOFF, RETRY_BACKOFF_MAX, RETRY_AFTER_MAX
+from bot.logger import WBLogger
+
+logger = WBLogger(__name__).get_logger()
+
+# ответы, означающие перегрузку сервера: лимит параллельных запросов уменьшается
+THROTTLE_STATUSES = (429, 503)
+# ответы, после которых идемпотентный запрос повторяется
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def retry_after(response: requests.Response) -> Optional[float]:
+    """Задержка из заголовка Retry-After в секундах или HTTP дате"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Token bucket - Ограничение частоты запросов: rate в секунду, до burst подряд
+
+    Запрос резервирует токен сразу, поэтому ожидающие запросы выстраиваются в очередь
+    без гонок. block() приостанавливает выдачу токенов, например по Retry-After.
+    """
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Резервирование токена, возвращает время ожидания в секундах"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(-self.tokens / self.rate, self.blocked_until - now, 0.0)
+
+    def block(self, seconds: float):
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class AimdLimit:
+    """
+    Adaptive concurrency - Лимит параллельных запросов по схеме AIMD
+
+    Каждый успешный ответ увеличивает лимит на 1/limit (на единицу за «окно» запросов),
+    ответ о перегрузке уменьшает его вдвое. Уменьшение выполняется один раз на поколение:
+    ответы запросов, отправленных до предыдущего уменьшения, лимит повторно не снижают.
+    """
+    def __init__(self, initial: int, maximum: int, minimum: int = 1):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = max(maximum, initial)
+        self.in_flight = 0
+        self.generation = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, check: Callable[[], None] = None) -> int:
+        """Ожидание свободного слота, возвращает поколение лимита для release"""
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait(0.5)
+                if check:
+                    check()
+            self.in_flight += 1
+            return self.generation
+
+    def release(self, generation: int, throttled: bool):
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                if generation == self.generation:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self.generation += 1
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class RateLimiter:
+    """
+    Client-side rate limiter - Ограничение запросов к API по хосту и классу запросов
+
+    Для каждой пары (хост, класс запросов, например sales или operations) действуют
+    свой token bucket и адаптивный лимит параллельных запросов. Ответы 429/503 снижают
+    лимит, Retry-After приостанавливает весь класс запросов. Идемпотентные запросы
+    повторяются после 429/5xx и ошибок соединения с экспоненциальной задержкой со
+    случайной составляющей (не больше backoff_max) или через указанное в Retry-After
+    время (не больше retry_after_max), ответ последней попытки возвращается как есть.
+    Слот параллельности занят до получения заголовков ответа.
+    """
+    def __init__(self, rate: float = RATE_LIMIT_RPS, burst: int = RATE_LIMIT_BURST,
+                 concurrency: int = RATE_LIMIT_CONCURRENCY, max_concurrency: int = RATE_LIMIT_MAX_CONCURRENCY,
+                 attempts: int = RETRY_ATTEMPTS, backoff: float = RETRY_BACKOFF, backoff_max: float = RETRY_BACKOFF_MAX,
+                 retry_after_max: float = RETRY_AFTER_MAX):
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.max_concurrency = max_concurrency
+        self.attempts = max(attempts, 1)
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.retry_after_max = retry_after_max
+        self._limits: Dict[Tuple[str, str], Tuple[TokenBucket, AimdLimit]] = {}
+        self._lock = threading.Lock()
+        # счетчики ответов о перегрузке, повторов и запросов, не выполненных после всех попыток
+        self.stats = Counter()
+
+    def limits(self, host: str, endpoint: str) -> Tuple[TokenBucket, AimdLimit]:
+        with self._lock:
+            key = (host, endpoint)
+            if key not in self._limits:
+                self._limits[key] = (TokenBucket(self.rate, self.burst),
+                                     AimdLimit(self.concurrency, self.max_concurrency))
+            return self._limits[key]
+
+    def concurrency_limits(self) -> Dict[str, int]:
+        """Текущие лимиты параллельных запросов по классам запросов"""
+        with self._lock:
+            return {f'{host} {endpoint}': int(limit.limit) for (host, endpoint), (_, limit) in self._limits.items()}
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+
+    @staticmethod
+    def _sleep(seconds: float, check: Callable[[], None] = None):
+        """Ожидание с проверкой отмены не реже раза в полсекунды"""
+        deadline = time.monotonic() + seconds
+        while (left := deadline - time.monotonic()) > 0:
+            time.sleep(min(left, 0.5))
+            if check:
+                check()
+
+    def request(self, session: requests.Session, method: str, url: str, endpoint: str, *, retry: bool = None,
+                check: Callable[[], None] = None, **kwargs) -> requests.Response:
+        """
+        Send request under limits - Запрос с ограничением частоты и повторами
+
+        :param session: requests session
+        :param method: HTTP method
+        :param url: url for request
+        :param endpoint: class of requests with common limits
+        :param retry: retry request, by default only GET is retried
+        :param check: called while waiting, may raise to stop waiting (report cancellation)
+        :param kwargs: passed to session.request
+        :return: response of the last attempt
+        """
+        retry = method.upper() == 'GET' if retry is None else retry
+        bucket, limit = self.limits(urlparse(url).hostname, endpoint)
+        attempt = 0
+        while True:
+            self._sleep(bucket.reserve(), check)
+            generation = limit.acquire(check)
+            throttled = False
+            try:
+                response = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if not retry or attempt + 1 >= self.attempts:
+                    self.stats['failed'] += 1
+                    raise
+                delay = self._backoff(attempt)
+                logger.error(f"Ошибка соединения {endpoint}: {e}, повтор через {delay:.1f} с")
+            else:
+                throttled = response.status_code in THROTTLE_STATUSES
+                if throttled:
+                    self.stats['throttled'] += 1
+                if response.status_code not in RETRY_STATUSES or not retry or attempt + 1 >= self.attempts:
+                    if response.status_code in RETRY_STATUSES:
+                        self.stats['failed'] += 1
+                    return response
+                delay = retry_after(response)
+                if delay is not None:
+                    delay = min(delay, self.retry_after_max)
+                    # сервер просит паузу для всех запросов этого класса
+                    bucket.block(delay)
+                else:
+                    delay = self._backoff(attempt)
+                logger.info(f"Ответ {response.status_code} на {endpoint}, повтор через {delay:.1f} с")
+                response.close()
+            finally:
+                # слот освобождается и при исключениях, которые не повторяются (ReportCancelled и др.)
+                limit.release(generation, throttled)
+            self.stats['retries'] += 1
+            attempt += 1
+            self._sleep(delay, check)
+
+
+# общий для процесса ограничитель запросов к API WB
+rate_limiter = RateLimiter()
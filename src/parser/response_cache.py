@@ -0,0 +1,140 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+from utils.env import RESPONSE_CACHE_PATH, RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_BYTES, SALES_OPEN_DAYS
+from bot.logger import WBLogger
+
+logger = WBLogger(__name__).get_logger()
+
+
+def response_key(account: Any, url: str, params: Dict[str, Any]) -> str:
+    """Ключ ответа: аккаунт, url без схемы и завершающего / и параметры в порядке имен"""
+    parts = urlsplit(url)
+    normalized = f"{parts.netloc.lower()}{parts.path.rstrip('/')}"
+    items = sorted((str(name), str(value)) for name, value in (params or {}).items())
+    return hashlib.sha256(json.dumps([str(account), normalized, items]).encode()).hexdigest()
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+    # None - ответ за закрытый период, не устаревает
+    expires_at: Optional[float]
+
+    def is_fresh(self) -> bool:
+        return self.expires_at is None or time.time() < self.expires_at
+
+    def validators(self) -> Dict[str, str]:
+        """Заголовки условного запроса для проверки устаревшего ответа"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def json(self) -> Any:
+        return json.loads(self.body)
+
+
+class ResponseCache:
+    """
+    On-disk response cache - Кеш ответов API на диске (SQLite)
+
+    Ответ за закрытый период (все дни старше open_days последних дней) хранится
+    бессрочно, ответ за период с незакрытыми днями - ttl секунд. Устаревший ответ с
+    ETag или Last-Modified проверяется условным запросом, при 304 срок продлевается.
+    Тела ответов хранятся сжатыми, при превышении max_bytes удаляются давно
+    не запрашивавшиеся ответы. Счетчики попаданий и промахов - в stats.
+    """
+    def __init__(self, path: str = RESPONSE_CACHE_PATH, ttl: float = RESPONSE_CACHE_TTL,
+                 max_bytes: int = RESPONSE_CACHE_MAX_BYTES, open_days: int = SALES_OPEN_DAYS):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.open_days = open_days
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    body BLOB NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    expires_at REAL,
+                    size INTEGER NOT NULL,
+                    accessed_at REAL NOT NULL
+                )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+            self.total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def expires_at(self, date_to: Optional[str]) -> Optional[float]:
+        """Срок хранения ответа по последнему дню периода запроса"""
+        try:
+            if date.fromisoformat(str(date_to)[:10]) <= date.today() - timedelta(days=self.open_days):
+                return None
+        except ValueError:
+            pass
+        return time.time() + self.ttl
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT body, etag, last_modified, expires_at FROM responses WHERE key = ?",
+                                     (key,)).fetchone()
+            if row is None:
+                self.stats['miss'] += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        entry = CachedResponse(zlib.decompress(row[0]), *row[1:])
+        self.stats['hit' if entry.is_fresh() else 'stale'] += 1
+        return entry
+
+    def put(self, key: str, body: bytes, etag: Optional[str], last_modified: Optional[str],
+            expires_at: Optional[float]):
+        compressed = zlib.compress(body)
+        with self._lock, self._conn:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, body, etag, last_modified, expires_at, size, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, compressed, etag, last_modified, expires_at, len(compressed), time.time()))
+            self.total_bytes += len(compressed) - (old[0] if old else 0)
+            self.stats['store'] += 1
+            self._evict()
+
+    def revalidated(self, key: str, expires_at: Optional[float]):
+        """Ответ не изменился (304) - продление срока"""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE responses SET expires_at = ?, accessed_at = ? WHERE key = ?",
+                               (expires_at, time.time(), key))
+            self.stats['revalidated'] += 1
+
+    def _evict(self):
+        """Удаление давно не запрашивавшихся ответов сверх max_bytes, вызывается под блокировкой"""
+        while self.total_bytes > self.max_bytes:
+            rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at LIMIT 100").fetchall()
+            if not rows:
+                self.total_bytes = 0
+                return
+            for key, size in rows:
+                if self.total_bytes <= self.max_bytes:
+                    return
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.total_bytes -= size
+                self.stats['evicted'] += 1
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,195 @@
+from datetime import date, datetime, timedelta
+from typing import IO, Dict, Iterable, List, Sequence, Union
+import numpy as np
+from parser.api import Office, SaleBatch, to_date
+from parser.column_names import sales_summary_column_names_mapping
+from parser.columnar import ColumnBatch, integral
+from parser.csv_writer import StreamingCsvWriter
+from parser.kpi import ratio
+
+# периоды сводки: неделя с понедельника, календарный месяц, весь период отчета
+GRAINS = ('week', 'month', 'total')
+GRAIN_TITLES = {'week': 'Неделя', 'month': 'Месяц', 'total': 'Итого'}
+
+# суммируемые показатели продаж
+SUM_FIELDS = ('sale_count', 'return_count', 'sale_sum', 'return_sum', 'proceeds', 'amount', 'bags_sum',
+              'office_rating_sum', 'supplier_return_sum')
+# вспомогательные суммы для средних: дни с продажами, рейтинг и выручка дней с рейтингом
+AUX_FIELDS = ('days', 'rating_sum', 'rating_days', 'rating_proceeds', 'rated_proceeds')
+ROLLUP_FIELDS = SUM_FIELDS + AUX_FIELDS
+
+# колонки сводки по продажам
+SUMMARY_COLUMNS = ['grain', 'period_start', 'office_id', 'name', 'days', *SUM_FIELDS, 'average_rating',
+                   'weighted_rating']
+
+
+def period_start(day: Union[str, date, datetime], grain: str) -> date:
+    """Начало недели или месяца, в который входит день"""
+    day = to_date(day)
+    if grain == 'week':
+        return day - timedelta(days=day.weekday())
+    if grain == 'month':
+        return day.replace(day=1)
+    raise ValueError(f'Нет начала периода для {grain}')
+
+
+def next_period_start(day: Union[str, date, datetime], grain: str) -> date:
+    """Начало следующей недели или месяца"""
+    start = period_start(day, grain)
+    if grain == 'week':
+        return start + timedelta(days=7)
+    return (start + timedelta(days=31)).replace(day=1)
+
+
+def period_starts(days: np.ndarray, grain: str, date_from: Union[str, date, datetime] = None) -> np.ndarray:
+    """Начала периодов для массива дней datetime64[D], для total - date_from"""
+    days = np.asarray(days, dtype='datetime64[D]')
+    if grain == 'week':
+        # 1970-01-01 - четверг, понедельник имеет остаток 0
+        return days - (days.astype(np.int64) + 3) % 7
+    if grain == 'month':
+        return days.astype('datetime64[M]').astype('datetime64[D]')
+    return np.full(len(days), np.datetime64(to_date(date_from), 'D'))
+
+
+class SalesRollup:
+    """
+    Sales rollup - Суммы продаж офисов по периодам
+
+    Одна строка на (офис, начало периода), колонки ROLLUP_FIELDS - суммы, поэтому
+    сводки частей периода складываются в сводку всего периода, а вычитание сводки
+    замененных дней и прибавление сводки новых обновляет сводку без пересчета
+    остальных дней. Средний и взвешенный по выручке рейтинг считаются из сумм.
+    """
+    def __init__(self, grain: str, office_ids: np.ndarray, period_starts: np.ndarray, sums: Dict[str, np.ndarray]):
+        self.grain = grain
+        self.office_ids = office_ids
+        self.period_starts = period_starts
+        self.sums = sums
+
+    def __len__(self) -> int:
+        return len(self.office_ids)
+
+    @classmethod
+    def empty(cls, grain: str) -> 'SalesRollup':
+        return cls(grain, np.zeros(0, dtype=np.int64), np.zeros(0, dtype='datetime64[D]'),
+                   {name: np.zeros(0) for name in ROLLUP_FIELDS})
+
+    @classmethod
+    def group(cls, grain: str, office_ids: np.ndarray, starts: np.ndarray,
+              sums: Dict[str, np.ndarray]) -> 'SalesRollup':
+        """
+        Vectorized groupby - Суммирование строк с одинаковыми (офис, начало периода)
+
+        Строки сводки упорядочены по офису и началу периода.
+        """
+        office_ids = np.asarray(office_ids, dtype=np.int64)
+        starts = np.asarray(starts, dtype='datetime64[D]')
+        if not len(office_ids):
+            return cls.empty(grain)
+        # составной ключ: номер дня начала периода меньше 10^5 до 2243 года
+        keys = office_ids * 100_000 + starts.astype(np.int64)
+        unique_keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        return cls(grain, office_ids[first], starts[first],
+                   {name: np.bincount(inverse, weights=sums[name], minlength=len(unique_keys))
+                    for name in ROLLUP_FIELDS})
+
+    @classmethod
+    def from_arrays(cls, grain: str, office_ids: np.ndarray, days: np.ndarray, metrics: Dict[str, np.ndarray],
+                    date_from: Union[str, date, datetime] = None) -> 'SalesRollup':
+        """
+        Rollup of daily rows - Сводка по строкам продаж офисов за день
+
+        :param metrics: SUM_FIELDS and office_rating columns, NaN for missing values
+        :param date_from: period start for total grain
+        """
+        values = {name: np.asarray(metrics[name], dtype=np.float64) for name in SUM_FIELDS}
+        rating = np.asarray(metrics['office_rating'], dtype=np.float64)
+        rated = ~np.isnan(rating)
+        proceeds = np.nan_to_num(values['proceeds'])
+        sums = {name: np.nan_to_num(column) for name, column in values.items()}
+        sums.update({
+            'days': np.ones(len(rating)),
+            'rating_sum': np.where(rated, rating, 0.0),
+            'rating_days': rated.astype(np.float64),
+            'rating_proceeds': np.where(rated, rating * proceeds, 0.0),
+            'rated_proceeds': np.where(rated, proceeds, 0.0),
+        })
+        return cls.group(grain, office_ids, period_starts(days, grain, date_from), sums)
+
+    @classmethod
+    def from_batches(cls, batches: Iterable[ColumnBatch], grain: str,
+                     date_from: Union[str, date, datetime] = None) -> 'SalesRollup':
+        """Сводка по пачкам ParserWB.iter_sales_batches"""
+        batch = SaleBatch.concat(list(batches))
+        return cls.from_arrays(grain, batch.column('office_id'), batch.column('date'),
+                               {name: batch.column(name) for name in (*SUM_FIELDS, 'office_rating')}, date_from)
+
+    @classmethod
+    def combine(cls, rollups: Sequence['SalesRollup'], grain: str = None,
+                date_from: Union[str, date, datetime] = None) -> 'SalesRollup':
+        """
+        Combine rollups - Сложение сводок
+
+        :param grain: coarser grain to regroup periods into, e.g. total from months
+        :param date_from: period start for total grain
+        """
+        grain = grain or (rollups[0].grain if rollups else 'total')
+        rollups = [rollup for rollup in rollups if len(rollup)]
+        if not rollups:
+            return cls.empty(grain)
+        starts = np.concatenate([rollup.period_starts for rollup in rollups])
+        if grain != rollups[0].grain:
+            starts = period_starts(starts, grain, date_from)
+        return cls.group(grain, np.concatenate([rollup.office_ids for rollup in rollups]), starts,
+                         {name: np.concatenate([rollup.sums[name] for rollup in rollups]) for name in ROLLUP_FIELDS})
+
+    def negate(self) -> 'SalesRollup':
+        """Сводка с обратным знаком для вычитания"""
+        return SalesRollup(self.grain, self.office_ids, self.period_starts,
+                           {name: -values for name, values in self.sums.items()})
+
+    def take(self, indices: np.ndarray) -> 'SalesRollup':
+        return SalesRollup(self.grain, self.office_ids[indices], self.period_starts[indices],
+                           {name: values[indices] for name, values in self.sums.items()})
+
+    def average_rating(self) -> np.ndarray:
+        """Средний рейтинг офиса по дням с рейтингом"""
+        return ratio(self.sums['rating_sum'], self.sums['rating_days'])
+
+    def weighted_rating(self) -> np.ndarray:
+        """Рейтинг офиса, взвешенный по выручке дней"""
+        return ratio(self.sums['rating_proceeds'], self.sums['rated_proceeds'])
+
+
+def write_summary_csv(rollups: Sequence[SalesRollup], filename: Union[str, IO[bytes]],
+                      offices: Sequence[Office] = ()) -> int:
+    """
+    Write sales summary to csv - Запись сводки по продажам
+
+    Сводки идут в переданном порядке, внутри сводки - офисы в порядке offices (остальные
+    после них) и периоды по возрастанию. Суммы округляются до копеек.
+
+    :param rollups: e.g. weekly, monthly and total rollups of one period
+    :param offices: offices for names and order
+    :return: number of written rows
+    """
+    names = {office.id: office.name for office in offices}
+    order = {office_id: position for position, office_id in enumerate(names)}
+    columns: Dict[str, List] = {name: [] for name in SUMMARY_COLUMNS}
+    for rollup in rollups:
+        positions = np.array([order.get(office_id, len(order)) for office_id in rollup.office_ids.tolist()],
+                             dtype=np.int64)
+        rollup = rollup.take(np.lexsort((rollup.period_starts, rollup.office_ids, positions)))
+        office_ids = rollup.office_ids.tolist()
+        columns['grain'] += [GRAIN_TITLES[rollup.grain]] * len(office_ids)
+        columns['period_start'] += np.datetime_as_string(rollup.period_starts, unit='D').tolist()
+        columns['office_id'] += office_ids
+        columns['name'] += [names.get(office_id) for office_id in office_ids]
+        for name in ('days', *SUM_FIELDS):
+            columns[name] += integral(np.round(rollup.sums[name], 2).tolist())
+        columns['average_rating'] += integral(np.round(rollup.average_rating(), 4).tolist())
+        columns['weighted_rating'] += integral(np.round(rollup.weighted_rating(), 4).tolist())
+    writer = StreamingCsvWriter(filename, column_names_mapping=sales_summary_column_names_mapping,
+                                columns=SUMMARY_COLUMNS)
+    return writer.write_tuples(zip(*(columns[name] for name in SUMMARY_COLUMNS)))
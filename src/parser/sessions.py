@@ -0,0 +1,175 @@
+import threading
+from collections import Counter
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import PoolManager
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from utils.env import HTTP_POOL_SIZE, HTTP_POOL_SIZES, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT
+from bot.logger import WBLogger
+
+logger = WBLogger(__name__).get_logger()
+
+
+def parse_pool_sizes(value: str) -> Dict[str, int]:
+    """Размеры пулов по хостам из строки вида 'host=size,host=size'"""
+    sizes = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            host, size = item.split('=', 1)
+            sizes[host.strip()] = int(size)
+    return sizes
+
+
+class TransportStats:
+    """Счетчики запросов и открытых соединений по хостам"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = Counter()
+        self.connections = Counter()
+
+    def request(self, host: str):
+        with self._lock:
+            self.requests[host] += 1
+
+    def connection(self, host: str):
+        with self._lock:
+            self.connections[host] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        """
+        Connection reuse by host - Переиспользование соединений по хостам
+
+        :return: host -> requests, opened connections and requests sent over reused connections
+        """
+        with self._lock:
+            return {host: {'requests': count, 'connections': self.connections[host],
+                           'reused': max(count - self.connections[host], 0)}
+                    for host, count in self.requests.items()}
+
+
+class _CountingPool:
+    """Пул соединений urllib3, учитывающий каждое новое соединение"""
+    stats: Optional[TransportStats] = None
+
+    def _new_conn(self):
+        if self.stats is not None:
+            self.stats.connection(self.host)
+        return super()._new_conn()
+
+
+class CountingHTTPConnectionPool(_CountingPool, HTTPConnectionPool):
+    pass
+
+
+class CountingHTTPSConnectionPool(_CountingPool, HTTPSConnectionPool):
+    pass
+
+
+class HostPoolManager(PoolManager):
+    """PoolManager с размером пула соединений по хосту"""
+    def __init__(self, stats: TransportStats, pool_sizes: Dict[str, int], **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+        self.pool_sizes = pool_sizes
+        self.pool_classes_by_scheme = {'http': CountingHTTPConnectionPool, 'https': CountingHTTPSConnectionPool}
+
+    def _new_pool(self, scheme, host, port, request_context=None):
+        if request_context is None:
+            request_context = self.connection_pool_kw.copy()
+        if host in self.pool_sizes:
+            request_context['maxsize'] = self.pool_sizes[host]
+        pool = super()._new_pool(scheme, host, port, request_context)
+        pool.stats = self.stats
+        return pool
+
+
+class PooledAdapter(HTTPAdapter):
+    """
+    Transport adapter - Адаптер с пулами по хостам, таймаутами по умолчанию и статистикой
+
+    Запрос без явного timeout получает (connect, read) таймаут адаптера.
+    """
+    def __init__(self, stats: TransportStats, pool_size: int = HTTP_POOL_SIZE,
+                 pool_sizes: Dict[str, int] = None, timeout: Tuple[float, float] = None):
+        # init_poolmanager вызывается из конструктора HTTPAdapter
+        self.stats = stats
+        self.pool_sizes = pool_sizes or {}
+        self.timeout = timeout or (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+        super().__init__(pool_connections=max(10, len(self.pool_sizes)), pool_maxsize=pool_size)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        self.poolmanager = HostPoolManager(self.stats, self.pool_sizes, num_pools=connections,
+                                           maxsize=maxsize, block=block, **pool_kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        self.stats.request(urlparse(request.url).hostname)
+        return super().send(request, timeout=timeout if timeout is not None else self.timeout, **kwargs)
+
+
+class SessionToken:
+    """
+    Shared session token state - Версия токена общей сессии и блокировка его обновления
+
+    Хранится рядом с сессией, поэтому все клиенты одной сессии обновляют токен по
+    очереди и один раз на все запросы, получившие 401 со старым токеном.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.version = 0
+
+
+class SessionRegistry:
+    """
+    Shared HTTP sessions - Общие HTTP сессии по аккаунтам поверх одного транспорта
+
+    Сессия (заголовки авторизации, cookies) хранится по ключу аккаунта и переиспользуется
+    всеми отчетами этого аккаунта. Пулы keep-alive соединений общие для всех сессий
+    и ограничены по хостам, поэтому соединения с API не открываются заново для каждой
+    авторизации и отчета. Ответы запрашиваются со сжатием gzip/deflate.
+    """
+    def __init__(self, pool_size: int = HTTP_POOL_SIZE, pool_sizes: Dict[str, int] = None,
+                 timeout: Tuple[float, float] = None):
+        self.transport_stats = TransportStats()
+        if pool_sizes is None:
+            pool_sizes = parse_pool_sizes(HTTP_POOL_SIZES)
+        self.adapter = PooledAdapter(self.transport_stats, pool_size=pool_size, pool_sizes=pool_sizes,
+                                     timeout=timeout)
+        self._sessions: Dict[str, requests.Session] = {}
+        self._tokens: Dict[str, SessionToken] = {}
+        self._lock = threading.Lock()
+
+    def session(self, key: str) -> requests.Session:
+        """Сессия аккаунта, создается при первом обращении"""
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                session.mount('http://', self.adapter)
+                session.mount('https://', self.adapter)
+                session.headers['Accept-Encoding'] = 'gzip, deflate'
+                self._sessions[key] = session
+            return session
+
+    def token(self, key: str) -> SessionToken:
+        """Состояние токена сессии key, общее для всех ее клиентов"""
+        with self._lock:
+            return self._tokens.setdefault(key, SessionToken())
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return self.transport_stats.snapshot()
+
+    def close(self):
+        """Закрытие всех соединений"""
+        with self._lock:
+            self._sessions.clear()
+            self._tokens.clear()
+        self.adapter.close()
+
+
+# общий для процесса реестр сессий
+session_registry = SessionRegistry()
@@ -0,0 +1,73 @@
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+from bot.logger import WBLogger
+
+logger = WBLogger(__name__).get_logger()
+
+
+class _Call:
+    """Выполняемый запрос и его результат"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Request coalescing - Объединение одинаковых одновременных запросов
+
+    Первый вызов do с ключом выполняет функцию, вызовы с тем же ключом до ее
+    завершения ждут и получают тот же результат или то же исключение. Результат
+    общий для всех ожидающих и не должен изменяться. Если выполнявший запрос отчет
+    был отменен (исключение не наследует Exception), ожидающие повторяют запрос сами.
+    """
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        # выполненные и полученные от другого потока результаты
+        self.stats = Counter()
+
+    def do(self, key: Hashable, func: Callable[[], Any],
+           check: Callable[[], None] = None) -> Tuple[Any, bool]:
+        """
+        Run func once for concurrent callers - Выполнение func один раз на всех одновременных вызывающих
+
+        :param key: identity of request
+        :param func: request function
+        :param check: called while waiting, may raise to stop waiting (report cancellation)
+        :return: (result, shared) - shared is True if result was produced by another caller
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+            if leader:
+                try:
+                    call.result = func()
+                except BaseException as e:
+                    call.error = e
+                    raise
+                finally:
+                    with self._lock:
+                        del self._calls[key]
+                    call.done.set()
+                self.stats['executed'] += 1
+                return call.result, False
+            while not call.done.wait(0.5):
+                if check:
+                    check()
+            if call.error is None:
+                self.stats['shared'] += 1
+                return call.result, True
+            if isinstance(call.error, Exception):
+                self.stats['shared_error'] += 1
+                raise call.error
+            logger.info("Coalesced request was cancelled by its leader, retrying")
+
+
+# общий для процесса реестр выполняемых запросов
+single_flight = SingleFlight()
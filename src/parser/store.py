@@ -0,0 +1,216 @@
+import json
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Tuple, Iterable
+from utils.env import LOCAL_STORE_PATH, SALES_OPEN_DAYS, WARM_DATA_TTL, FRESH_DATA_TTL
+from bot.logger import WBLogger
+
+logger = WBLogger(__name__).get_logger()
+
+
+def date_range(date_from: date, date_to: date) -> Iterable[date]:
+    """Перебор дней от date_from до date_to включительно"""
+    day = date_from
+    while day <= date_to:
+        yield day
+        day += timedelta(days=1)
+
+
+def day_ranges(date_from: date, date_to: date, is_stored: Callable[[date], bool]) -> List[Tuple[date, date]]:
+    """Непрерывные диапазоны дней, для которых is_stored вернул False"""
+    ranges = []
+    for day in date_range(date_from, date_to):
+        if is_stored(day):
+            continue
+        if ranges and ranges[-1][1] == day - timedelta(days=1):
+            ranges[-1] = (ranges[-1][0], day)
+        else:
+            ranges.append((day, day))
+    return ranges
+
+
+class DayFreshness:
+    """
+    Daily data freshness rules - Общие правила актуальности дневных данных
+
+    Закрытый день (старше open_days последних дней) после загрузки не меняется.
+    Незакрытый прошедший день считается прогретым, если загружен после его окончания
+    и не раньше warm_ttl секунд назад, например ночной задачей планировщика.
+    Любой день, включая сегодняшний, не запрашивается повторно fresh_ttl секунд
+    после загрузки, например фоновой предзагрузкой после авторизации.
+    """
+    def __init__(self, open_days: int = SALES_OPEN_DAYS, warm_ttl: float = WARM_DATA_TTL,
+                 fresh_ttl: float = FRESH_DATA_TTL):
+        self.open_days = open_days
+        self.warm_ttl = warm_ttl
+        self.fresh_ttl = fresh_ttl
+
+    def is_closed(self, day: date) -> bool:
+        """День закрыт, если он старше open_days последних дней"""
+        return day <= date.today() - timedelta(days=self.open_days)
+
+    def is_reusable(self, day: date, fetched_at: float) -> bool:
+        """Сохраненные данные за день можно отдать без запроса к API"""
+        if self.is_closed(day) or time.time() - fetched_at < self.fresh_ttl:
+            return True
+        day_end = datetime.combine(day + timedelta(days=1), datetime.min.time()).timestamp()
+        return fetched_at >= day_end and time.time() - fetched_at < self.warm_ttl
+
+
+class DailyStore(DayFreshness):
+    """Base for local daily stores - Общая основа локальных хранилищ дневных данных (SQLite)"""
+    def __init__(self, path: str = LOCAL_STORE_PATH, open_days: int = SALES_OPEN_DAYS,
+                 warm_ttl: float = WARM_DATA_TTL, fresh_ttl: float = FRESH_DATA_TTL):
+        super().__init__(open_days=open_days, warm_ttl=warm_ttl, fresh_ttl=fresh_ttl)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._create_tables()
+
+    def _create_tables(self):
+        raise NotImplementedError
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SalesStore(DailyStore):
+    """
+    Local store for daily sales - Локальное хранилище дневных данных по продажам (SQLite)
+
+    Закрытые дни по офису после загрузки не меняются, поэтому повторно запрашиваются
+    только отсутствующие дни и последние open_days дней, кроме прогретых.
+    """
+    SALE_COLUMNS = ('office_id', 'name', 'date', 'sale_sum', 'sale_count', 'return_sum', 'return_count',
+                    'proceeds', 'amount', 'bags_sum', 'office_rating', 'percent', 'office_rating_sum',
+                    'supplier_return_sum')
+
+    def _create_tables(self):
+        with self._lock, self._conn:
+            self._conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS sales_days (
+                    supplier_id INTEGER NOT NULL,
+                    {', '.join(self.SALE_COLUMNS)},
+                    PRIMARY KEY (supplier_id, office_id, date)
+                )""")
+            # дни, по которым данные уже получены (в том числе дни без продаж)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS sales_coverage (
+                    supplier_id INTEGER NOT NULL,
+                    office_id INTEGER NOT NULL,
+                    date TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    PRIMARY KEY (supplier_id, office_id, date)
+                )""")
+
+    def missing_ranges(self, supplier_id: int, office_id: int,
+                       date_from: date, date_to: date) -> List[Tuple[date, date]]:
+        """
+        Get date ranges to fetch - Получение диапазонов дат, которые нужно запросить у API
+
+        :return: list of (date_from, date_to) contiguous ranges
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT date, fetched_at FROM sales_coverage "
+                "WHERE supplier_id = ? AND office_id = ? AND date BETWEEN ? AND ?",
+                (supplier_id, office_id, date_from.isoformat(), date_to.isoformat())).fetchall()
+        covered = dict(rows)
+        return day_ranges(date_from, date_to,
+                          lambda day: day.isoformat() in covered and self.is_reusable(day, covered[day.isoformat()]))
+
+    def load(self, supplier_id: int, office_id: int, date_from: date, date_to: date) -> List[dict]:
+        """Get stored sales rows for office - Получение сохраненных строк по офису, отсортированных по дате"""
+        with self._lock:
+            cursor = self._conn.execute(
+                f"SELECT {', '.join(self.SALE_COLUMNS)} FROM sales_days "
+                f"WHERE supplier_id = ? AND office_id = ? AND date BETWEEN ? AND ? ORDER BY date",
+                (supplier_id, office_id, date_from.isoformat(), date_to.isoformat()))
+            return [dict(zip(self.SALE_COLUMNS, row)) for row in cursor.fetchall()]
+
+    def save(self, supplier_id: int, office_id: int, date_from: date, date_to: date, rows: List[dict]):
+        """
+        Save fetched sales rows - Сохранение полученных строк по офису за диапазон дат
+
+        Строки за диапазон заменяются целиком, дни диапазона отмечаются как полученные.
+        """
+        fetched_at = time.time()
+        values = []
+        for row in rows:
+            row = dict(row)
+            if isinstance(row['date'], datetime):
+                row['date'] = row['date'].date().isoformat()
+            values.append((supplier_id, *[row[column] for column in self.SALE_COLUMNS]))
+        placeholders = ', '.join('?' * (len(self.SALE_COLUMNS) + 1))
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM sales_days WHERE supplier_id = ? AND office_id = ? AND date BETWEEN ? AND ?",
+                               (supplier_id, office_id, date_from.isoformat(), date_to.isoformat()))
+            self._conn.executemany(
+                f"INSERT INTO sales_days (supplier_id, {', '.join(self.SALE_COLUMNS)}) VALUES ({placeholders})", values)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO sales_coverage (supplier_id, office_id, date, fetched_at) VALUES (?, ?, ?, ?)",
+                [(supplier_id, office_id, day.isoformat(), fetched_at) for day in date_range(date_from, date_to)])
+        logger.info(f'Сохранены данные по продажам офиса {office_id} за {date_from} - {date_to}: {len(values)} строк')
+
+
+class DayStore(DailyStore):
+    """
+    Local store for daily API payloads - Локальное хранилище дневных ответов API (SQLite)
+
+    Элементы ответа хранятся в json по (вид данных, supplier_id, ключ, дата). Ключ
+    отличает запросы с разными параметрами, например разные наборы сотрудников.
+    Дни без данных тоже сохраняются, чтобы не запрашивать их повторно.
+    """
+    def _create_tables(self):
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS day_payloads (
+                    kind TEXT NOT NULL,
+                    supplier_id INTEGER NOT NULL,
+                    key TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    PRIMARY KEY (kind, supplier_id, key, date)
+                )""")
+
+    def missing_ranges(self, kind: str, supplier_id: int, key: str,
+                       date_from: date, date_to: date) -> List[Tuple[date, date]]:
+        """Get date ranges to fetch - Диапазоны дат, которые нужно запросить у API"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT date, fetched_at FROM day_payloads "
+                "WHERE kind = ? AND supplier_id = ? AND key = ? AND date BETWEEN ? AND ?",
+                (kind, supplier_id, key, date_from.isoformat(), date_to.isoformat())).fetchall()
+        covered = dict(rows)
+        return day_ranges(date_from, date_to,
+                          lambda day: day.isoformat() in covered and self.is_reusable(day, covered[day.isoformat()]))
+
+    def load(self, kind: str, supplier_id: int, key: str, date_from: date, date_to: date) -> List[Tuple[str, Any]]:
+        """Get stored payloads - Сохраненные данные по дням, отсортированные по дате"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT date, payload FROM day_payloads "
+                "WHERE kind = ? AND supplier_id = ? AND key = ? AND date BETWEEN ? AND ? ORDER BY date",
+                (kind, supplier_id, key, date_from.isoformat(), date_to.isoformat())).fetchall()
+        return [(day, json.loads(payload)) for day, payload in rows]
+
+    def save(self, kind: str, supplier_id: int, key: str, date_from: date, date_to: date,
+             payloads: Dict[str, Any], empty: Any = None):
+        """
+        Save fetched payloads - Сохранение данных за диапазон дат
+
+        :param payloads: payload by date string YYYY-MM-DD
+        :param empty: payload for days of range without data
+        """
+        fetched_at = time.time()
+        values = [(kind, supplier_id, key, day.isoformat(), json.dumps(payloads.get(day.isoformat(), empty)), fetched_at)
+                  for day in date_range(date_from, date_to)]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO day_payloads (kind, supplier_id, key, date, payload, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", values)
+        logger.info(f'Сохранены данные {kind} за {date_from} - {date_to}: {len(payloads)} дней с данными')
@@ -0,0 +1,139 @@
+import glob
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional
+from utils.env import TOKEN_STORE_PATH, ACCESS_TOKEN_TTL, TOKEN_REFRESH_MARGIN
+from bot.logger import WBLogger
+
+logger = WBLogger(__name__).get_logger()
+
+# файлы refresh токенов прежнего формата: refresh_token_{phone}_{timestamp}.txt
+LEGACY_TOKEN_PATTERN = 'refresh_token_*_*.txt'
+
+
+@dataclass
+class Tokens:
+    """Токены аккаунта ЛК Франшизы"""
+    phone: str
+    access_token: Optional[str]
+    refresh_token: str
+    # время окончания действия access токена, unix time
+    expires_at: float
+
+    def is_access_valid(self, margin: float = TOKEN_REFRESH_MARGIN) -> bool:
+        """access токен действует еще не меньше margin секунд"""
+        return bool(self.access_token) and time.time() + margin < self.expires_at
+
+
+class TokenStore:
+    """
+    Token store - Хранилище access и refresh токенов по телефону (SQLite)
+
+    Действующий access токен переиспользуется без запросов к серверу авторизации,
+    за margin секунд до истечения он обновляется по refresh токену. Обновление по
+    одному телефону выполняется под lock(phone), чтобы параллельные отчеты одного
+    аккаунта делали один запрос токена. При создании в хранилище переносятся
+    refresh токены из файлов прежнего формата.
+    """
+    def __init__(self, path: str = TOKEN_STORE_PATH, legacy_dir: Optional[str] = '.'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._phone_locks: Dict[str, threading.Lock] = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS tokens (
+                    phone TEXT PRIMARY KEY,
+                    access_token TEXT,
+                    refresh_token TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )""")
+        if legacy_dir is not None:
+            self.migrate_legacy_files(legacy_dir)
+
+    def lock(self, phone: str) -> threading.Lock:
+        """Блокировка обновления токенов телефона"""
+        with self._lock:
+            return self._phone_locks.setdefault(phone, threading.Lock())
+
+    def get(self, phone: str) -> Optional[Tokens]:
+        with self._lock:
+            row = self._conn.execute("SELECT phone, access_token, refresh_token, expires_at FROM tokens "
+                                     "WHERE phone = ?", (phone,)).fetchone()
+        return Tokens(*row) if row else None
+
+    def save(self, phone: str, access_token: Optional[str], refresh_token: str,
+             expires_in: Optional[float] = ACCESS_TOKEN_TTL):
+        """
+        Save tokens - Сохранение токенов после входа по коду или обновления
+
+        :param expires_in: access token lifetime in seconds from token response
+        """
+        now = time.time()
+        expires_at = now + expires_in if access_token else 0
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tokens (phone, access_token, refresh_token, expires_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)", (phone, access_token, refresh_token, expires_at, now))
+
+    def delete(self, phone: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM tokens WHERE phone = ?", (phone,))
+        logger.info(f"Tokens for {phone} are removed")
+
+    def phones(self) -> List[str]:
+        """Телефоны, для которых сохранен refresh токен"""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT phone FROM tokens ORDER BY phone")]
+
+    def migrate_legacy_files(self, directory: str = '.'):
+        """
+        Import legacy token files - Перенос refresh токенов из файлов refresh_token_{phone}_{timestamp}.txt
+
+        Берется последний файл по телефону, если в хранилище токенов для него еще нет.
+        Перенесенные файлы удаляются.
+        """
+        latest: Dict[str, str] = {}
+        for filename in sorted(glob.glob(os.path.join(directory, LEGACY_TOKEN_PATTERN)), key=_legacy_file_time):
+            latest[os.path.basename(filename).split('_')[2]] = filename
+        for phone, filename in latest.items():
+            try:
+                if self.get(phone) is None:
+                    with open(filename, 'r') as f:
+                        self.save(phone, None, f.read().strip())
+                for legacy_file in glob.glob(os.path.join(directory, f'refresh_token_{phone}_*.txt')):
+                    os.remove(legacy_file)
+                logger.info(f"Refresh token of {phone} is moved to token store")
+            except Exception as e:
+                logger.error(f"Error while migrating refresh token file {filename}: {e}")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _legacy_file_time(filename: str) -> float:
+    """Время создания токена из имени файла, при другом формате имени - время создания файла"""
+    try:
+        stamp = os.path.basename(filename)[:-len('.txt')].split('_', 3)[3]
+        return datetime.strptime(stamp, "%d-%m-%Y_%H:%M:%S").timestamp()
+    except (IndexError, ValueError):
+        return os.path.getctime(filename)
+
+
+_default_store: Optional[TokenStore] = None
+_default_store_lock = threading.Lock()
+
+
+def default_token_store() -> TokenStore:
+    """Общее для процесса хранилище токенов, создается при первом обращении"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = TokenStore()
+        return _default_store
@@ -0,0 +1,56 @@
+from collections import Counter
+from datetime import date, timedelta
+from typing import Iterable, Optional
+from parser.api import ParserWB
+from parser.auth_fr import Auth
+from parser.store import SalesStore, DayStore
+from bot.logger import WBLogger
+
+logger = WBLogger(__name__).get_logger()
+
+
+def warm_account(session, day: date, sales_store: SalesStore, day_store: DayStore) -> Counter:
+    """
+    Prefetch one day of account data - Прогрев локальных хранилищ данными аккаунта за день
+
+    Продажи по всем офисам, операции и операции сотрудников за day загружаются
+    в локальные хранилища, после чего отчеты за последние дни строятся из них.
+
+    :param session: authorized franchise session
+    :param day: day to prefetch, usually yesterday
+    :return: request counts to WB API
+    """
+    parser = ParserWB(session, sales_store=sales_store, day_store=day_store)
+    parser.fetch_offices()
+    parser.fetch_employees()
+    for _ in parser.iter_sales_batches(date_from=day, date_to=day):
+        pass
+    for _ in parser.iter_operation_batches(date_from=day, date_to=day):
+        pass
+    for _ in parser.iter_employee_operation_batches(date_from=day, date_to=day):
+        pass
+    return parser.request_counts
+
+
+def warm_accounts(phones: Iterable[str], sales_store: SalesStore, day_store: DayStore,
+                  day: Optional[date] = None):
+    """
+    Prefetch yesterday for accounts - Ночной прогрев данных по аккаунтам
+
+    Используются только сохраненные refresh токены, аккаунты без действующего
+    токена пропускаются: запросить код из ЛК в фоне невозможно.
+
+    :param phones: account phones
+    :param day: day to prefetch, defaults to yesterday
+    """
+    day = day or date.today() - timedelta(days=1)
+    for phone in phones:
+        try:
+            session = Auth().get_saved_session(phone)
+            if session is None:
+                logger.error(f'Прогрев данных пропущен для {phone}: нет действующего токена')
+                continue
+            counts = warm_account(session, day, sales_store, day_store)
+            logger.info(f'Прогреты данные {phone} за {day}: {dict(counts)}')
+        except Exception as e:
+            logger.error(f'Ошибка прогрева данных для {phone}: {e}')
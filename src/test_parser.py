@@ -3,6 +3,7 @@ from datetime import datetime, timedelta
 from parser.api import ParserWB
 from parser.auth_fr import Auth
 from parser.auth_api import AuthApi
+from parser.employees import attach_entry_barcodes
 
 
 def main():
@@ -30,25 +31,9 @@ def main():
     operations_data = parser.fetch_employee_data(date_from, date_to)
     api_parser = AuthApi()
     api_parser.get_token()
-    for employee in operations_data:
-        phone_number = employee.get('phone')
-        api_data = api_parser.get_employee_data(phone_number)
-        if api_data:
-            for day in api_data:
-                print('API is not None')
-                api_date = day.get('date_created').split('T')[0]  # получаем только дату записи входа
-                api_barcode = day.get('barcode')  # получаем ШК офиса
-                # перебираем все операции сотрудника по датам
-                for operation in employee.get('operations'):
-                    operation_date = operation.date
-                    if api_date == operation_date:
-                        operation.barcode = api_barcode
-                # employee['operations'] = [
-                #     operation.set_barcode(api_barcode)
-                #     if operation and operation.date == api_date
-                #     else operation
-                #     for operation in employee.get('operations')
-                # ]
+    entries_by_phone = api_parser.get_employees_data(employee.get('phone') for employee in operations_data)
+    # проставляем ШК офиса по журналу входов по (телефон, дата)
+    attach_entry_barcodes(operations_data, entries_by_phone)
 
     print('Begin to save to csv')
     parser.save_to_csv_mananagers_operations(data=operations_data, filename=f"operations_data_{date_from} - {date_to} - {phone_number}.csv",)
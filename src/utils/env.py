@@ -17,17 +17,88 @@ date_to = os.getenv('DATE_TO')
 GET_EVENTS_LK_URL = os.getenv('GET_EVENTS_LK_URL')
 LOGIN_FR_URL = os.getenv('LOGIN_FR_URL')
 TOKEN_URL = os.getenv('TOKEN_URL')
+# хранилище access и refresh токенов ЛК Франшизы
+TOKEN_STORE_PATH = os.getenv('TOKEN_STORE_PATH', 'tokens.db')
+# время жизни access токена в секундах, если сервер не вернул expires_in
+ACCESS_TOKEN_TTL = int(os.getenv('ACCESS_TOKEN_TTL', 3600))
+# за сколько секунд до истечения access токен обновляется заранее
+TOKEN_REFRESH_MARGIN = int(os.getenv('TOKEN_REFRESH_MARGIN', 300))
+# количество параллельных запросов к API WB
+FETCH_WORKERS = int(os.getenv('FETCH_WORKERS', 8))
+# размер пула keep-alive соединений на хост и переопределения по хостам в виде host=size,host=size
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 32))
+HTTP_POOL_SIZES = os.getenv('HTTP_POOL_SIZES', '')
+# таймауты соединения и чтения ответа в секундах
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 60))
+# ограничение запросов к API по хосту и классу запросов: запросов в секунду и подряд
+RATE_LIMIT_RPS = float(os.getenv('RATE_LIMIT_RPS', 50))
+RATE_LIMIT_BURST = int(os.getenv('RATE_LIMIT_BURST', 50))
+# начальный и максимальный адаптивный лимит параллельных запросов
+RATE_LIMIT_CONCURRENCY = int(os.getenv('RATE_LIMIT_CONCURRENCY', 16))
+RATE_LIMIT_MAX_CONCURRENCY = int(os.getenv('RATE_LIMIT_MAX_CONCURRENCY', 64))
+# количество попыток GET запроса и задержки между ними в секундах
+RETRY_ATTEMPTS = int(os.getenv('RETRY_ATTEMPTS', 5))
+RETRY_BACKOFF = float(os.getenv('RETRY_BACKOFF', 0.5))
+RETRY_BACKOFF_MAX = float(os.getenv('RETRY_BACKOFF_MAX', 30))
+# наибольшая пауза по заголовку Retry-After в секундах
+RETRY_AFTER_MAX = float(os.getenv('RETRY_AFTER_MAX', 600))
+# время жизни снимка /account в секундах
+ACCOUNT_TTL = int(os.getenv('ACCOUNT_TTL', 300))
+# локальное хранилище загруженных данных
+LOCAL_STORE_PATH = os.getenv('LOCAL_STORE_PATH', 'local_store.db')
+# количество последних дней, данные по которым еще могут измениться
+SALES_OPEN_DAYS = int(os.getenv('SALES_OPEN_DAYS', 3))
+# время в секундах, в течение которого прогретые после окончания дня данные не запрашиваются повторно
+WARM_DATA_TTL = int(os.getenv('WARM_DATA_TTL', 86400))
+# время в секундах, в течение которого данные за незакрытые дни, в том числе сегодня, не запрашиваются повторно
+FRESH_DATA_TTL = int(os.getenv('FRESH_DATA_TTL', 600))
+# количество последних дней продаж, загружаемых в фоне сразу после авторизации
+PREFETCH_DAYS = int(os.getenv('PREFETCH_DAYS', 7))
+# кеш ответов API: путь, время жизни ответов за незакрытые дни в секундах, предельный размер в байтах
+RESPONSE_CACHE_PATH = os.getenv('RESPONSE_CACHE_PATH', 'response_cache.db')
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 300))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+# размер пачки строк при потоковой записи csv
+CSV_CHUNK_SIZE = int(os.getenv('CSV_CHUNK_SIZE', 10000))
+# размер окна дат в днях при запросе операций
+OPERATIONS_WINDOW_DAYS = int(os.getenv('OPERATIONS_WINDOW_DAYS', 31))
+# размер куска ответа в байтах при потоковом разборе json
+JSON_STREAM_CHUNK_SIZE = int(os.getenv('JSON_STREAM_CHUNK_SIZE', 65536))
 
 # FastAPI
 API_URL = os.getenv('API_URL')
 BASIC_API = os.getenv('BASIC_API')
 TOKEN_URL_FASTAPI = os.getenv('TOKEN_URL_FASTAPI')
 EMPLOYEE_URL = os.getenv('EMPLOYEE_URL')
+# количество параллельных запросов журнала входов сотрудников
+ENTRY_LOG_WORKERS = int(os.getenv('ENTRY_LOG_WORKERS', 16))
 
 
 
 # Telegram
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
+# количество одновременно формируемых отчетов всего и на одного пользователя
+REPORT_WORKERS = int(os.getenv('REPORT_WORKERS', 4))
+REPORTS_PER_USER = int(os.getenv('REPORTS_PER_USER', 1))
+# потоки фоновой предзагрузки данных после авторизации, отдельно от потоков отчетов
+PREFETCH_WORKERS = int(os.getenv('PREFETCH_WORKERS', 2))
+# минимальный интервал обновления сообщения о прогрессе отчета в секундах
+REPORT_PROGRESS_INTERVAL = float(os.getenv('REPORT_PROGRESS_INTERVAL', 2))
+# количество хранимых завершенных задач отчетов на пользователя
+REPORT_JOBS_HISTORY = int(os.getenv('REPORT_JOBS_HISTORY', 5))
+# размер буфера отчета в памяти, больше - во временном файле
+REPORT_SPOOL_SIZE = int(os.getenv('REPORT_SPOOL_SIZE', 16 * 1024 * 1024))
+# ограничение размера файла для отправки ботом (50 МБ в Bot API)
+REPORT_UPLOAD_LIMIT = int(os.getenv('REPORT_UPLOAD_LIMIT', 50 * 1000 * 1000))
+# отчеты меньше этого размера отправляются без сжатия
+REPORT_COMPRESS_MIN_SIZE = int(os.getenv('REPORT_COMPRESS_MIN_SIZE', 1024 * 1024))
+# время ночного прогрева данных и отправки отчетов по подпискам (HH:MM)
+SCHEDULE_WARM_TIME = os.getenv('SCHEDULE_WARM_TIME', '03:00')
+SCHEDULE_REPORT_TIME = os.getenv('SCHEDULE_REPORT_TIME', '08:00')
+
+# окно скользящих сумм в отчете KPI менеджеров, дней
+KPI_WINDOW_DAYS = int(os.getenv('KPI_WINDOW_DAYS', 7))
 
 # ADMINS
 ADMINS_STRING = os.getenv('ADMINS')
@@ -40,6 +111,12 @@ POSTGRES_SERVER = os.getenv('POSTGRES_HOST', 'employee-db')
 POSTGRES_PORT = os.getenv('POSTGRES_PORT', 5432)
 POSTGRES_DB = os.getenv('POSTGRES_DB')
 DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_SERVER}:{POSTGRES_PORT}/{POSTGRES_DB}"
+# хранилище загруженных данных: DATABASE_URL для PostgreSQL или локальный SQLite
+WAREHOUSE_URL = os.getenv('WAREHOUSE_URL', 'sqlite:///warehouse.db')
+# размер пачки строк при загрузке в хранилище
+WAREHOUSE_BATCH_SIZE = int(os.getenv('WAREHOUSE_BATCH_SIZE', 5000))
 
 
 
+# 1 - отчеты бота строятся запросами к хранилищу, 0 - каждый раз выгружаются из API
+WAREHOUSE_REPORTS = int(os.getenv('WAREHOUSE_REPORTS', 1))